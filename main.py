@@ -2,6 +2,9 @@
 TeraBox Uploader CLI: main.py
 Python CLI tool to make uploads to your Terabox cloud from any Linux or Windows environment
 without having to use the website.
+The upload logic lives in the modules folder (TeraboxClient and Uploader), so it can also be used from other
+Python programs. This file only implements the command line interface. The modules needed by a command are only
+imported when that command runs, so the help and setup commands start quickly.
 
 This program is provided as-is, without any warranty.
 This program is not affiliated with Terabox in any way.
@@ -12,41 +15,65 @@ For more information, please visit https://github.com/dnigamer/TeraboxUploaderCL
 If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
 """
 
-import fnmatch
-import math
 import os
 import sys
 import json
-import subprocess
-import hashlib
-import zipfile
-from urllib.parse import quote_plus
-import requests
-from typing import Optional
 import base64
 
-from modules.encryption import Encryption, FileEncryptedException
 from modules.formatting import Formatting
+from modules.logbackend import LogBackend, LogSettingException, get_backend, set_backend
 
 CODE_VERSION = "1.8.1"
 fmt = Formatting(timestamps=True)
 
-print("-" * 97)
-print(f"Terabox Uploader CLI v{CODE_VERSION} 2025")
-print("* Developed by Gonçalo M. (@dnigamer in Github).")
-print("* For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI.")
-print("* If you find any bugs, please open an issue in the Github repository mentioned in the link above")
-print("-" * 97)
-print("! This program is licensed under the MIT License.")
-print("! This program is provided as-is, without any warranty.")
-print("! This program is not affiliated with Terabox in any way.")
-print("-" * 97)
-
-# Setup argument component
-if len(sys.argv) > 1 and sys.argv[1] == "setup":
+
+def print_banner() -> None:
+    """
+    Prints the program banner
+    :return:
+    """
+    print("-" * 97)
+    print(f"Terabox Uploader CLI v{CODE_VERSION} 2025")
+    print("* Developed by Gonçalo M. (@dnigamer in Github).")
+    print("* For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI.")
+    print("* If you find any bugs, please open an issue in the Github repository mentioned in the link above")
+    print("-" * 97)
+    print("! This program is licensed under the MIT License.")
+    print("! This program is provided as-is, without any warranty.")
+    print("! This program is not affiliated with Terabox in any way.")
+    print("-" * 97)
+
+
+def print_usage() -> None:
+    """
+    Prints the command line usage
+    :return:
+    """
+    print("Usage: python main.py [command]")
+    print()
+    print("Commands:")
+    print("  (none)        Upload the source directory of settings.json, or every job of its jobs list, to Terabox.")
+    print("  setup         Create the secrets.json and settings.json files interactively.")
+    print("  encryption    Generate an encryption key and optionally save it to settings.json.")
+    print("  plan          Plan the upload without making it and estimate its duration (see 'plan --help').")
+    print("  verify        Compare the local files with the cloud without downloading them (see 'verify --help').")
+    print("  remote        Move, copy, rename, delete or create remote files in bulk (see 'remote --help').")
+    print("  unpack        Extract files from a bundle of packed small files (see 'unpack --help').")
+    print("  restore       Download a remote directory and decrypt its files (see 'restore --help').")
+    print("  mockserver    Run a local mock Terabox server (see 'mockserver --help').")
+    print("  bench         Benchmark the uploads against the mock server (see 'bench --help'), or the encryption")
+    print("                with 'bench encryption'.")
+    print("  -h, --help    Show this message.")
+
+
+def setup_command() -> None:
+    """
+    Creates the secrets.json and settings.json files interactively
+    :return:
+    """
     if os.path.exists("secrets.json") and os.path.exists("settings.json"):
         fmt.error("setup", "secrets.json and settings.json already exist in the current folder.")
-        sys.exit()
+        return
 
     if os.path.exists("secrets.json"):
         fmt.error("setup", "secrets.json already exists in the current folder.")
@@ -58,19 +85,19 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         JS_TOKEN = input(": ")
         if not any(char.isdigit() for char in JS_TOKEN):
             fmt.error("setup", "Invalid jstoken.")
-            sys.exit()
+            return
 
         print("Enter your csrfToken:")
         CSRF_TOKEN = input(": ")
         if not CSRF_TOKEN:
             fmt.error("setup", "Invalid csrfToken.")
-            sys.exit()
+            return
 
         print("Enter your browserid:")
         BROWSER_ID = input(": ")
         if not BROWSER_ID:
             fmt.error("setup", "Invalid browserid.")
-            sys.exit()
+            return
 
         print("Enter your lang:")
         LANG = input(": ")
@@ -81,13 +108,13 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         NDUS = input(": ")
         if not NDUS:
             fmt.error("setup", "Invalid ndus token.")
-            sys.exit()
+            return
 
         print("Enter your ndut_fmt token:")
         NDUT_FMT = input(": ")
         if not NDUT_FMT:
             fmt.error("setup", "Invalid ndut_fmt token.")
-            sys.exit()
+            return
 
         try:
             with open("secrets.json", "w", encoding="utf8") as f:
@@ -105,7 +132,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         except Exception as e:
             fmt.error("setup", "An error occurred while creating the secrets.json file.")
             fmt.error("setup", f"More information about this error: {e}")
-            sys.exit()
+            return
 
         fmt.success("setup", "secrets.json file created.")
 
@@ -119,22 +146,22 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         SOURCE_DIR = input(": ")
         if not SOURCE_DIR:
             fmt.error("setup", "Invalid source directory.")
-            sys.exit()
+            return
         if not os.path.exists(SOURCE_DIR):
             fmt.error("setup", "Source directory does not exist.")
-            sys.exit()
+            return
 
         print("Enter the path to the remote directory:")
         REMOTE_DIR = input(": ")
         if not REMOTE_DIR:
             fmt.error("setup", "Invalid remote directory.")
-            sys.exit()
+            return
 
         print("Do you want to move files to another directory after uploading? (yes/no)")
         MOVE_FILES = input(": ")
         if not MOVE_FILES:
             fmt.error("setup", "Please input \"yes\" or \"no\" for move files setting")
-            sys.exit()
+            return
         if MOVE_FILES.lower() not in ("yes", "no"):
             fmt.error("setup", "Invalid move files setting.")
             fmt.error("setup", "Defaulting to \"false\"/no moving files.")
@@ -144,10 +171,10 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
             UPLOADED_DIR = input(": ")
             if not UPLOADED_DIR:
                 fmt.error("setup", "Invalid uploaded directory.")
-                sys.exit()
+                return
             if not os.path.exists(UPLOADED_DIR):
                 fmt.error("setup", "Destination directory of uploaded files does not exist.")
-                sys.exit()
+                return
             MOVE_FILES = "true"
         else:
             MOVE_FILES = "false"
@@ -157,7 +184,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         DELETE_SOURCE = input(": ")
         if not DELETE_SOURCE:
             fmt.error("setup", "Please input \"yes\" or \"no\" for delete source setting.")
-            sys.exit()
+            return
         if DELETE_SOURCE.lower() not in ("yes", "no"):
             fmt.error("setup", "Invalid delete source setting. Defaulting to \"false\"/no deletion.")
             DELETE_SOURCE = "false"
@@ -170,7 +197,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         ENCRYPTION_ENAB = input(": ")
         if not ENCRYPTION_ENAB:
             fmt.error("setup", "Please input \"yes\" or \"no\" for encryption setting.")
-            sys.exit()
+            return
         if ENCRYPTION_ENAB.lower() not in ("yes", "no"):
             fmt.error("setup", "Invalid encryption setting.")
             fmt.error("setup", "Defaulting to \"false\"/no encryption.")
@@ -180,7 +207,9 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
             ENCRYPTION_KEY = input(": ")
             if not ENCRYPTION_KEY:
                 fmt.error("setup", "Please input a valid path to the encryption key.")
-                sys.exit()
+                return
+            from modules.encryption import Encryption
+
             if os.path.exists(ENCRYPTION_KEY):
                 ENCRYPTION_ENAB = "true"
                 fmt.success("setup", "Encryption key found.")
@@ -199,7 +228,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         IGNORE_FILES = input(": ")
         if not IGNORE_FILES:
             fmt.error("setup", "Invalid ignore files setting.")
-            sys.exit()
+            return
         if IGNORE_FILES.lower() not in ("yes", "no"):
             fmt.error("setup", "Invalid ignore files setting.")
         if IGNORE_FILES.lower() == "yes":
@@ -207,7 +236,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
             IGNORED_FILES = input(": ")
             if not IGNORED_FILES:
                 fmt.error("setup", "Invalid ignored files setting.")
-                sys.exit()
+                return
             IGNORED_FILES = [x.strip() for x in IGNORED_FILES.split(",")]
         else:
             IGNORED_FILES = []
@@ -216,7 +245,7 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         SHOW_QUOTA = input(": ")
         if not SHOW_QUOTA:
             fmt.error("setup", "Invalid show quota setting.")
-            sys.exit()
+            return
         if SHOW_QUOTA.lower() not in ("yes", "no"):
             fmt.error("setup", "Invalid show quota setting.")
         if SHOW_QUOTA.lower() == "yes":
@@ -250,13 +279,16 @@ if len(sys.argv) > 1 and sys.argv[1] == "setup":
         except Exception as e:
             fmt.error("setup", "An error occurred while creating the settings.json file.")
             fmt.error("setup", f"More information about this error: {e}")
-            sys.exit()
+            return
 
     fmt.info("setup", "Setup completed. Please run the program again without the 'setup' argument.")
-    sys.exit()
 
-# Encryption setup component
-if len(sys.argv) > 1 and sys.argv[1] == "encryption":
+
+def encryption_command() -> None:
+    """
+    Generates an encryption key and optionally saves it to settings.json
+    :return:
+    """
     # Generate encryption key
     fmt.info("encryption", "Generating encryption key...")
     encryption_key = base64.urlsafe_b64encode(os.urandom(32)).decode("utf-8")
@@ -280,741 +312,659 @@ if len(sys.argv) > 1 and sys.argv[1] == "encryption":
         fmt.info("encryption", "Encryption key not saved.")
 
     fmt.info("encryption", "Encryption process completed.")
-    sys.exit()
-
-# CURL INSTALLATION
-CURL_URL = "https://curl.se/windows/dl-8.13.0_5/curl-8.13.0_5-win64-mingw.zip"
-if os.name == "nt":
-    fmt.info("CURL", "Windows host detected. Checking if curl is installed...")
-    curl_path = os.path.join("curl", "bin", "curl.exe")
-    if not (os.path.exists(curl_path) or os.path.exists("curl.exe")):
-        fmt.info("CURL", f"curl.exe not found. Downloading curl from {CURL_URL}...")
-        curlreq = requests.get(CURL_URL, timeout=10)
-        with open("curl.zip", "wb") as f:
-            f.write(curlreq.content)
-        fmt.info("CURL", "Extracting curl...")
-        with zipfile.ZipFile("curl.zip", "r") as zip_ref:
-            zip_ref.extractall(".")
-        extracted_dir = "curl-8.13.0_5-win64-mingw"
-        if os.path.exists(extracted_dir):
-            os.rename(extracted_dir, "curl")
-        fmt.info("CURL", "Curl extracted.")
-        os.remove("curl.zip")
-    else:
-        fmt.success("CURL", "curl is already installed or exists in the current folder.")
-else:
-    fmt.info("CURL", "Checking for curl...")
-    if not subprocess.run(["which", "curl"], stdout=subprocess.PIPE, check=True).stdout.decode('utf-8'):
-        fmt.info("CURL", "curl not found. Installing curl...")
-        if os.name == "posix":
-            fmt.info("CURL", "Installing curl using Homebrew...")
-            subprocess.run(["brew", "install", "curl"], check=True)
-        elif os.name == "linux":  # Assuming Debian-based distros
-            fmt.info("CURL", "Installing curl using apt...")
-            subprocess.run(["sudo", "apt", "install", "-y", "curl"], check=True)
-        else:
-            fmt.error("CURL", "Your OS is not supported for automatic curl installation. Please install curl manually.")
-            sys.exit()
-    else:
-        fmt.info("CURL", "Curl is already installed or exists in the current folder.")
 
-try:
-    if not os.path.exists("settings.json"):
-        fmt.error("settings", "settings.json file not found.")
-        fmt.error("settings", "Please create a settings.json file by running the program with the 'setup'"
-                              " argument or following the README.md.")
-        sys.exit()
 
-    with open("secrets.json", "r", encoding="utf8") as f:
-        try:
-            secrets = json.load(f)
-        except json.JSONDecodeError as e:
-            fmt.error("auth", "Invalid JSON format in secrets.json.")
-            fmt.error("auth", f"More information about this error: {e}")
-            sys.exit()
-        except Exception as e:
-            fmt.error("auth", "An error occurred while reading the secrets.json file.")
-            fmt.error("auth", f"More information about this error: {e}")
-            sys.exit()
+def add_server_arguments(parser) -> None:
+    """
+    Adds the options of the mock Terabox server to an argument parser
+    :param parser: argparse.ArgumentParser object
+    :return:
+    """
+    from modules.mockserver import ERROR_KINDS
 
-        try:
-            JSTOKEN = secrets["jstoken"]
-            COOKIES = secrets["cookies"]
-            COOKIES_STR = ""
-            for key, value in COOKIES.items():
-                COOKIES_STR += f"{key}={value};"
-            f.close()
-
-            if not any(char.isdigit() for char in JSTOKEN):
-                fmt.error("auth", "Invalid jstoken.")
-                sys.exit()
-            fmt.success("auth", "Loaded authentication tokens.")
-        except KeyError as e:
-            fmt.error("auth", f"Key {e} not found in secrets.json.")
-            f.close()
-            sys.exit()
-        except Exception as e:
-            fmt.error("auth", "An error occurred while reading the secrets.json file.")
-            fmt.error("auth", f"More information about this error: {e}")
-            f.close()
-            sys.exit()
-except FileNotFoundError as e:
-    fmt.error("auth", "secrets.json file not found.")
-    fmt.error("auth", f"More information about this error: {e}")
-    sys.exit()
-except Exception as e:
-    fmt.error("auth", "An error occurred while reading the secrets.json file.")
-    fmt.error("auth", f"More information about this error: {e}")
-    sys.exit()
-
-try:
-    if not os.path.exists("settings.json"):
-        fmt.error("settings", "settings.json file not found.")
-        fmt.error("settings",
-                  "Please create a settings.json file by running the program with the 'setup' argument or following "
-                  "the README.md.")
-        sys.exit()
-
-    with open("settings.json", "r", encoding="utf8") as f:
-        try:
-            settings = json.load(f)
-        except json.JSONDecodeError as e:
-            fmt.error("settings", "Invalid JSON format in settings.json.")
-            fmt.error("settings", f"More information about this error: {e}")
-            sys.exit()
-        except Exception as e:
-            fmt.error("settings", "An error occurred while reading the settings.json file.")
-            fmt.error("settings", f"More information about this error: {e}")
-            sys.exit()
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before every response")
+    parser.add_argument("--bandwidth", default="", help="upload bandwidth of the server, like 10MB (default: "
+                                                        "unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected error per request")
+    parser.add_argument("--errors", default="http,errno", help=f"kinds of injected errors: {', '.join(ERROR_KINDS)}")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the injected errors")
+    parser.add_argument("--vip", action="store_true", help="answer the membership query as a VIP account")
+    parser.add_argument("--store", action="store_true", help="keep the content of the uploaded files to serve "
+                                                             "downloads")
 
-        try:
-            SOURCE_DIR = settings["directories"].get("sourcedir", "")
-            REMOTELOC = settings["directories"].get("remotedir", "")
-            MOVETOLOC = settings["directories"].get("uploadeddir", "")
-            MOVEFILES = settings["files"].get("movefiles", "false").lower() == "true"
-            DELSRCFIL = settings["files"].get("deletesource", "false").lower() == "true"
-            ENCRYPTFL = settings["encryption"].get("enabled", "false").lower() == "true"
-            ENCRYPKEY = settings["encryption"].get("encryptionkey", "")
-            IGNOREFIL = settings.get("ignoredfiles", [])
-            SHOWQUOTA = settings["appearance"].get("showquota", "false").lower() == "true"
-            # normalize important paths to absolute paths so display helpers work reliably
-            try:
-                if SOURCE_DIR:
-                    SOURCE_DIR = os.path.abspath(SOURCE_DIR)
-                if MOVETOLOC:
-                    MOVETOLOC = os.path.abspath(MOVETOLOC)
-                if ENCRYPKEY:
-                    ENCRYPKEY = os.path.abspath(ENCRYPKEY)
-            except Exception:
-                pass
-        except KeyError as e:
-            fmt.error("settings", f"Key {e} not found in settings.json.")
-            fmt.error("settings", "Please check your settings.json file and the README.md file for these "
-                                  "configurations.")
-            sys.exit()
-        except Exception as e:
-            fmt.error("settings", "An error occurred while reading the settings.json file.")
-            fmt.error("settings", f"More information about this error: {e}")
-            sys.exit()
-        f.close()
-except FileNotFoundError as e:
-    fmt.error("settings", "settings.json file not found.")
-    fmt.error("settings", f"More information about this error: {e}")
-    sys.exit()
-except Exception as e:
-    fmt.error("settings", "An error occurred while reading the settings.json file.")
-    fmt.error("settings", f"More information about this error: {e}")
-    sys.exit()
-
-if DELSRCFIL and MOVEFILES:
-    fmt.error("settings",
-              "You cannot have move and delete files settings configured as true at the same time.")
-    fmt.error("settings", "Please check your settings.json file for these configurations.")
-    sys.exit()
-
-if not SOURCE_DIR or not REMOTELOC:
-    fmt.error("settings", "Invalid directory paths. Please check the settings.json file for missing paths.")
-    sys.exit()
-
-if not os.path.exists(SOURCE_DIR) and not os.path.isdir(SOURCE_DIR):
-    fmt.error("settings", "Source directory does not exist. Please check the path.")
-    sys.exit()
-
-if not os.path.exists(MOVETOLOC) and not os.path.isdir(MOVETOLOC) and MOVEFILES:
-    fmt.error("settings", "Move to directory does not exist. Please check the path.")
-    sys.exit()
-
-if not ENCRYPTFL:
-    fmt.warning("encryption",
-                "File encryption is disabled. However, it is recommended to enable it for security "
-                "reasons regarding TeraBox's ToS and Privacy Policy.")
-    fmt.warning("encryption",
-                "For full security of your files, please enable file encryption in the settings.json "
-                "file.")
-else:
-    encrypt = Encryption()
-    if not ENCRYPKEY:
-        fmt.error("encryption", "Encryption key path is not set.")
-        sys.exit()
-    if not os.path.exists(ENCRYPKEY):
-        fmt.warning("encryption", "Encryption key file does not exist.")
-        fmt.info("encryption", "Generating encryption key...")
-        encrypt.generate_key(ENCRYPKEY)
-        fmt.success("encryption", "Encryption key generated successfully.")
-    else:
-        fmt.success("encryption", "Encryption key found.")
-        fmt.success("encryption", "Type of encryption key: " + encrypt.get_key_type(ENCRYPKEY))
 
-fmt.success("settings", "Loaded settings.")
+def build_server(args, port: int = 0):
+    """
+    Builds the mock Terabox server from the parsed command line options
+    :param args: Options parsed with the arguments of add_server_arguments.
+    :param port: Port of the server. 0 picks a free port.
+    :return: MockTerabox object
+    """
+    from modules.mockserver import MockTerabox
+    from modules.throttle import parse_rate
 
-# PROGRAM INTERNAL VARS
-USERAGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.2; rv:121.0) Gecko/20100101 Firefox/121.0"
-BASEURLTB = "https://www.terabox.com"
-TEMP_DIR = "./temp"
-ERRORS = False
+    return MockTerabox(port=port, latency=args.latency, bandwidth=parse_rate(args.bandwidth),
+                       error_rate=args.error_rate, errors=tuple(filter(None, args.errors.split(","))),
+                       seed=args.seed, vip=args.vip, store_content=args.store, log=fmt)
 
 
-def _short_path(path: str, prefer_base: Optional[str] = None) -> str:
+def mockserver_command(argv: list) -> bool:
     """
-    Return a short display path for logs.
-    - Prefer a path relative to cwd when possible.
-    - If that results in a leading '..', and prefer_base is provided, return a path relative to prefer_base
-      prefixed with the base directory name (e.g. 'source/sub1/file').
-    - Fall back to absolute path if relpaths fail.
-    Paths are returned using the OS-native separators.
+    Runs a local mock Terabox server until interrupted
+    :param argv: Arguments of the command.
+    :return: True if the server ran.
     """
+    import argparse
+    import time
+    from modules.throttle import BandwidthSettingException
+
+    parser = argparse.ArgumentParser(prog="python main.py mockserver",
+                                     description="Run a local stand-in for the Terabox API.")
+    parser.add_argument("--port", type=int, default=8766, help="port of the server (default: 8766)")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
     try:
-        abs_path = os.path.abspath(path)
-    except Exception:
-        return str(path)
-
-    # If we have a prefer_base (usually SOURCE_DIR), try to show path relative to it
-    if prefer_base:
-        try:
-            abs_base = os.path.abspath(prefer_base)
-            # If path is inside prefer_base, show as 'basename_of_base/relative/path'
-            try:
-                common = os.path.commonpath([abs_path, abs_base])
-            except Exception:
-                common = None
-            if common == abs_base:
-                rel = os.path.relpath(abs_path, abs_base)
-                if rel == '.' or rel == './':
-                    return os.path.normpath(os.path.basename(abs_base))
-                return os.path.normpath(os.path.join(os.path.basename(abs_base), rel))
-
-            # If not strictly inside, try relative to parent of prefer_base to get 'source/..' style
-            base_parent = os.path.dirname(abs_base)
-            try:
-                rel2 = os.path.relpath(abs_path, base_parent)
-                if not rel2.startswith('..'):
-                    return os.path.normpath(rel2)
-            except Exception:
-                pass
-        except Exception:
-            pass
-
-    # Fallback to a relpath to cwd if it doesn't go outside, otherwise absolute
+        server = build_server(args, args.port)
+    except (BandwidthSettingException, ValueError) as e:
+        fmt.error("mock", str(e))
+        return False
+    server.start()
+    fmt.info("mock", f"Use \"hosts\": [\"{server.url}\"] in the upload settings, and {server.url} as the base URL "
+                     f"of TeraboxClient. Press Ctrl+C to stop.")
     try:
-        relcwd = os.path.relpath(abs_path, os.getcwd())
-        if not relcwd.startswith('..'):
-            return os.path.normpath(relcwd)
-    except Exception:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
         pass
-
-    return os.path.normpath(abs_path)
+    server.stop()
+    fmt.info("mock", f"Requests: {server.requests}. Injected errors: {server.injected}.")
+    return True
 
 
-# PROGRAM FUNCTIONS
-def convert_size(size_bytes: int) -> str:
+def parse_sizes(value: str) -> list:
     """
-    Converts bytes to human-readable size
-    :param size_bytes: The size in bytes to convert.
-    :return: The size as a human-readable string.
+    Parses a comma-separated list of sizes like "64KB,1MB"
+    :param value: The list of sizes.
+    :return: list of sizes in bytes.
     """
-    if size_bytes == 0:
-        return "0 B"
-    size_name = ("B", "KB", "MB", "GB", "TB")
-    it = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, it)
-    size = round(size_bytes / p, 2)
-    return f"{size} {size_name[it]}"
+    from modules.throttle import parse_rate
 
+    return [parse_rate(size) for size in value.split(",") if size.strip()]
 
-def fetch_remote_directory(remote_dir: str) -> list:
+
+def bench_encryption_command(argv: list) -> bool:
     """
-    Returns all the files in the remote directory in a list
-    :param remote_dir:
-    :return: list of files/folders in the remote directory
+    Measures the encryption speed of each key type and buffer size, and optionally saves the fastest buffer size
+    :param argv: Arguments of the command.
+    :return: True if the benchmark ran.
     """
+    import argparse
+    from modules.benchmark import BUFFER_SIZES, ENCRYPTION_FILE_SIZES, KEY_SIZES, run_encryption_benchmark
+    from modules.formatting import convert_size
+    from modules.throttle import BandwidthSettingException
+
+    parser = argparse.ArgumentParser(prog="python main.py bench encryption",
+                                     description="Measure the encryption and decryption speed of every key type "
+                                                 "across buffer and file sizes on this machine.")
+    parser.add_argument("--buffers", default=",".join(convert_size(size).replace(" ", "") for size in BUFFER_SIZES),
+                        help="AES buffer sizes (default: %(default)s)")
+    parser.add_argument("--sizes", default=",".join(convert_size(size).replace(" ", "")
+                                                    for size in ENCRYPTION_FILE_SIZES),
+                        help="file sizes (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(KEY_SIZES), help="key types (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each measurement, the fastest is kept")
+    parser.add_argument("--save", action="store_true",
+                        help="save the fastest AES buffer size to the encryption settings of settings.json")
+    args = parser.parse_args(argv)
+    modes = [mode for mode in KEY_SIZES if mode.lower() in args.modes.lower().split(",")]
+    if not modes:
+        parser.error(f"unknown key types {args.modes}. Use {', '.join(KEY_SIZES)}.")
     try:
-        req = requests.get(
-            f"{BASEURLTB}/api/list",
-            headers={
-                "User-Agent": USERAGENT,
-                "Referer": BASEURLTB + "/main"
-            },
-            cookies=COOKIES,
-            params={
-                "app_id": "250528",
-                "web": "1",
-                "channel": "dubox",
-                "clienttype": "5", # This changed from 0 to 5 in 2025
-                "jsToken": f"{JSTOKEN}",
-                "dir": f"/{remote_dir}", # Leading slash is now required
-                "num": "1000",
-                "page": "1",
-                "order": "time",
-                "desc": "1",
-                "showempty": "0"
-            },
-            timeout=10
-        )
-        data = json.loads(req.text)
-        if "errno" in data and data["errno"] != 0:
-            if data["errno"] == -7:
-                fmt.error("remote fetch", "Couldn't fetch remote directory. Check if the remote directory exists.")
-            if data["errno"] == -6:
-                fmt.error("remote fetch", "Couldn't fetch remote directory. Check if all the cookies are valid.")
-            else:
-                fmt.error("remote fetch", f"API error: {data}")
-            return []
-        response = data.get("list", [])
-        items = []
-        for entry in response:
-            listing = {
-                "name": entry["server_filename"],
-                "path": entry["path"],
-                "size": entry["size"],
-            }
-            if entry["isdir"] == 0:
-                items.append(listing)
-            if entry["isdir"] == 1:
-                items.extend(fetch_remote_directory(entry["path"]))
-        return items
-    except Exception as e:
-        fmt.error("remote fetch", f"Exception occurred: {e}")
-        return []
-
-
-def precreate_file(filename: str, md5json_pc_local: str) -> str:
-    """
-    Precreates a file for upload
-    :param filename: The name of the file to precreate in the cloud path including the filepath.
-    :param md5json_pc_local: The MD5 hash of the file or full file (if in pieces).
-    :return: The upload ID of the file. If the precreate fails, returns "fail".
-    """
+        buffer_sizes, file_sizes = parse_sizes(args.buffers), parse_sizes(args.sizes)
+    except BandwidthSettingException as e:
+        fmt.error("benchmark", e.message)
+        return False
+    if args.save and not os.path.exists("settings.json"):
+        fmt.error("benchmark", "settings.json not found. Run the program with the 'setup' argument first.")
+        return False
     try:
-        preresponse = requests.post(f"{BASEURLTB}/api/precreate",
-                                    headers={"User-Agent": USERAGENT, "Origin": BASEURLTB,
-                                             "Referer": BASEURLTB + "/main?category=all",
-                                             "Content-Type": "application/x-www-form-urlencoded"},
-                                    cookies=COOKIES,
-                                    data={"app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "0",
-                                          "jsToken": f"{JSTOKEN}", "path": f"{REMOTELOC}/{filename}", "autoinit": "1",
-                                          "target_path": f"{REMOTELOC}", "block_list": f"{md5json_pc_local}"},
-                                    timeout=10)
-        if "uploadid" in preresponse.text:
-            return json.loads(preresponse.text)["uploadid"]
-        fmt.error("precreate", "File precreate failed.")
-        if json.loads(preresponse.text)["errmsg"] == 'need verify':
-            fmt.error("precreate",
-                      "The login session has expired. Please login again and refresh the credentials.")
-            return "fail"
-        fmt.error("precreate", f"ERROR: More information: {json.loads(preresponse.text)}")
-        return "fail"
-    except Exception as exp_precreate:
-        fmt.error("precreate", "ERROR: File precreate request failed.")
-        fmt.error("precreate", f"ERROR: More information about this error: {exp_precreate}")
-        return "fail"
-
-
-def upload_file(local_path: str, cloud_filename: str, uploadid_local: str, md5hash: str, partseq: int = 0) -> str:
-    """
-    Uploads a file
-    :param filename: The name of the file to upload in the cloud path including the filepath.
-    :param uploadid_local: The upload ID of the file.
-    :param md5hash: The MD5 hash of the file/piece to upload.
-    :param partseq: The part sequence of the file. Default is 0 (for single file upload).
-    :return: The MD5 hash of the file after upload. If the MD5 hash does not match, returns "mismatch". If the upload
-    fails, returns "failed".
+        run_encryption_benchmark(buffer_sizes, file_sizes, modes, max(args.repeat, 1),
+                                 save="settings.json" if args.save else "", log=fmt)
+    except (OSError, json.JSONDecodeError) as e:
+        fmt.error("benchmark", f"Benchmark failed: {e}")
+        return False
+    return True
+
+
+def bench_command(argv: list) -> bool:
     """
+    Benchmarks the uploads against a local mock Terabox server
+    :param argv: Arguments of the command.
+    :return: True if every file was uploaded and no workload is slower than the baseline.
+    """
+    if argv and argv[0] == "encryption":
+        return bench_encryption_command(argv[1:])
+    import argparse
+    from modules.benchmark import WORKLOADS, run_benchmark
+    from modules.throttle import BandwidthSettingException, parse_rate
+
+    parser = argparse.ArgumentParser(prog="python main.py bench",
+                                     description="Measure the files/s and MB/s of the uploads against a local mock "
+                                                 "Terabox server.")
+    parser.add_argument("workloads", nargs="*", help=f"workloads to run: {', '.join(WORKLOADS)} (default: all), or "
+                                                     f"'encryption' for the encryption benchmark")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync", help="upload engine")
+    parser.add_argument("--files", type=int, default=None, help="amount of files of each workload")
+    parser.add_argument("--size", default="", help="size of each file, like 4MB")
+    parser.add_argument("--output", default="", help="save the results to a JSON file")
+    parser.add_argument("--baseline", default="", help="compare the results with a JSON file of a previous run")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    for name in args.workloads:
+        if name not in WORKLOADS:
+            parser.error(f"unknown workload {name}. Use {', '.join(WORKLOADS)}.")
     try:
-        base_command = ["curl", "-X", "POST",
-                "-H", f"User-Agent:{USERAGENT}",
-                "-H", f"Origin:{BASEURLTB}",
-                "-H", f"Referer:{BASEURLTB}/main?category=all",
-                "-H", "Content-Type:multipart/form-data",
-                "-b", f"{COOKIES_STR}",
-                "-F", f"file=@{local_path}",
-                f"{BASEURLTB.replace('www', 'c-jp')}:443/rest/2.0/pcs/superfile2?"
-                f"method=upload&type=tmpfile&app_id=250528&path={quote_plus(REMOTELOC + '/' + cloud_filename)}&"
-                f"uploadid={uploadid_local}&partseq={partseq}"]
-        if os.name == "nt":
-            base_command[0] = os.path.join("curl", "bin", "curl.exe")
-
-        out = subprocess.run(base_command, stdout=subprocess.PIPE, check=True)
-        uresp = json.loads(out.stdout.decode('utf-8'))
-
-        if 'error_code' not in uresp:
-            # show a shorter, repo-relative path for readability
-            try:
-                display_local = _short_path(local_path, prefer_base=SOURCE_DIR)
-            except Exception:
-                display_local = os.path.basename(local_path)
-            fmt.success("upload", f"File {display_local} uploaded successfully to cloud path {REMOTELOC}/{cloud_filename}.")
-            if uresp["md5"] == md5hash:
-                fmt.info("md5", f"MD5 hash match for cloud file {cloud_filename} after upload.")
-                return uresp["md5"]
-            fmt.error("md5", f"MD5 hash mismatch for cloud file {cloud_filename} after upload. Skipping file...")
-            return "mismatch"
-
-        fmt.error("upload", "File upload failed.")
-        fmt.error("upload", f"ERROR: More information: {uresp}")
-        return "failed"
-    except Exception as exp_upload:
-        fmt.error("upload", "File upload request failed.")
-        fmt.error("upload", f"More information about this error: {exp_upload}")
-        return "failed"
-
-
-def create_file(cloudpath_local: str, uploadid_local: str, sizebytes: int, md5json_local: str) -> requests.Response:
-    """
-    Creates a file on the cloud
-    :param cloudpath_local: Cloud path of the file to create.
-    :param uploadid_local: The upload ID of the file requested previously.
-    :param sizebytes: The size of the file in bytes.
-    :param md5json_local: The MD5 hash of the file or full file (if in pieces).
-    :return: The response of the create file request.
-    """
-    crresponse = requests.post(f"{BASEURLTB}/api/create",
-                               headers={"User-Agent": USERAGENT, "Origin": BASEURLTB,
-                                        "Content-Type": "application/x-www-form-urlencoded"},
-                               cookies=COOKIES,
-                               params={"isdir": "0", "rtype": "1", "app_id": "250528", "jsToken": f"{JSTOKEN}"},
-                               data={"path": f"{cloudpath_local}", "uploadid": f"{uploadid_local}",
-                                     "target_path": f"{REMOTELOC}/", "size": f"{sizebytes}",
-                                     "block_list": f"{md5json_local}"},
-                               timeout=10)
-    return crresponse
-
-
-def clean_temp() -> bool:
-    """
-    Cleans the temp folder
-    :return: True if the temp folder was cleaned successfully, False otherwise.
-    """
-    if os.path.exists(TEMP_DIR):
-        fmt.info("temp", "Cleaning up temp directory...")
-        for tmpfilename in os.listdir(TEMP_DIR):
-            file_path = os.path.join(TEMP_DIR, tmpfilename)
-            try:
-                os.remove(file_path)
-            except Exception as exp_temp:
-                fmt.error("temp", f"File {tmpfilename} could not be deleted.")
-                fmt.error("temp", f"More information about this error: {exp_temp}")
-                return False
-        fmt.success("temp", "Temp directory cleared.")
-        return True
-
-    fmt.info("temp", "Creating temp directory...")
-    os.mkdir(TEMP_DIR)
-    fmt.success("temp", "Temp directory created.")
-    return True
+        server = build_server(args)
+        size = parse_rate(args.size)
+    except (BandwidthSettingException, ValueError) as e:
+        fmt.error("benchmark", str(e))
+        return False
+    try:
+        return run_benchmark(args.workloads or list(WORKLOADS), engine=args.engine, files=args.files, size=size,
+                             server=server, output=args.output, baseline=args.baseline, log=fmt)
+    except OSError as e:
+        fmt.error("benchmark", f"Benchmark failed: {e}")
+        return False
 
 
-# PROGRAM START
-clean_temp()  # Clean temp directory
-
-# Get member info and check if the user is a VIP
-fmt.info("vip", "Checking if you are a VIP user...")
-vip = json.loads(requests.get(f"{BASEURLTB}/rest/2.0/membership/proxy/user?method=query",
-                              headers={"User-Agent": USERAGENT, "Origin": BASEURLTB,
-                                       "Referer": BASEURLTB + "/main?category=all",
-                                       "Content-Type": "application/x-www-form-urlencoded"},
-                              cookies=COOKIES, timeout=19).text)["data"]["member_info"]["is_vip"]
-fmt.success("vip", f"You are a {'vip' if vip == 1 else 'non-vip'} user.")
-
-
-def get_files_in_directory(find_dir, base_directory) -> dict:
-    """
-    Recursively gets all files in the source directory
-    :param find_dir:             The directory to get files from
-    :param base_directory:  The base directory to get the relative path
-    :return:                dict of files in the directory
-    """
-    dir_files = {}
-    for filename in os.listdir(find_dir):
-        full_path = os.path.join(find_dir, filename)
-        if os.path.isfile(full_path):
-            if filename in [".DS_Store", os.path.basename(__file__), "settings.json", "secrets.json"]:
-                fmt.warning("upload", f"Skipping file {filename} because it's a protected file.")
-                continue
-            for exclusion in IGNOREFIL:
-                if fnmatch.fnmatch(filename, exclusion):
-                    fmt.warning("upload", f"Skipping file {filename} because it's in the ignore list.")
-                    continue
-            sizebytes = os.path.getsize(full_path)
-            relpath = os.path.relpath(full_path, base_directory)
-            dir_files.setdefault(find_dir, []).append({"name": filename, "relative_path": relpath, "sizebytes":
-                                                       sizebytes, "encrypted": False, "encrypterror": False})
-        elif os.path.isdir(full_path):
-            dir_files.update(get_files_in_directory(full_path, base_directory))
-
-    return dir_files
-
-
-# Loop through files in source directory and add to array
-try:
-    display_source = _short_path(SOURCE_DIR, prefer_base=SOURCE_DIR)
-except Exception:
-    display_source = SOURCE_DIR
-fmt.info("upload", f"Checking files in {display_source}...")
-files = get_files_in_directory(SOURCE_DIR, SOURCE_DIR)
-if len(files) == 0:
-    fmt.success("upload", "No files to upload.")
-    fmt.debug("program", "Program closing. Have a nice day!")
-    sys.exit()
+def prepare_encryption(settings) -> None:
+    """
+    Checks the encryption key of the settings and generates it if it does not exist
+    :param settings: Program settings.
+    :return:
+    """
+    if not settings.encryption_enabled:
+        fmt.warning("encryption",
+                    "File encryption is disabled. However, it is recommended to enable it for security "
+                    "reasons regarding TeraBox's ToS and Privacy Policy.")
+        fmt.warning("encryption",
+                    "For full security of your files, please enable file encryption in the settings.json "
+                    "file.")
+        return
+    from modules.encryption import Encryption
 
-# ENCRYPTION (IF ENABLED)
-if ENCRYPTFL:
     encrypt = Encryption()
-    if len(files) == 0:
-        fmt.success("encrypt", "No files to encrypt.")
+    if not os.path.exists(settings.encryption_key):
+        fmt.warning("encryption", "Encryption key file does not exist.")
+        fmt.info("encryption", "Generating encryption key...")
+        encrypt.generate_key(settings.encryption_key)
+        fmt.success("encryption", "Encryption key generated successfully.")
+    else:
+        fmt.success("encryption", "Encryption key found.")
+        fmt.success("encryption", "Type of encryption key: " + encrypt.get_key_type(settings.encryption_key))
+
+
+def settings_error(message: str) -> None:
+    """
+    Logs an invalid settings.json error
+    :param message: Description of the error.
+    :return:
+    """
+    fmt.error("settings", message)
+    fmt.error("settings", "Please check your settings.json file and the README.md file for these "
+                          "configurations, or create it by running the program with the 'setup' argument.")
+
+
+def load_client(upload: bool = False):
+    """
+    Loads secrets.json and settings.json, and configures the logging and tracing of the program
+    :param upload: If True, the settings are checked for an upload, with the source directory, the move to
+    directory and the encryption key.
+    :return: (Settings, TeraboxClient) tuple, or (None, None) if the files are missing or invalid.
+    """
+    from modules.client import TeraboxClient
+    from modules.config import Settings, SettingsException, load_secrets
+    from modules.tracing import Tracer, set_tracer
 
     try:
-        KEY_TYPE = encrypt.get_key_type(ENCRYPKEY)
-        fmt.debug("encrypt", f"Formatting files using key type: {KEY_TYPE}")
-    except Exception as e:
-        fmt.error("encrypt", f"Encryption key {ENCRYPKEY} is invalid.")
-        fmt.error("encrypt", f"More information about this error: {e}")
-        ERRORS = True
-        sys.exit()
-
-    fmt.info("encrypt", f"Encrypting files in {SOURCE_DIR}...")
-    for directory, files_in_directory in files.items():
-        for file in files_in_directory:
-            fmt.info("encrypt", f"Encrypting file {file['name']}...")
-            try:
-                encrypt.encrypt_file(ENCRYPKEY, os.path.join(str(directory),
-                                                             str(file['name'].replace(str(directory), ''))))
-                file['name'] = f"{file['name']}.enc"
-                file['sizebytes'] = os.path.getsize(os.path.join(TEMP_DIR, file['name']))
-                file['encrypted'] = True
-                fmt.success("encrypt", f"File {file['name']} encrypted successfully.")
-            except FileEncryptedException:
-                file['name'] = f"{file['name']}.enc"
-                file['sizebytes'] = os.path.getsize(os.path.join(TEMP_DIR, file['name']))
-                file['encrypted'] = True
-                fmt.warning("encrypt", f"File {file['name']} is already encrypted.")
-                continue
-            except Exception as e:
-                fmt.error("encrypt", f"File {file['name']} encryption failed.")
-                fmt.error("encrypt", f"More information about this error: {e}")
-                file['encrypterror'] = True
-                ERRORS = True
-                continue
-
-def _process_single_file_entry(directory, file, remote_files):
-    global ERRORS
-    # Safe, forward-slash relative path for logging and cloud comparisons
-    rel_disp = file['relative_path'].replace('\\', '/')
-
-    # Determine what the cloud-relative filename will be (append .enc for encrypted files)
-    cloud_relative = rel_disp + ('.enc' if file.get('encrypted') else '')
-
-    # Skip if file already exists remotely (compare using the cloud-relative name)
-    for remote_file in remote_files:
-        if remote_file.get("path", "").endswith(cloud_relative):
-            abs_path = os.path.abspath(os.path.join(str(directory), str(file["name"])))
-            display_local = _short_path(abs_path, prefer_base=SOURCE_DIR)
-            fmt.warning("upload", f"File {file['name']} (OS path: {display_local}) already exists on the cloud. Skipping file...")
-            return
+        secrets = load_secrets("secrets.json")
+        fmt.success("auth", "Loaded authentication tokens.")
+    except SettingsException as e:
+        fmt.error("auth", e.message)
+        return None, None
 
-    # Local source directory selection
-    if file['encrypted']:
-        local_source_dir = TEMP_DIR
-        fmt.debug("file", f"File {rel_disp} is encrypted. Using source directory as {TEMP_DIR}.")
-    else:
-        local_source_dir = settings["directories"]["sourcedir"]
-        fmt.debug("file", f"File {rel_disp} is not encrypted. Using source directory as {local_source_dir}.")
-
-    fmt.info("upload", f"Uploading {rel_disp}...")
-
-    # Quota check
-    if SHOWQUOTA:
-        quotareq = requests.get(
-            f"{BASEURLTB}/api/quota?checkfree=1",
-            headers={"User-Agent": USERAGENT},
-            cookies=COOKIES,
-            timeout=10,
-        )
-        quota = json.loads(quotareq.text)
-        aviquot = quota['total'] - quota['used']
-        fmt.debug("quota", f"Available quota: {convert_size(aviquot)}")
-        if aviquot < file['sizebytes']:
-            fmt.error("quota", f"Not enough quota available for file {file['name']}.")
-            return
-        fmt.debug("quota", f"Available quota after the upload: {convert_size(aviquot - file['sizebytes'])}")
+    try:
+        settings = Settings.load("settings.json", upload=upload)
+        set_backend(LogBackend.from_settings(settings.logging))
+        set_tracer(Tracer.from_settings(settings.tracing))
+        client = TeraboxClient.from_settings(settings, secrets, log=fmt)
+    except (SettingsException, LogSettingException) as e:
+        settings_error(e.message)
+        return None, None
+    return settings, client
 
-    # Resolve local file path
-    local_file_path = os.path.abspath(os.path.join(local_source_dir, file['relative_path']))
-    if file['encrypted']:
-        local_file_path = os.path.abspath(os.path.join(TEMP_DIR, file['name']))
-    if not os.path.exists(local_file_path):
+
+def upload_command() -> bool:
+    """
+    Uploads the source directory of settings.json, or the source directories of its jobs
+    :return: True if every file was uploaded without errors.
+    """
+    from modules.accounts import AccountPool
+    from modules.config import SettingsException, load_accounts
+    from modules.metrics import MetricsExporter, MetricsSettingException
+    from modules.compression import Compression, CompressionSettingException
+    from modules.jobs import DEFAULT_WORKERS, JobRunner, load_jobs
+    from modules.packing import Packer, PackingSettingException
+    from modules.scheduler import Scheduler, SchedulingSettingException
+    from modules.integrity import IntegrityManifest, IntegritySettingException
+    from modules.snapshot import Snapshotter, SnapshotSettingException
+    from modules.tempspace import TempSpace, TempSpaceSettingException
+    from modules.tracing import get_tracer
+    from modules.uploader import Uploader
+
+    settings, client = load_client(upload=True)
+    if client is None:
+        return False
+    try:
+        jobs = load_jobs(settings)
+        exporter = MetricsExporter.from_settings(settings.metrics, log=fmt)
+        Packer.from_settings(settings.packing)
+        Scheduler.from_settings(settings.scheduling)
+        TempSpace.from_settings(settings.temp)
+        for target in [job.settings for job in jobs] or [settings]:
+            Packer.from_settings(target.packing)
+            IntegrityManifest.from_settings(target.integrity)
+            Snapshotter.from_settings(target.snapshot)
+            if target.encryption_enabled:
+                Compression.from_settings(target.compression)
+        workers = int(settings.upload.get("jobworkers", DEFAULT_WORKERS))
+        secrets = load_accounts("secrets.json")
+        accounts = AccountPool.from_secrets(settings, secrets, client, log=fmt) if len(secrets) > 1 else None
+    except (SettingsException, MetricsSettingException, PackingSettingException, CompressionSettingException,
+            SchedulingSettingException, TempSpaceSettingException, IntegritySettingException,
+            SnapshotSettingException) as e:
+        settings_error(e.message)
+        return False
+    except ValueError as e:
+        settings_error(f"Invalid amount of job workers in settings.json: {e}")
+        return False
+    client.throttle.install_signal_handler()
+    for target in [job.settings for job in jobs] or [settings]:
+        prepare_encryption(target)
+    fmt.success("settings", "Loaded settings.")
+
+    # curl and the account type are only checked once a file has to be uploaded
+    exporter.start()
+    try:
+        if jobs:
+            result = JobRunner(client, jobs, workers=workers, log=fmt, accounts=accounts).run()
+        else:
+            result = Uploader(client, settings, log=fmt, accounts=accounts).run()
+    finally:
+        exporter.stop()
+        tracer = get_tracer()
+        tracer.log_summary(fmt)
         try:
-            display_missing = _short_path(local_file_path, prefer_base=SOURCE_DIR)
-        except Exception:
-            display_missing = local_file_path
-        fmt.error(
-            "upload",
-            f"File {display_missing} does not exist on the source directory anymore. Skipping file...",
-        )
-        ERRORS = True
-        return
+            if tracer.write():
+                fmt.info("trace", f"Trace written to {tracer.path}. Open it in https://ui.perfetto.dev.")
+        except OSError as e:
+            fmt.error("trace", f"Could not write the trace file {tracer.path}: {e}")
+    if not result.ok:
+        fmt.warning("upload",
+                    "Some files were not uploaded or had problems while uploading. Please check the logs!")
+        return False
+    if result.uploaded or result.skipped:
+        fmt.success("upload", "All files were uploaded.")
+    return True
 
-    # Size limits
-    if (vip == 1 and file['sizebytes'] >= 21474836479) or (vip == 0 and file['sizebytes'] >= 4294967296):
-        fmt.error(
-            "upload",
-            f"File {file['name']} is too big for the type of account you have. Skipping file...",
-        )
-        fmt.error("upload", f"File size: {convert_size(file['sizebytes'])}")
-        fmt.error("upload", f"Maximum file size for your account: {'20GB' if vip == 1 else '4GB'}")
-        ERRORS = True
-        return
 
-    # Build upload pieces and MD5 list
-    pieces = []
-    md5dict = []
-    if file['sizebytes'] >= 2147483648:
-        fmt.info("split", "File size is greater than 2GB. Splitting original file in chunks...")
-        CHUNK_SIZE = 120 * 1024 * 1024
-        num_chunks = int(os.path.getsize(local_file_path) / CHUNK_SIZE)
-        fmt.debug("split", f"File will be split in {num_chunks} chunks.")
-        for i in range(num_chunks):
-            chunk_filename = os.path.join(TEMP_DIR, f"{file['name']}.part{i:03d}")
-            with open(local_file_path, 'rb') as f, open(chunk_filename, 'wb') as chunk_file:
-                f.seek(i * CHUNK_SIZE)
-                chunk = f.read(CHUNK_SIZE)
-                chunk_file.write(chunk)
-                md5dict.append(hashlib.md5(chunk).hexdigest())
-            pieces.append(chunk_filename)
-        fmt.success("split", f"File split successfully in {len(pieces)} pieces.")
+def plan_command(argv: list) -> bool:
+    """
+    Plans the upload of the source directory of settings.json, or of every job, without any request or temp file
+    :param argv: Arguments of the command.
+    :return: True if no file would fail.
+    """
+    import argparse
+    from modules.compression import CompressionSettingException
+    from modules.config import SettingsException
+    from modules.formatting import convert_size
+    from modules.integrity import IntegritySettingException
+    from modules.jobs import load_jobs
+    from modules.packing import PackingSettingException
+    from modules.planner import REQUEST_TIME, Plan, Planner
+    from modules.scheduler import SchedulingSettingException
+    from modules.snapshot import SnapshotSettingException
+    from modules.tempspace import TempSpaceSettingException
+    from modules.throttle import BandwidthSettingException, parse_rate
+
+    parser = argparse.ArgumentParser(prog="python main.py plan",
+                                     description="Show which files an upload would send, skip or leave out, and how "
+                                                 "long it would take, without any request or temp file. The files "
+                                                 "on the cloud are taken from the last listing of the remote "
+                                                 "directory, kept in the cache by the uploads.")
+    parser.add_argument("paths", nargs="*", help="local files and directories (default: the source directory)")
+    parser.add_argument("--bandwidth", default="",
+                        help="upload speed of the estimate, e.g. 10MB (default: the bandwidth limit of settings.json)")
+    parser.add_argument("--request-time", type=float, default=REQUEST_TIME,
+                        help=f"seconds taken by each API request besides its data (default: {REQUEST_TIME})")
+    parser.add_argument("--output", default="plan.json", help="JSON file the plan is saved to (default: plan.json)")
+    args = parser.parse_args(argv)
+
+    settings, client = load_client(upload=True)
+    if client is None:
+        return False
+    try:
+        bandwidth = parse_rate(args.bandwidth) or client.throttle.schedule.limit_at()
+    except BandwidthSettingException as e:
+        fmt.error("plan", e.message)
+        return False
+    plan = Plan(bandwidth, args.request_time)
+    try:
+        jobs = load_jobs(settings)
+        if args.paths and jobs:
+            fmt.error("plan", "Paths can't be given when settings.json has upload jobs.")
+            return False
+        for name, target in [(job.name, job.settings) for job in jobs] or [(None, settings)]:
+            Planner(client, target, log=fmt, job=name).plan(args.paths or None, plan)
+    except (SettingsException, PackingSettingException, CompressionSettingException, SchedulingSettingException,
+            TempSpaceSettingException, IntegritySettingException, SnapshotSettingException) as e:
+        settings_error(e.message)
+        return False
+
+    for entry in plan.files:
+        if entry["action"] == "fail":
+            fmt.error("plan", f"Would fail: {entry['cloud_path']} ({entry['reason']})")
+    totals = plan.totals()
+    upload = totals["upload"]
+    fmt.info("plan", f"{upload['files']} files to upload ({convert_size(upload['bytes'])}, {upload['parts']} parts, "
+                     f"{upload['split']} split), {totals['skip']['files']} to skip, {totals['fail']['files']} "
+                     f"that would fail.")
+    seconds = plan.estimated_seconds()
+    if seconds is None:
+        fmt.warning("plan", "No bandwidth limit is set, so the duration can't be estimated. Use --bandwidth.")
     else:
-        with open(local_file_path, 'rb') as md5_file:
-            md5dict = [hashlib.md5(md5_file.read()).hexdigest()]
-        fmt.info("md5", f"MD5 hash calculated for file {rel_disp}.")
-        pieces.append(local_file_path)
-    md5json = json.dumps(md5dict)
-
-    # Precreate on cloud
-    fmt.info("precreate", f"Precreating cloud file {rel_disp}...")
-    cloud_relative = rel_disp + ('.enc' if file['encrypted'] else '')
-    uploadid = precreate_file(cloud_relative, md5json)
-    if uploadid == 'fail':
-        ERRORS = True
-        return
-    cloudpath = (os.path.join(REMOTELOC, cloud_relative)).replace('\\', '/')
-
-    # Upload
-    upload_failed = False
-    if len(pieces) > 1:
-        for idx, pi in enumerate(pieces):
-            resp = upload_file(pi, cloud_relative, uploadid, md5dict[idx], idx)
-            if resp in ("failed", "mismatch"):
-                upload_failed = True
-                break
+        fmt.info("plan", f"Estimated duration at {convert_size(bandwidth)}/s: {int(seconds // 3600)}h"
+                         f"{int(seconds % 3600 // 60):02d}m{int(seconds % 60):02d}s.")
+    try:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(plan.to_dict(), f, indent=2)
+    except OSError as e:
+        fmt.error("plan", f"Could not save the plan to {args.output}: {e}")
+        return False
+    fmt.success("plan", f"Plan saved to {args.output}.")
+    return totals["fail"]["files"] == 0
+
+
+def verify_command(argv: list) -> bool:
+    """
+    Compares the local files with the remote directory of settings.json, without downloading them
+    :param argv: Arguments of the command.
+    :return: True if every local file is on the cloud with the same content.
+    """
+    import argparse
+    from modules.compression import CompressionSettingException
+    from modules.config import SettingsException
+    from modules.integrity import IntegritySettingException
+    from modules.packing import PackingSettingException
+    from modules.retry import CircuitOpenException, TransferError
+    from modules.scheduler import SchedulingSettingException
+    from modules.snapshot import SnapshotSettingException
+    from modules.tempspace import TempSpaceSettingException
+    from modules.verify import BATCH_SIZE, Verifier
+
+    parser = argparse.ArgumentParser(prog="python main.py verify",
+                                     description="Report the local files that are missing or different on the cloud, "
+                                                 "and the cloud files that don't exist locally.")
+    parser.add_argument("paths", nargs="*", help="local files and directories (default: the source directory)")
+    parser.add_argument("--quick", action="store_true", help="only compare the sizes, without hashing the files")
+    parser.add_argument("--blocks", action="store_true",
+                        help="download the files recorded in an integrity manifest and compare their blocks")
+    parser.add_argument("--workers", type=int, default=8, help="parallel requests and hashing jobs (default: 8)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE,
+                        help=f"files per metadata request (default: {BATCH_SIZE})")
+    parser.add_argument("--output", default="", help="save the report to a JSON file")
+    args = parser.parse_args(argv)
+
+    settings, client = load_client()
+    if client is None:
+        return False
+    try:
+        # The local files are scanned with an uploader, which reads the upload settings
+        verifier = Verifier(client, settings, log=fmt, workers=args.workers, batch_size=args.batch,
+                            checksums=not args.quick, blocks=args.blocks)
+        report = verifier.verify(args.paths or None)
+    except (TransferError, CircuitOpenException) as e:
+        fmt.error("verify", f"Could not read the remote directory: {e}")
+        return False
+    except (SettingsException, PackingSettingException, CompressionSettingException, SchedulingSettingException,
+            TempSpaceSettingException, IntegritySettingException, SnapshotSettingException) as e:
+        settings_error(e.message)
+        return False
+
+    for path in report.missing:
+        fmt.error("verify", f"Missing on the cloud: {path}")
+    for path, reason in report.mismatched:
+        fmt.error("verify", f"Different on the cloud: {path} ({reason})")
+    for path in report.extra:
+        fmt.warning("verify", f"Only on the cloud: {path}")
+    if report.unchecked:
+        fmt.warning("verify", f"{len(report.unchecked)} files have the same size, but the cloud returned no "
+                              f"checksum to compare with.")
+    summary = (f"{len(report.matched)} matched, {len(report.missing)} missing, {len(report.mismatched)} "
+               f"different, {len(report.extra)} only on the cloud.")
+    if report.ok:
+        fmt.success("verify", summary)
     else:
-        resp = upload_file(pieces[0], cloud_relative, uploadid, md5dict[0])
-        if resp in ("failed", "mismatch"):
-            upload_failed = True
-    if upload_failed:
-        ERRORS = True
-        return
+        fmt.error("verify", summary)
+    if args.output:
+        try:
+            with open(args.output, "w", encoding="utf8") as f:
+                json.dump(report.to_dict(), f, indent=2)
+        except OSError as e:
+            fmt.error("verify", f"Could not save the report to {args.output}: {e}")
+            return False
+        fmt.success("verify", f"Report saved to {args.output}.")
+    return report.ok
+
 
-    # Create the file on the cloud
-    fmt.info("upload", f"Finalizing file {rel_disp} upload...")
-    create = create_file(str(cloudpath), uploadid, file['sizebytes'], md5json)
-    success_create = json.loads(create.text).get("errno") == 0
-    if success_create:
-        display_local = _short_path(local_file_path, prefer_base=SOURCE_DIR)
-        fmt.success("upload", f"File {display_local} uploaded and saved on cloud successfully.")
-        fmt.success("upload", f"The file is now available at {cloudpath} in the cloud.")
+def restore_command(argv: list) -> bool:
+    """
+    Downloads a remote directory, decrypting the files encrypted with the key of settings.json
+    :param argv: Arguments of the command.
+    :return: True if every file was restored or skipped.
+    """
+    import argparse
+    from modules.integrity import IntegritySettingException
+    from modules.restore import RANGE_SIZE, Restorer
+    from modules.retry import CircuitOpenException, TransferError
+
+    parser = argparse.ArgumentParser(prog="python main.py restore",
+                                     description="Download a remote directory and its subdirectories, rebuilding "
+                                                 "the tree locally and decrypting the .enc files.")
+    parser.add_argument("remote", nargs="?", default="", help="remote directory (default: the remote directory)")
+    parser.add_argument("--target", default=".", help="local directory to restore to (default: the current one)")
+    parser.add_argument("--workers", type=int, default=8, help="parallel range requests (default: 8)")
+    parser.add_argument("--range-size", type=parse_sizes, default=[RANGE_SIZE],
+                        help=f"size of each range request, e.g. 16MB (default: {RANGE_SIZE // 1024 // 1024}MB)")
+    parser.add_argument("--overwrite", action="store_true", help="replace the local files that already exist")
+    args = parser.parse_args(argv)
+
+    settings, client = load_client()
+    if client is None:
+        return False
+    try:
+        restorer = Restorer(client, settings, log=fmt, workers=args.workers, range_size=args.range_size[0],
+                            overwrite=args.overwrite)
+    except IntegritySettingException as e:
+        settings_error(e.message)
+        return False
+    try:
+        result = restorer.restore(args.remote or None, args.target)
+    except (TransferError, CircuitOpenException) as e:
+        fmt.error("restore", f"Could not read the remote directory: {e}")
+        return False
+    summary = f"{len(result.restored)} restored, {len(result.skipped)} skipped, {len(result.failed)} failed."
+    if result.ok:
+        fmt.success("restore", summary)
     else:
-        fmt.error("upload", f"File {file['name']} upload failed.")
-        fmt.error("upload", f"More information: {create}")
-        ERRORS = True
-        return
+        fmt.error("restore", summary)
+    return result.ok
 
-    # Move/delete
-    if MOVEFILES:
-        try:
-            src_move = os.path.abspath(os.path.join(local_source_dir, file['relative_path']))
-            dst_move = os.path.abspath(os.path.join(MOVETOLOC, os.path.basename(file['relative_path'])))
-            try:
-                display_src_move = _short_path(src_move, prefer_base=SOURCE_DIR)
-            except Exception:
-                display_src_move = src_move
-            try:
-                display_dst_move = _short_path(
-                    dst_move, prefer_base=MOVETOLOC or os.path.dirname(dst_move)
-                )
-            except Exception:
-                display_dst_move = dst_move
-            fmt.info("move", f"Moving file {display_src_move} to {display_dst_move}...")
-            os.rename(src_move, dst_move)
-            fmt.success("move", f"File {file['name']} moved successfully to destination.")
-        except Exception as e:
-            fmt.error("move", f"File {file['name']} could not be moved.")
-            fmt.error("move", f"More information about this error: {e}")
-            ERRORS = True
-            return
 
-    if DELSRCFIL:
+def remote_command(argv: list) -> bool:
+    """
+    Moves, copies, renames, deletes or creates remote entries with batched requests
+    :param argv: Arguments of the command.
+    :return: True if every entry succeeded.
+    """
+    import argparse
+    from modules.remote import BATCH_SIZE, ONDUP_CHOICES, OPERATIONS, RemoteManager
+    from modules.retry import CircuitOpenException, TransferError
+
+    parser = argparse.ArgumentParser(prog="python main.py remote",
+                                     description="Run an operation on many remote files or directories, packing "
+                                                 "the entries into batched requests.")
+    parser.add_argument("operation", choices=OPERATIONS, help="operation to run")
+    parser.add_argument("paths", nargs="*", help="cloud paths. For rename, pairs of cloud path and new name. With "
+                                                 "--match, the directories to search")
+    parser.add_argument("--to", default="", help="destination directory of move and copy")
+    parser.add_argument("--from", dest="source", default="",
+                        help="read the entries from a file, one per line (for rename: path<TAB>new name)")
+    parser.add_argument("--match", default="", help="run on the files of the directories whose name matches a "
+                                                    "pattern, like '*.part*'")
+    parser.add_argument("--ondup", choices=ONDUP_CHOICES, default="fail",
+                        help="what to do when the destination exists (default: fail)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel requests (default: 4)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE,
+                        help=f"entries per request (default: {BATCH_SIZE})")
+    args = parser.parse_args(argv)
+
+    lines = []
+    if args.source:
         try:
-            src_del = os.path.abspath(os.path.join(local_source_dir, file['relative_path']))
-            try:
-                display_src_del = _short_path(src_del, prefer_base=SOURCE_DIR)
-            except Exception:
-                display_src_del = src_del
-            fmt.info("delete", f"Deleting file {display_src_del} from source directory...")
-            os.remove(src_del)
-            fmt.success("delete", f"File {file['name']} deleted successfully.")
-        except Exception as e:
-            fmt.error("delete", f"File {file['name']} could not be deleted.")
-            fmt.error("delete", f"More information about this error: {e}")
-            ERRORS = True
-            return
+            with open(args.source, "r", encoding="utf8") as f:
+                lines = [line.rstrip("\r\n") for line in f if line.strip()]
+        except OSError as e:
+            parser.error(f"could not read {args.source}: {e.strerror or e}")
+    entries = args.paths + lines
+    if args.operation in ("move", "copy") and not args.to:
+        parser.error(f"{args.operation} needs a destination directory (--to)")
+    if args.operation == "rename":
+        if args.match:
+            parser.error("rename can't be used with --match")
+        pairs = [[path, name] for path, name in zip(args.paths[::2], args.paths[1::2])]
+        pairs += [line.split("\t", 1) for line in lines]
+        if len(args.paths) % 2 or any(len(pair) != 2 for pair in pairs):
+            parser.error("rename needs a new name for every path")
+    if not entries:
+        parser.error("no remote paths given")
+
+    settings, client = load_client()
+    if client is None:
+        return False
+    manager = RemoteManager(client, log=fmt, workers=args.workers, batch_size=args.batch, ondup=args.ondup)
+    try:
+        if args.match:
+            entries = manager.match(entries, args.match)
+            fmt.info("remote", f"{len(entries)} files match {args.match}.")
+        if args.operation == "rename":
+            result = manager.rename(pairs)
+        elif args.operation in ("move", "copy"):
+            result = getattr(manager, args.operation)(entries, args.to)
+        else:
+            result = getattr(manager, args.operation)(entries)
+    except (TransferError, CircuitOpenException) as e:
+        fmt.error("remote", f"Could not list the remote directories: {e}")
+        return False
+    summary = f"{args.operation}: {len(result.done)} done, {len(result.failed)} failed."
+    if result.ok:
+        fmt.success("remote", summary)
+    else:
+        fmt.error("remote", summary)
+    return result.ok
 
-    # Conclude per-file procedure
+
+def unpack_command(argv: list) -> bool:
+    """
+    Extracts files from a bundle using its index
+    :param argv: Arguments of the command.
+    :return: True if every requested file was extracted.
+    """
+    import argparse
+    from modules.packing import INDEX_SUFFIX, extract, load_index
+
+    parser = argparse.ArgumentParser(prog="python main.py unpack",
+                                     description="Extract files from a bundle of packed small files, reading only "
+                                                 "their bytes. Decrypt encrypted bundles and indexes first.")
+    parser.add_argument("bundle", help="the bundle (.tar or .zip)")
+    parser.add_argument("files", nargs="*", help="paths of the files inside the bundle (default: all of them)")
+    parser.add_argument("--index", default="", help=f"the index of the bundle (default: the bundle path + "
+                                                    f"{INDEX_SUFFIX})")
+    parser.add_argument("--target", default=".", help="directory to extract to (default: the current one)")
+    args = parser.parse_args(argv)
+
+    index = args.index or args.bundle + INDEX_SUFFIX
     try:
-        final_path = (
-            local_file_path
-            if not file['encrypted']
-            else os.path.abspath(os.path.join(TEMP_DIR, file['name']))
-        )
-        display_local = _short_path(final_path, prefer_base=SOURCE_DIR)
-    except Exception:
-        display_local = file.get('name', 'unknown file')
-    fmt.success("upload", f"File {display_local} concluded every upload procedure.")
-
-
-remote_files = fetch_remote_directory(REMOTELOC)
-
-for directory, files_in_directory in files.items():
-    if not files_in_directory:
-        continue
-    for file in files_in_directory:
-        if file['encrypterror']:
-            continue
-        _process_single_file_entry(directory, file, remote_files)
-
-if not ERRORS:
-    fmt.success("upload", "All files were uploaded.")
-    clean_temp()
-    fmt.debug("program", "Program closing. Have a nice day!")
-else:
-    fmt.warning("upload",
-                "Some files were not uploaded or had problems while uploading. Please check the logs!")
+        entries = load_index(index)
+    except (OSError, ValueError, KeyError) as e:
+        fmt.error("unpack", f"Could not read the index {index}: {e}")
+        return False
+    ok = True
+    for member in args.files or list(entries):
+        parts = [part for part in member.split("/") if part not in ("", ".")]
+        if member not in entries:
+            fmt.error("unpack", f"File {member} is not in the bundle {args.bundle}.")
+            ok = False
+        elif not parts or ".." in parts:
+            fmt.error("unpack", f"Refusing to extract {member} outside of the target directory.")
+            ok = False
+        else:
+            target = os.path.join(args.target, *parts)
+            try:
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                extract(args.bundle, entries[member], target)
+                fmt.success("unpack", f"Extracted {member} to {target}.")
+            except OSError as e:
+                fmt.error("unpack", f"Could not extract {member}: {e}")
+                ok = False
+    return ok
+
+
+def main(argv: list) -> int:
+    """
+    Entry point of the command line interface
+    :param argv: Command line arguments, without the program name.
+    :return: Exit code.
+    """
+    command = argv[0] if argv else ""
+    if command in ("-h", "--help", "help"):
+        print(f"Terabox Uploader CLI v{CODE_VERSION}")
+        print_usage()
+        return 0
+    print_banner()
+    if command == "setup":
+        setup_command()
+        return 0
+    if command == "encryption":
+        encryption_command()
+        return 0
+    commands = {"mockserver": mockserver_command, "bench": bench_command, "verify": verify_command,
+                "restore": restore_command, "remote": remote_command,
+                "unpack": unpack_command, "plan": plan_command}
+    if command in commands:
+        ok = commands[command](argv[1:])
+        get_backend().close()
+        return 0 if ok else 1
+    if command:
+        fmt.error("program", f"Unknown command: {command}")
+        print_usage()
+        return 2
+
+    ok = upload_command()
     fmt.debug("program", "Program closing. Have a nice day!")
+    get_backend().close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
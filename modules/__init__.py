@@ -0,0 +1,40 @@
+"""
+TeraBox Uploader CLI: modules
+Library API of the uploader. Example:
+
+    from modules import Settings, TeraboxClient, Uploader, load_secrets
+
+    settings = Settings.load("settings.json")
+    client = TeraboxClient.from_settings(settings, load_secrets("secrets.json"))
+    result = Uploader(client, settings).upload_paths(["/data/reports", "/data/dump.sql"])
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import importlib
+
+# The submodules are imported on first access, so importing one of them doesn't load the others
+_EXPORTS = {
+    "TeraboxClient": "modules.client",
+    "Settings": "modules.config",
+    "SettingsException": "modules.config",
+    "load_secrets": "modules.config",
+    "Uploader": "modules.uploader",
+    "UploadResult": "modules.uploader",
+}
+
+__all__ = ["TeraboxClient", "Settings", "SettingsException", "load_secrets", "Uploader", "UploadResult"]
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'modules' has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,223 @@
+"""
+TeraBox Uploader CLI: accounts.py
+This module is used to spread the uploads over several Terabox accounts.
+Every account has its own quota and rate limits. The files of a run are queued, largest first unless a scheduling
+policy is set, and every account takes the next file that fits in its available quota as soon as it is free, so the
+faster accounts upload more files. An account whose session stops working ("need verify", errno -6) is taken out of
+the run and its file goes back to the queue for the other accounts. Every uploaded file is recorded in the manifest
+of its account, so its location is known.
+Used in: uploader.py, jobs.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from modules.client import TeraboxClient
+from modules.config import Settings
+from modules.formatting import Formatting, convert_size
+from modules.quota import QuotaTracker
+from modules.retry import CircuitOpenException, TransferError
+
+MANIFEST_DIR = "manifests"
+
+
+class Account:
+    """
+    A Terabox account of the run, with its client and its statistics.
+    """
+
+    def __init__(self, name: str, client: TeraboxClient):
+        """
+        :param name: Name of the account in secrets.json.
+        :param client: Client of the account.
+        """
+        self.name = name
+        self.client = client
+        self.quota = QuotaTracker(client)
+        self.down = False
+        self.uploaded_bytes = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Average speed of the files uploaded by the account, in bytes per second
+        """
+        return self.uploaded_bytes / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class Manifest:
+    """
+    Record of the files uploaded to each account, one JSON line per file in <directory>/<account>.jsonl.
+    """
+
+    def __init__(self, directory: str = MANIFEST_DIR):
+        """
+        :param directory: Directory of the manifests.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def path(self, account: str) -> str:
+        """
+        Returns the manifest file of an account
+        :param account: Name of the account.
+        :return: Path of the manifest.
+        """
+        return os.path.join(self.directory, f"{account}.jsonl")
+
+    def record(self, account: str, files: list, remote_path: str, size: int) -> None:
+        """
+        Records an uploaded file
+        :param account: Name of the account the file was uploaded to.
+        :param files: Local source files of the upload. A bundle has several.
+        :param remote_path: Cloud path of the file.
+        :param size: Uploaded size in bytes.
+        :return:
+        """
+        line = json.dumps({"files": files, "remote": remote_path, "size": size, "time": int(time.time())})
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(account), "a", encoding="utf8") as f:
+                f.write(line + "\n")
+
+    def locate(self) -> dict:
+        """
+        Reads every manifest
+        :return: dict of each local file to the (account, cloud path) tuple of its latest upload.
+        """
+        locations = {}
+        if not os.path.isdir(self.directory):
+            return locations
+        manifests = sorted(name for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+        entries = []
+        for name in manifests:
+            with open(os.path.join(self.directory, name), "r", encoding="utf8") as f:
+                entries.extend((name[:-len(".jsonl")], json.loads(line)) for line in f if line.strip())
+        for account, entry in sorted(entries, key=lambda item: item[1]["time"]):
+            for path in entry["files"]:
+                locations[path] = (account, entry["remote"])
+        return locations
+
+
+class AccountPool:
+    """
+    The accounts of a run and the queue of the files they share.
+    """
+
+    def __init__(self, accounts: list, manifest: Optional[Manifest] = None, log: Optional[Formatting] = None):
+        """
+        :param accounts: list of Account objects.
+        :param manifest: Manifest the uploaded files are recorded in.
+        :param log: Formatting object used for logging.
+        """
+        self.accounts = accounts
+        self.manifest = manifest or Manifest()
+        self.log = log or Formatting(timestamps=True)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_secrets(cls, settings: Settings, secrets: list, client: Optional[TeraboxClient] = None,
+                     log: Optional[Formatting] = None, **kwargs) -> "AccountPool":
+        """
+        Builds the clients of the accounts of secrets.json. They share one bandwidth limiter.
+        :param settings: Program settings. The "manifestdir" of its "accounts" section is the manifest directory.
+        :param secrets: list of accounts, as returned by load_accounts.
+        :param client: Client of the first account, if it was already built.
+        :param log: Formatting object used for logging.
+        :param kwargs: Other arguments of the clients.
+        :return: AccountPool object
+        """
+        accounts = []
+        for secret in secrets:
+            if accounts:
+                kwargs["throttle"] = accounts[0].client.throttle
+            elif client is not None:
+                accounts.append(Account(secret["name"], client))
+                continue
+            accounts.append(Account(secret["name"], TeraboxClient.from_settings(settings, secret, log=log, **kwargs)))
+        return cls(accounts, Manifest(settings.accounts.get("manifestdir", MANIFEST_DIR)), log)
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    @property
+    def healthy(self) -> list:
+        """
+        The accounts that are still uploading
+        """
+        return [account for account in self.accounts if not account.down]
+
+    def mark_down(self, account: Account, reason: str) -> None:
+        """
+        Takes an account out of the run
+        :param account: The account.
+        :param reason: Description of the error.
+        :return:
+        """
+        account.down = True
+        self.log.error("accounts", f"Account {account.name} stopped uploading: {reason}")
+        if self.healthy:
+            self.log.warning("accounts", f"Its files are uploaded by the other accounts: "
+                                         f"{', '.join(other.name for other in self.healthy)}.")
+
+    def take(self, account: Account, pending: list) -> Optional[dict]:
+        """
+        Takes the first queued file that fits in the available quota of an account
+        :param account: The account that is free.
+        :param pending: Queue of file entries, in upload order.
+        :return: The file entry, or None if no queued file fits.
+        """
+        try:
+            available = account.quota.available()
+        except (TransferError, CircuitOpenException) as e:
+            self.mark_down(account, f"its quota could not be checked ({e})")
+            return None
+        with self._lock:
+            for index, file in enumerate(pending):
+                if file['sizebytes'] <= available:
+                    return pending.pop(index)
+        return None
+
+    def put_back(self, file: dict, pending: list) -> None:
+        """
+        Queues a file again, for another account. It keeps its turn at the head of the queue.
+        :param file: The file entry.
+        :param pending: Queue of file entries, in upload order.
+        :return:
+        """
+        with self._lock:
+            pending.insert(0, file)
+
+    def record(self, account: Account, size: int, seconds: float) -> None:
+        """
+        Adds an uploaded file to the statistics of an account
+        :param account: The account.
+        :param size: Size of the file in bytes.
+        :param seconds: Time the upload took.
+        :return:
+        """
+        with self._lock:
+            account.uploaded_bytes += size
+            account.busy_seconds += seconds
+
+    def log_summary(self) -> None:
+        """
+        Logs the amount uploaded to each account
+        :return:
+        """
+        for account in self.accounts:
+            if account.uploaded_bytes:
+                self.log.info("accounts", f"Account {account.name}: uploaded {convert_size(account.uploaded_bytes)} "
+                                          f"at {convert_size(int(account.throughput))}/s.")
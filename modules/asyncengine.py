@@ -0,0 +1,410 @@
+"""
+TeraBox Uploader CLI: asyncengine.py
+This module is used to upload files with asyncio instead of blocking requests and curl processes.
+Remote listing, precreate, chunk upload, create and post-upload actions run as coroutines limited by semaphores,
+so thousands of files can be in flight from a single thread.
+It requires the optional aiohttp library.
+Used in: uploader.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional, the blocking engine is used without it
+    aiohttp = None
+
+from modules.client import TeraboxClient
+from modules.formatting import Formatting
+from modules.progress import Progress
+from modules.quota import QuotaTracker
+from modules.retry import MISSING_DIR_ERRNOS, TransferError, CircuitOpenException
+from modules.scheduler import PrioritySlots, Scheduler
+from modules.uploader import block_md5s
+
+READ_BLOCK = 1024 * 1024
+# Seconds to connect to a host, and seconds without any data from it once a request is sent. A transfer has no
+# total timeout, since the upload of a part takes as long as the bandwidth needs.
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+
+class AsyncEngineUnavailableException(Exception):
+    """
+    Exception raised when the asyncio engine is requested but aiohttp is not installed.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class AsyncUploadEngine:
+    """
+    Uploads files to Terabox using coroutines.
+    """
+
+    def __init__(self, client: TeraboxClient, remote_dir: str, concurrency: int = 16,
+                 api_concurrency: int = 8, max_file_size: Optional[int] = None, check_quota: bool = False,
+                 quota: Optional[QuotaTracker] = None,
+                 chunk_size: int = 120 * 1024 * 1024, split_threshold: int = 2147483648,
+                 progress: Optional[Progress] = None, log: Optional[Formatting] = None,
+                 scheduler: Optional[Scheduler] = None, hasher: Optional[Callable] = None,
+                 unchanged: Optional[Callable] = None):
+        """
+        :param client: Client of the account. Its session settings, upload host selector, retry policy and
+        throttle are shared with the engine.
+        :param remote_dir: Remote directory the files are uploaded to.
+        :param concurrency: Maximum amount of parts uploaded at the same time.
+        :param api_concurrency: Maximum amount of concurrent listing, precreate and create requests.
+        :param max_file_size: Files of this size or bigger are skipped. None disables the check.
+        :param check_quota: Checks the available quota before each file.
+        :param quota: Tracker of the available quota. If set, it is used for the checks instead of a quota request
+        per file.
+        :param chunk_size: Size of each part when a file is split.
+        :param split_threshold: Files of this size or bigger are split in parts.
+        :param progress: Tracker of the upload progress. The files are identified by the "path" of their entry.
+        :param log: Formatting object used for logging.
+        :param scheduler: Scheduler of the files. If it preempts, the free upload slots are given to the parts of the
+        most urgent files instead of the parts that asked first.
+        :param hasher: Blocking callable returning the MD5 hashes of the parts of the file of an item, given the item
+        and the size of the file, like a hasher that also hashes the blocks for the integrity manifest. The parts are
+        hashed with block_md5s if None.
+        :param unchanged: Blocking callable run with each item before its file is created on the cloud. It returns
+        False if the file changed since it was hashed, and the file then fails instead of being created.
+        """
+        if aiohttp is None:
+            raise AsyncEngineUnavailableException("The asyncio engine requires aiohttp. Install it with "
+                                                  "\"pip install aiohttp\".")
+        self.client = client
+        self.base_url = client.base_url
+        self.cookies = client.cookies
+        self.jstoken = client.jstoken
+        self.remote_dir = remote_dir
+        self.user_agent = client.user_agent
+        self.selector = client.selector
+        self.retry = client.retry
+        self.throttle = client.throttle
+        self.concurrency = concurrency
+        self.api_concurrency = api_concurrency
+        self.max_file_size = max_file_size
+        self.check_quota = check_quota or quota is not None
+        self.quota = quota
+        self.chunk_size = chunk_size
+        self.split_threshold = split_threshold
+        self.progress = progress or Progress()
+        self.log = log or Formatting(timestamps=True)
+        self.scheduler = scheduler or Scheduler()
+        self.hasher = hasher
+        self.unchanged = unchanged
+        self._session = None
+        self._upload_slots = None
+        self._api_sem = None
+        self._hash_sem = None
+        self._prepare_pool = None
+        self._stopped = False
+
+    @staticmethod
+    def _remote_key(path: str) -> str:
+        return "/" + path.replace("\\", "/").strip("/")
+
+    async def _api(self, operation: str, method: str, path: str, **kwargs) -> dict:
+        async def attempt() -> dict:
+            try:
+                async with self._api_sem:
+                    async with self._session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                        text = await response.text(errors="replace")
+                        status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise TransferError("exception", None, str(e) or type(e).__name__) from e
+            try:
+                data = json.loads(text)
+            except json.JSONDecodeError as e:
+                if status != 200:
+                    raise TransferError("http", status, text[:200]) from e
+                raise TransferError("exception", None, f"Invalid JSON response: {text[:200]}") from e
+            if status != 200:
+                raise TransferError("http", status, str(data))
+            if "errno" in data and data["errno"] != 0:
+                raise TransferError("errno", data["errno"], str(data.get("errmsg", data)))
+            return data
+
+        return await self.retry.run_async(operation, attempt)
+
+    async def list_remote(self, remote_dir: str) -> list:
+        """
+        Lists every file in the remote directory and its subdirectories, fetching the subdirectories concurrently
+        :param remote_dir: The remote directory.
+        :return: list of dicts with the name, path and size of each file.
+        """
+        items, subdirs, page = [], [], 1
+        while True:
+            data = await self._api("remote fetch", "GET", "/api/list", params={
+                "app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "5", "jsToken": self.jstoken,
+                "dir": self._remote_key(remote_dir), "num": "1000", "page": str(page), "order": "time",
+                "desc": "1", "showempty": "0"})
+            entries = data.get("list", [])
+            for entry in entries:
+                if entry["isdir"] == 1:
+                    subdirs.append(entry["path"])
+                else:
+                    items.append({"name": entry["server_filename"], "path": entry["path"], "size": entry["size"]})
+            if len(entries) < 1000:
+                break
+            page += 1
+        for result in await asyncio.gather(*(self.list_remote(subdir) for subdir in subdirs)):
+            items.extend(result)
+        return items
+
+    def _multipart_body(self, path: str, offset: int, length: int, filename: str,
+                        on_progress: Optional[Callable[[int], None]] = None):
+        boundary = uuid.uuid4().hex
+        head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+
+        async def body():
+            yield head
+            with open(path, "rb") as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    data = await asyncio.to_thread(f.read, min(READ_BLOCK, remaining))
+                    if not data:
+                        break
+                    delay = self.throttle.reserve(len(data))
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    remaining -= len(data)
+                    yield data
+                    if on_progress is not None:
+                        on_progress(length - remaining)
+            yield tail
+
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}",
+                   "Content-Length": str(len(head) + length + len(tail))}
+        return body, headers
+
+    async def _upload_part(self, key: str, path: str, offset: int, length: int, cloud_relative: str,
+                           uploadid: str, md5hash: str, partseq: int, rank: tuple = ()) -> str:
+        async def attempt() -> str:
+            host = self.selector.current()
+            on_progress = self.progress.callback(key, partseq)
+            on_progress(0)
+            body, headers = self._multipart_body(path, offset, length, os.path.basename(cloud_relative),
+                                                 on_progress)
+            params = {"method": "upload", "type": "tmpfile", "app_id": "250528",
+                      "path": f"{self.remote_dir}/{cloud_relative}", "uploadid": uploadid, "partseq": str(partseq)}
+            limit = self.throttle.limit
+            self.throttle.start_transfer()
+            concurrency = self.throttle.active
+            sent, started = 0, time.monotonic()
+            try:
+                async with self._upload_slots.slot(rank):
+                    async with self._session.post(f"{host}/rest/2.0/pcs/superfile2", params=params, data=body(),
+                                                  headers={**headers, "Origin": self.base_url,
+                                                           "Referer": f"{self.base_url}/main?category=all"}) \
+                            as response:
+                        text = await response.text(errors="replace")
+                        status = response.status
+                sent = length
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.selector.report(host, 0, time.monotonic() - started, False)
+                raise TransferError("exception", None, str(e) or type(e).__name__) from e
+            finally:
+                self.throttle.end_transfer(sent)
+            self.selector.report(host, length, time.monotonic() - started, status < 500, concurrency, limit)
+            try:
+                uresp = json.loads(text)
+            except json.JSONDecodeError as e:
+                if status != 200:
+                    raise TransferError("http", status, text[:200]) from e
+                raise TransferError("exception", None, f"Invalid JSON response: {text[:200]}") from e
+            if status != 200:
+                raise TransferError("http", status, str(uresp))
+            if "error_code" in uresp:
+                raise TransferError("errno", uresp["error_code"], str(uresp))
+            if uresp.get("md5") != md5hash:
+                raise TransferError("md5", None, f"MD5 hash mismatch for cloud file {cloud_relative} after upload.")
+            return uresp["md5"]
+
+        return await self.retry.run_async("upload", attempt)
+
+    async def _available_quota(self) -> int:
+        if self.quota is not None:
+            return await asyncio.to_thread(self.quota.available)
+        data = await self._api("quota", "GET", "/api/quota", params={"checkfree": "1"})
+        return data["total"] - data["used"]
+
+    async def _process(self, item: dict, remote_paths: set, post_upload: Optional[Callable],
+                       prepare: Optional[Callable] = None) -> str:
+        """
+        Uploads a single file
+        :param item: dict with the "file" entry, its "local_path" and its "cloud_relative" path.
+        :param remote_paths: Paths of the files that already exist on the cloud.
+        :param post_upload: Blocking callable run with the item after the file is created on the cloud.
+        :param prepare: Blocking callable run with the item before its local file is read.
+        :return: "uploaded", "skipped" or "failed".
+        """
+        if self._stopped:
+            return "failed"
+        file, local_path, cloud_relative = item["file"], item["local_path"], item["cloud_relative"]
+        key = file["path"]
+        if self._remote_key(f"{self.remote_dir}/{cloud_relative}") in remote_paths:
+            self.log.warning("upload", f"File {cloud_relative} already exists on the cloud. Skipping file...")
+            return "skipped"
+        if prepare is not None:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(self._prepare_pool, prepare, item):
+                return "failed"
+        if not os.path.exists(local_path):
+            self.log.error("upload", f"File {local_path} does not exist on the source directory anymore. "
+                                     f"Skipping file...")
+            return "failed"
+        size = os.path.getsize(local_path)
+        if self.max_file_size is not None and size >= self.max_file_size:
+            self.log.error("upload", f"File {file['name']} is too big for the type of account you have. "
+                                     f"Skipping file...")
+            return "failed"
+
+        try:
+            if self.check_quota and await self._available_quota() < size:
+                self.log.error("quota", f"Not enough quota available for file {file['name']}.")
+                return "failed"
+
+            self.progress.stage(key, "hash")
+            async with self._hash_sem:
+                if self.hasher is not None:
+                    md5s = await asyncio.to_thread(self.hasher, item, size)
+                else:
+                    md5s = await asyncio.to_thread(block_md5s, local_path, size, self.chunk_size,
+                                                   self.split_threshold)
+            md5json = json.dumps(md5s)
+
+            self.progress.stage(key, "precreate")
+            precreate = await self._api("precreate", "POST", "/api/precreate", data={
+                "app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "0", "jsToken": self.jstoken,
+                "path": f"{self.remote_dir}/{cloud_relative}", "autoinit": "1", "target_path": self.remote_dir,
+                "block_list": md5json})
+            if "uploadid" not in precreate:
+                raise TransferError("exception", None, f"No upload ID in response: {precreate}")
+            uploadid = precreate["uploadid"]
+
+            self.progress.stage(key, "upload")
+            part_size = self.chunk_size if len(md5s) > 1 else size
+            for partseq, md5hash in enumerate(md5s):
+                offset = partseq * part_size
+                length = min(part_size, size - offset)
+                self.progress.start_transfer(key, partseq, cloud_relative if len(md5s) == 1 else
+                                             f"{cloud_relative} part {partseq + 1}/{len(md5s)}", length)
+                try:
+                    await self._upload_part(key, local_path, offset, length, cloud_relative, uploadid, md5hash,
+                                            partseq, item.get("rank", ()))
+                except BaseException:
+                    self.progress.end_transfer(key, partseq, False)
+                    raise
+                self.progress.end_transfer(key, partseq, True)
+            self.log.success("upload", f"File {cloud_relative} uploaded successfully to cloud path "
+                                       f"{self.remote_dir}/{cloud_relative}.")
+
+            cloudpath = f"{self.remote_dir}/{cloud_relative}".replace("\\", "/")
+            if self.unchanged is not None and not await asyncio.to_thread(self.unchanged, item):
+                return "failed"
+            self.progress.stage(key, "create")
+            await self._api("create", "POST", "/api/create",
+                            params={"isdir": "0", "rtype": "1", "app_id": "250528", "jsToken": self.jstoken},
+                            data={"path": cloudpath, "uploadid": uploadid, "target_path": f"{self.remote_dir}/",
+                                  "size": str(size), "block_list": md5json})
+            if self.quota is not None:
+                self.quota.consume(size)
+            self.log.success("upload", f"The file is now available at {cloudpath} in the cloud.")
+        except CircuitOpenException as e:
+            if not self._stopped:
+                self._stopped = True
+                self.log.error("auth", str(e))
+                self.log.error("auth", "Stopping the upload of the remaining files.")
+            return "failed"
+        except TransferError as e:
+            if e.kind == "md5":
+                file["md5mismatch"] = True
+            self.log.error("upload", f"File {file['name']} upload failed.")
+            self.log.error("upload", f"More information about this error: {e}")
+            return "failed"
+        except OSError as e:
+            self.log.error("upload", f"File {file['name']} could not be read.")
+            self.log.error("upload", f"More information about this error: {e}")
+            return "failed"
+
+        self.progress.stage(key, "post")
+        if post_upload is not None and not await asyncio.to_thread(post_upload, item):
+            return "failed"
+        return "uploaded"
+
+    async def run(self, items: list, post_upload: Optional[Callable] = None, prepare: Optional[Callable] = None,
+                  finished: Optional[Callable] = None, listing: Optional[list] = None) -> list:
+        """
+        Uploads every item
+        :param items: list of dicts with the "file" entry, its "local_path" and its "cloud_relative" path, in upload
+        order.
+        :param post_upload: Blocking callable run with each item after it is created on the cloud. It returns True
+        on success.
+        :param prepare: Blocking callable run with each item that isn't on the cloud yet, before its local file is
+        read, like the encryption of the file. It returns True on success and can wait for temp space, so it runs in
+        its own threads.
+        :param finished: Blocking callable run with each item once it is uploaded, skipped or failed.
+        :param listing: Files in the remote directory, if it was already listed, as returned by list_directory.
+        :return: list with the outcome ("uploaded", "skipped" or "failed") of each item.
+        """
+        self._upload_slots = PrioritySlots(self.concurrency)
+        for index, item in enumerate(items):
+            item["rank"] = (self.scheduler.urgency(item["file"]) if self.scheduler.preempt else (), index)
+        self._api_sem = asyncio.Semaphore(self.api_concurrency)
+        self._hash_sem = asyncio.Semaphore(max(1, os.cpu_count() or 1))
+        connector = aiohttp.TCPConnector(limit=self.concurrency + self.api_concurrency)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        async with aiohttp.ClientSession(headers={"User-Agent": self.user_agent}, cookies=self.cookies,
+                                         connector=connector, timeout=timeout) as session:
+            self._session = session
+            try:
+                if listing is None:
+                    listing = await self.list_remote(self.remote_dir)
+                    self.client.remember_listing(self.remote_dir, listing)
+                remote_paths = {self._remote_key(entry["path"]) for entry in listing}
+            except TransferError as e:
+                self.log.error("remote fetch", f"Couldn't fetch remote directory: {e}")
+                # Without the listing every file would be uploaded again
+                listing = [] if e.code in MISSING_DIR_ERRNOS else self.client.fallback_listing(self.remote_dir)
+                if listing is None:
+                    return ["failed"] * len(items)
+                remote_paths = {self._remote_key(entry["path"]) for entry in listing}
+            except CircuitOpenException as e:
+                self.log.error("auth", str(e))
+                return ["failed"] * len(items)
+            with ThreadPoolExecutor(max(1, os.cpu_count() or 1), thread_name_prefix="prepare") as pool:
+                self._prepare_pool = pool
+                return list(await asyncio.gather(*(self._tracked(item, remote_paths, post_upload, prepare, finished)
+                                                   for item in items)))
+
+    async def _tracked(self, item: dict, remote_paths: set, post_upload: Optional[Callable],
+                       prepare: Optional[Callable] = None, finished: Optional[Callable] = None) -> str:
+        try:
+            status = await self._process(item, remote_paths, post_upload, prepare)
+        finally:
+            if finished is not None:
+                await asyncio.to_thread(finished, item)
+        self.progress.finish(item["file"]["path"], "mismatch" if item["file"].get("md5mismatch") else status,
+                             item["file"]["sizebytes"])
+        return status
@@ -0,0 +1,298 @@
+"""
+TeraBox Uploader CLI: benchmark.py
+This module is used to measure the upload speed of the program against the local mock Terabox server, so that
+performance regressions become visible. Every workload generates its files in a temporary directory and uploads
+them with the real Uploader, the only difference being the server.
+It also measures the encryption and decryption speed of each key type and buffer size on the current machine.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+from modules.formatting import Formatting, convert_size
+from modules.logbackend import ConsoleSink, LogBackend
+from modules.mockserver import MockTerabox
+
+WORKLOADS = {
+    "small": {"files": 500, "size": 16 * 1024, "encrypted": False},
+    "large": {"files": 1, "size": 256 * 1024 * 1024, "encrypted": False},
+    "encrypted": {"files": 20, "size": 4 * 1024 * 1024, "encrypted": True},
+    # Bundles written ahead of their upload fill the temp budget, and an encrypted file bigger than the budget must
+    # still be uploaded instead of waiting for them forever
+    "budget": {"files": 40, "size": 50 * 1024, "encrypted": True, "large": 3 * 1024 * 1024,
+               "settings": {"packing": {"enabled": "true", "threshold": "100KB", "bundlesize": "600KB"},
+                            "temp": {"budget": "1MB"}}},
+}
+# A result slower than the baseline by more than this fraction is reported as a regression
+REGRESSION_THRESHOLD = 0.1
+FILL_BLOCK = 1024 * 1024
+BUFFER_SIZES = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+ENCRYPTION_FILE_SIZES = [1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+# Raw key sizes that get_key_type reads as an AES and a Fernet key
+KEY_SIZES = {"AES": 32, "Fernet": 24}
+
+
+def _workdir() -> str:
+    # Encryption.encrypt_file treats every path containing "enc" as already encrypted
+    while True:
+        path = tempfile.mkdtemp(prefix="terabox-perf-")
+        if "enc" not in path:
+            return path
+        os.rmdir(path)
+
+
+def _write_files(directory: str, files: int, size: int) -> None:
+    os.makedirs(directory)
+    block = os.urandom(min(size, FILL_BLOCK))
+    for index in range(files):
+        with open(os.path.join(directory, f"file{index:05d}.bin"), "wb") as f:
+            # The index makes every file different, so no two files have the same MD5 hash
+            f.write(index.to_bytes(8, "big"))
+            remaining = size - 8
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+
+def run_workload(name: str, server: MockTerabox, files: int, size: int, encrypted: bool = False,
+                 engine: str = "sync", log: Optional[Formatting] = None, large: int = 0,
+                 extra: Optional[dict] = None) -> dict:
+    """
+    Uploads a generated set of files to the mock server and measures the throughput
+    :param name: Name of the workload.
+    :param server: Running mock server.
+    :param files: Amount of files.
+    :param size: Size of each file in bytes.
+    :param encrypted: If True, the files are encrypted before the upload, like with encryption enabled.
+    :param engine: Upload engine, "sync" or "async".
+    :param log: Formatting object used by the uploader. Defaults to errors only.
+    :param large: Size in bytes of one more file uploaded with the others. No such file if 0.
+    :param extra: Sections of settings.json added to the settings of the run.
+    :return: dict with the measurements of the run.
+    """
+    from modules.client import TeraboxClient
+    from modules.config import Settings
+    from modules.uploader import Uploader
+
+    log = log or Formatting(timestamps=True, backend=LogBackend([ConsoleSink("error")]))
+    workdir = _workdir()
+    previous_dir = os.getcwd()
+    try:
+        # Encryption writes to ./temp, so the run happens inside the work directory
+        os.chdir(workdir)
+        _write_files("src", files, size)
+        if large:
+            _write_files(os.path.join("src", "large"), 1, large)
+        settings = {"directories": {"sourcedir": "src", "remotedir": f"/benchmark/{name}-{int(time.time())}"},
+                    "encryption": {"enabled": str(encrypted).lower(), "encryptionkey": "perf.key"},
+                    "upload": {"hosts": [server.url], "engine": engine},
+                    "cache": {"file": "cache.json"},
+                    "appearance": {"progress": "false"}, **(extra or {})}
+        if encrypted:
+            from modules.encryption import Encryption
+
+            Encryption.generate_key("perf.key", password="benchmark")
+        settings = Settings(settings)
+        client = TeraboxClient.from_settings(settings, {"jstoken": "benchmark", "cookies": {"ndus": "benchmark"}},
+                                             log=log, base_url=server.url)
+        started = time.monotonic()
+        result = Uploader(client, settings, log=log).upload_paths(["src"])
+        seconds = time.monotonic() - started
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    files, total = files + bool(large), files * size + large
+    return {"workload": name, "engine": engine, "files": files, "bytes": total, "seconds": round(seconds, 3),
+            "files_per_second": round(files / seconds, 2) if seconds else 0.0,
+            "mb_per_second": round(total / seconds / 1048576, 2) if seconds else 0.0,
+            "uploaded": len(result.uploaded), "failed": len(result.failed),
+            "retries": sum(client.retry.retry_counts.values())}
+
+
+def compare(results: list, baseline: list) -> list:
+    """
+    Compares the results with the results of a previous run
+    :param results: Results of this run.
+    :param baseline: Results of the previous run.
+    :return: list of (result, previous MB/s, change) tuples of the slower workloads.
+    """
+    previous = {(entry["workload"], entry["engine"]): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["workload"], result["engine"]))
+        if not before or not before["mb_per_second"]:
+            continue
+        change = result["mb_per_second"] / before["mb_per_second"] - 1
+        if change < -REGRESSION_THRESHOLD:
+            regressions.append((result, before["mb_per_second"], change))
+    return regressions
+
+
+def run_benchmark(workloads: list, engine: str = "sync", files: Optional[int] = None, size: Optional[int] = None,
+                  server: Optional[MockTerabox] = None, output: str = "", baseline: str = "",
+                  log: Optional[Formatting] = None) -> bool:
+    """
+    Runs the workloads and logs a table of the results
+    :param workloads: Names of the workloads (see WORKLOADS).
+    :param engine: Upload engine, "sync" or "async".
+    :param files: Amount of files of each workload, instead of its default.
+    :param size: Size of the files of each workload in bytes, instead of its default.
+    :param server: Mock server to use. A new one without latency and errors is used if None.
+    :param output: Path of a JSON file to save the results to.
+    :param baseline: Path of the JSON file of a previous run to compare the results with.
+    :param log: Formatting object used for logging.
+    :return: True if every file was uploaded and no workload is slower than the baseline.
+    """
+    log = log or Formatting(timestamps=True)
+    server = server or MockTerabox(log=log)
+    server.start()
+    results = []
+    try:
+        for name in workloads:
+            workload = WORKLOADS[name]
+            count, file_size = files or workload["files"], size or workload["size"]
+            log.info("benchmark", f"Running the {name} workload: {count} files of {convert_size(file_size)} with "
+                                  f"the {engine} engine...")
+            results.append(run_workload(name, server, count, file_size, workload["encrypted"], engine,
+                                        large=workload.get("large", 0), extra=workload.get("settings")))
+    finally:
+        server.stop()
+
+    log.info("benchmark", f"{'workload':<10} {'engine':<6} {'files':>6} {'size':>10} {'seconds':>8} "
+                          f"{'files/s':>9} {'MB/s':>8} {'failed':>6} {'retries':>7}")
+    for result in results:
+        log.info("benchmark", f"{result['workload']:<10} {result['engine']:<6} {result['files']:>6} "
+                              f"{convert_size(result['bytes']):>10} {result['seconds']:>8.2f} "
+                              f"{result['files_per_second']:>9.1f} {result['mb_per_second']:>8.1f} "
+                              f"{result['failed']:>6} {result['retries']:>7}")
+    ok = all(not result["failed"] for result in results)
+
+    if baseline:
+        with open(baseline, "r", encoding="utf8") as f:
+            for result, before, change in compare(results, json.load(f)):
+                log.warning("benchmark", f"The {result['workload']} workload is {-change:.0%} slower than the "
+                                         f"baseline ({result['mb_per_second']} MB/s instead of {before} MB/s).")
+                ok = False
+    if output:
+        with open(output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+        log.success("benchmark", f"Results saved to {output}.")
+    return ok
+
+
+def _best_time(function, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_encryption(buffer_sizes: Optional[list] = None, file_sizes: Optional[list] = None,
+                         modes: Optional[list] = None, repeat: int = 3) -> list:
+    """
+    Measures the encryption and decryption speed of each key type, buffer size and file size. Fernet keys encrypt
+    the whole file at once, so they are only measured once per file size.
+    :param buffer_sizes: Buffer sizes of the AES mode in bytes.
+    :param file_sizes: File sizes in bytes.
+    :param modes: Key types, "AES" and/or "Fernet".
+    :param repeat: Amount of runs of each measurement. The fastest one is kept.
+    :return: list of dicts with the mode, buffer size, file size and the encrypt and decrypt speed in MB/s.
+    """
+    from modules.encryption import Encryption
+
+    buffer_sizes = buffer_sizes or BUFFER_SIZES
+    file_sizes = file_sizes or ENCRYPTION_FILE_SIZES
+    workdir = _workdir()
+    previous_dir = os.getcwd()
+    results = []
+    try:
+        # Encryption writes to ./temp, so the measurements happen inside the work directory
+        os.chdir(workdir)
+        os.mkdir("temp")
+        for mode in modes or list(KEY_SIZES):
+            keypath = f"{mode.lower()}.key"
+            with open(keypath, "wb") as f:
+                f.write(base64.urlsafe_b64encode(os.urandom(KEY_SIZES[mode])))
+            for file_size in file_sizes:
+                _write_files("src", 1, file_size)
+                source = os.path.join("src", "file00000.bin")
+                encrypted = os.path.join("temp", "file00000.bin.enc")
+                for buffer_size in (buffer_sizes if mode == "AES" else [None]):
+                    encrypt = Encryption(buffer_size)
+                    encrypt_time = _best_time(lambda: encrypt.encrypt_file(keypath, source), repeat)
+                    decrypt_time = _best_time(lambda: encrypt.decrypt_file(keypath, encrypted), repeat)
+                    results.append({"mode": mode, "buffer": buffer_size, "size": file_size,
+                                    "encrypt_mb_per_second": round(file_size / encrypt_time / 1048576, 1),
+                                    "decrypt_mb_per_second": round(file_size / decrypt_time / 1048576, 1)})
+                shutil.rmtree("src")
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def best_buffer_size(results: list) -> Optional[int]:
+    """
+    Returns the AES buffer size that encrypts and decrypts every file size in the least time
+    :param results: Results of benchmark_encryption.
+    :return: Buffer size in bytes, or None if no AES buffer size was measured.
+    """
+    times = {}
+    for result in results:
+        if result["mode"] == "AES":
+            size = result["size"]
+            seconds = size / result["encrypt_mb_per_second"] + size / result["decrypt_mb_per_second"]
+            times[result["buffer"]] = times.get(result["buffer"], 0.0) + seconds
+    return min(times, key=times.get) if times else None
+
+
+def run_encryption_benchmark(buffer_sizes: Optional[list] = None, file_sizes: Optional[list] = None,
+                             modes: Optional[list] = None, repeat: int = 3, save: str = "",
+                             log: Optional[Formatting] = None) -> Optional[int]:
+    """
+    Runs the encryption benchmark and logs a table of the results
+    :param buffer_sizes: Buffer sizes of the AES mode in bytes.
+    :param file_sizes: File sizes in bytes.
+    :param modes: Key types, "AES" and/or "Fernet".
+    :param repeat: Amount of runs of each measurement.
+    :param save: Path of the settings.json file the best buffer size is saved to. Not saved if empty.
+    :param log: Formatting object used for logging.
+    :return: The best AES buffer size in bytes, or None if AES was not measured.
+    """
+    log = log or Formatting(timestamps=True)
+    log.info("benchmark", "Measuring the encryption speed. This can take a minute...")
+    results = benchmark_encryption(buffer_sizes, file_sizes, modes, repeat)
+    log.info("benchmark", f"{'mode':<7} {'buffer':>10} {'file size':>10} {'encrypt MB/s':>13} {'decrypt MB/s':>13}")
+    for result in results:
+        buffer = convert_size(result["buffer"]) if result["buffer"] else "whole file"
+        log.info("benchmark", f"{result['mode']:<7} {buffer:>10} {convert_size(result['size']):>10} "
+                              f"{result['encrypt_mb_per_second']:>13.1f} {result['decrypt_mb_per_second']:>13.1f}")
+    best = best_buffer_size(results)
+    if best is None:
+        return None
+    log.success("benchmark", f"Fastest AES buffer size on this machine: {convert_size(best)}.")
+    if save:
+        with open(save, "r", encoding="utf8") as f:
+            content = json.load(f)
+        content.setdefault("encryption", {})["buffersize"] = str(best)
+        with open(save, "w", encoding="utf8") as f:
+            json.dump(content, f, indent=2)
+        log.success("benchmark", f"Buffer size saved to {save}.")
+    return best
@@ -0,0 +1,122 @@
+"""
+TeraBox Uploader CLI: cache.py
+This module is used to keep the results of slow startup checks (account type, curl location) between runs, and the
+last listing of the remote directory for the plan command.
+The values are stored in a small JSON file and expire after a configurable time.
+Used in: client.py, curl.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+CACHE_FILE = ".terabox-cache.json"
+DEFAULT_TTL = 86400
+
+
+class Cache:
+    """
+    Key/value store persisted in a JSON file. Every value has the time it was stored, so readers can ignore
+    values older than their time-to-live.
+    """
+
+    def __init__(self, path: Optional[str] = CACHE_FILE, ttl: float = DEFAULT_TTL):
+        """
+        :param path: Path of the cache file. With None, the values are only kept in memory.
+        :param ttl: Default time-to-live of the values in seconds. With 0, nothing is read from the cache.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._data = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "Cache":
+        """
+        Builds the cache from the "cache" section of settings.json
+        :param section: dict with the optional "file" and "ttl" keys.
+        :return: Cache object
+        """
+        return cls(section.get("file", CACHE_FILE) or None, float(section.get("ttl", DEFAULT_TTL)))
+
+    @staticmethod
+    def account_key(name: str, cookies: dict) -> str:
+        """
+        Returns a cache key bound to an account, without storing its session cookie
+        :param name: Name of the value.
+        :param cookies: Cookies of the session.
+        :return: Cache key.
+        """
+        return f"{name}:{hashlib.sha256(str(cookies.get('ndus', '')).encode()).hexdigest()[:16]}"
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self._data = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf8") as f:
+                        data = json.load(f)
+                    if isinstance(data, dict):
+                        self._data = data
+                except (OSError, json.JSONDecodeError):
+                    pass
+        return self._data
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Any:
+        """
+        Returns a value of the cache
+        :param key: Key of the value.
+        :param ttl: Time-to-live of the value in seconds. Defaults to the TTL of the cache.
+        :return: The value, or None if it is missing or expired.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._load().get(key)
+        if not isinstance(entry, dict) or time.time() - entry.get("time", 0) > ttl:
+            return None
+        return entry.get("value")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf8") as f:
+                json.dump(self._data, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a value in the cache and writes the cache file
+        :param key: Key of the value.
+        :param value: JSON serializable value.
+        :return:
+        """
+        with self._lock:
+            self._load()[key] = {"value": value, "time": time.time()}
+            self._save()
+
+    def invalidate(self, key: str) -> None:
+        """
+        Removes a value from the cache
+        :param key: Key of the value.
+        :return:
+        """
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
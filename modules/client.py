@@ -0,0 +1,504 @@
+"""
+TeraBox Uploader CLI: client.py
+This module is used to talk to the Terabox API: listing, quota, membership, precreate, upload and create requests,
+and the file manager requests that move, copy, rename and delete remote files.
+No request is made until one of its methods is called, and the requests library is only imported then.
+Used in: main.py, uploader.py, remote.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import quote_plus
+
+from modules.cache import Cache
+from modules.config import Settings, SettingsException, load_secrets
+from modules.curl import ensure_curl
+from modules.endpoints import EndpointSelector
+from modules.formatting import Formatting
+from modules.progress import parse_curl_size
+from modules.retry import RetryPolicy, TransferError
+from modules.throttle import Throttle, BandwidthSettingException
+from modules.tracing import get_tracer
+
+USERAGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.2; rv:121.0) Gecko/20100101 Firefox/121.0"
+BASEURLTB = "https://www.terabox.com"
+# Errno of a file manager request where only some of the entries failed
+PARTIAL_ERRNO = 12
+
+
+class TeraboxClient:
+    """
+    Client of the Terabox web API for a single account.
+    """
+
+    def __init__(self, jstoken: str, cookies: dict, base_url: str = BASEURLTB, user_agent: str = USERAGENT,
+                 retry: Optional[RetryPolicy] = None, throttle: Optional[Throttle] = None,
+                 selector: Optional[EndpointSelector] = None, curl_binary: Optional[str] = None,
+                 cache: Optional[Cache] = None, log: Optional[Formatting] = None):
+        """
+        :param jstoken: JS token of the session.
+        :param cookies: Cookies of the session.
+        :param base_url: Base URL of the Terabox website.
+        :param user_agent: User-Agent header used for the requests.
+        :param retry: Retry policy of the requests.
+        :param throttle: Bandwidth limiter of the uploads.
+        :param selector: Selector of the upload host. Defaults to the c-jp upload host of base_url.
+        :param curl_binary: curl executable used for the uploads. Found (or installed) on the first upload if None.
+        :param cache: Cache of the account type and of the curl location between runs. Not used if None.
+        :param log: Formatting object used for logging.
+        """
+        self.jstoken = jstoken
+        self.cookies = cookies
+        self.cookies_str = "".join(f"{key}={value};" for key, value in cookies.items())
+        self.base_url = base_url
+        self.user_agent = user_agent
+        self.log = log or Formatting(timestamps=True)
+        self.retry = retry or RetryPolicy(log=self.log)
+        self.throttle = throttle or Throttle()
+        self.selector = selector or EndpointSelector([base_url.replace("www", "c-jp")], log=self.log)
+        self.curl_binary = curl_binary
+        self.cache = cache
+        self._session = None
+        self._vip = None
+        self._host_probed = False
+        self._lock = threading.Lock()
+        self._vip_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        requests session of the client, created on first use
+        """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            self._session.headers["User-Agent"] = self.user_agent
+        return self._session
+
+    @classmethod
+    def from_secrets(cls, path: str = "secrets.json", **kwargs) -> "TeraboxClient":
+        """
+        Builds a client from a secrets.json file
+        :param path: Path of the secrets.json file.
+        :param kwargs: Other arguments of the client.
+        :return: TeraboxClient object
+        """
+        secrets = load_secrets(path)
+        return cls(secrets["jstoken"], secrets["cookies"], **kwargs)
+
+    @classmethod
+    def from_settings(cls, settings: Settings, secrets: dict, log: Optional[Formatting] = None,
+                      **kwargs) -> "TeraboxClient":
+        """
+        Builds a client with the bandwidth, retry, upload host and cache settings of settings.json
+        :param settings: Program settings.
+        :param secrets: dict with the "jstoken" and the "cookies" of the session, as returned by load_secrets.
+        :param log: Formatting object used for logging.
+        :param kwargs: Other arguments of the client. A "throttle" replaces the one of the bandwidth settings, to share
+        it between clients.
+        :return: TeraboxClient object
+        """
+        log = log or Formatting(timestamps=True)
+        base_url = kwargs.pop("base_url", BASEURLTB)
+        upload = settings.upload
+        try:
+            # The accounts of a run share one bandwidth limit
+            throttle = kwargs.pop("throttle", None) or Throttle.from_settings(settings.bandwidth)
+            retry = RetryPolicy.from_settings(settings.retry, log=log)
+            selector = EndpointSelector(
+                upload.get("hosts", []) or [base_url.replace("www", "c-jp")],
+                locate_url=(f"{base_url.replace('www', 'd')}/rest/2.0/pcs/file?method=locateupload"
+                            if upload.get("locateupload", "false").lower() == "true" else ""),
+                probe_size=int(upload.get("probesize", "0")),
+                log=log,
+            )
+            cache = Cache.from_settings(settings.cache)
+        except (BandwidthSettingException, KeyError, ValueError) as e:
+            raise SettingsException(f"Invalid bandwidth, retry, upload or cache settings in settings.json: "
+                                    f"{e}") from e
+        return cls(secrets["jstoken"], secrets["cookies"], base_url=base_url, retry=retry, throttle=throttle,
+                   selector=selector, cache=cache, log=log, **kwargs)
+
+    @staticmethod
+    def _api_response(response, accept: tuple = ()) -> dict:
+        """
+        Checks the HTTP status and the errno of a Terabox API response
+        :param response: The response of the request.
+        :param accept: Errnos returned as a response instead of raising, like the partial failure of a batch.
+        :return: The decoded JSON response. Raises TransferError if the request failed.
+        """
+        try:
+            data = json.loads(response.text)
+        except json.JSONDecodeError as e:
+            if response.status_code != 200:
+                raise TransferError("http", response.status_code, response.text[:200]) from e
+            raise TransferError("exception", None, f"Invalid JSON response: {response.text[:200]}") from e
+        if response.status_code != 200:
+            raise TransferError("http", response.status_code, str(data))
+        if "errno" in data and data["errno"] != 0 and data["errno"] not in accept:
+            raise TransferError("errno", data["errno"], str(data.get("errmsg", data)))
+        return data
+
+    def request(self, operation: str, method: str, path: str, accept: tuple = (), attempts: Optional[int] = None,
+                **kwargs) -> dict:
+        """
+        Makes a request to the Terabox API, retrying it according to the retry policy
+        :param operation: Name of the operation, used for logging.
+        :param method: HTTP method of the request.
+        :param path: Path of the API endpoint (e.g. /api/list) or full URL.
+        :param accept: Errnos that are not an error for this request.
+        :param attempts: Amount of attempts, instead of the one of the retry policy.
+        :return: The decoded JSON response. Raises TransferError if the request failed.
+        """
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        kwargs.setdefault("cookies", self.cookies)
+        kwargs.setdefault("timeout", 10)
+
+        import requests
+
+        def attempt() -> dict:
+            try:
+                with get_tracer().span(operation, "api"):
+                    response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                raise TransferError("exception", None, str(e)) from e
+            return self._api_response(response, accept)
+
+        return self.retry.run(operation, attempt, attempts)
+
+    def is_vip(self) -> bool:
+        """
+        Checks if the account is a VIP account. The answer is kept for the lifetime of the client, and in the
+        cache between runs.
+        :return: True if the account is a VIP account.
+        """
+        # Parallel upload jobs share the client, so only the first one asks
+        with self._vip_lock:
+            if self._vip is None:
+                key = Cache.account_key("vip", self.cookies)
+                cached = self.cache.get(key) if self.cache is not None else None
+                if cached is not None:
+                    self._vip = bool(cached)
+                    return self._vip
+                self.log.info("vip", "Checking if you are a VIP user...")
+                data = self.request("vip", "GET", "/rest/2.0/membership/proxy/user?method=query",
+                                    headers={"Origin": self.base_url, "Referer": self.base_url + "/main?category=all",
+                                             "Content-Type": "application/x-www-form-urlencoded"},
+                                    timeout=19)
+                self._vip = data["data"]["member_info"]["is_vip"] == 1
+                self.log.success("vip", f"You are a {'vip' if self._vip else 'non-vip'} user.")
+                if self.cache is not None:
+                    self.cache.set(key, self._vip)
+        return self._vip
+
+    def max_file_size(self) -> int:
+        """
+        Returns the size from which files are too big for the account
+        :return: Size in bytes.
+        """
+        return 21474836479 if self.is_vip() else 4294967296
+
+    def quota(self) -> int:
+        """
+        Returns the available quota of the account
+        :return: Available quota in bytes.
+        """
+        data = self.request("quota", "GET", "/api/quota?checkfree=1")
+        return data['total'] - data['used']
+
+    def list_entries(self, remote_dir: str) -> list:
+        """
+        Returns the entries of a single remote directory, reading every page of the listing
+        :param remote_dir: The remote directory.
+        :return: list of the entries returned by /api/list (files and directories).
+        """
+        entries, page = [], 1
+        while True:
+            data = self.request("remote fetch", "GET", "/api/list",
+                                headers={"Referer": self.base_url + "/main"},
+                                params={
+                                    "app_id": "250528",
+                                    "web": "1",
+                                    "channel": "dubox",
+                                    "clienttype": "5",  # This changed from 0 to 5 in 2025
+                                    "jsToken": f"{self.jstoken}",
+                                    "dir": "/" + remote_dir.strip("/"),  # Leading slash is now required
+                                    "num": "1000",
+                                    "page": str(page),
+                                    "order": "time",
+                                    "desc": "1",
+                                    "showempty": "0"
+                                })
+            listed = data.get("list", [])
+            entries.extend(listed)
+            if len(listed) < 1000:
+                return entries
+            page += 1
+
+    def list_directory(self, remote_dir: str) -> list:
+        """
+        Returns all the files in the remote directory and its subdirectories
+        :param remote_dir: The remote directory.
+        :return: list of dicts with the name, path and size of each file.
+        """
+        items = []
+        for entry in self.list_entries(remote_dir):
+            if entry["isdir"] == 1:
+                items.extend(self.list_directory(entry["path"]))
+            else:
+                items.append({"name": entry["server_filename"], "path": entry["path"], "size": entry["size"]})
+        return items
+
+    def remember_listing(self, remote_dir: str, files: list, merge: bool = False) -> None:
+        """
+        Stores the listing of a remote directory in the cache, for the commands that must not make requests
+        :param remote_dir: The remote directory.
+        :param files: list of dicts with the path and size of each file, as returned by list_directory.
+        :param merge: If True, the files are added to the listing in the cache, which keeps the time it was made.
+        Nothing is stored if the directory was never listed.
+        :return:
+        """
+        if self.cache is None:
+            return
+        key = Cache.account_key(f"listing:{remote_dir}", self.cookies)
+        listing = {"time": time.time(), "files": {}}
+        if merge:
+            cached = self.cache.get(key, ttl=float("inf"))
+            if not isinstance(cached, dict):
+                return
+            listing = {"time": cached.get("time", 0), "files": dict(cached.get("files", []))}
+        listing["files"].update((file["path"], file["size"]) for file in files)
+        self.cache.set(key, {"time": listing["time"], "files": sorted(listing["files"].items())})
+
+    def cached_listing(self, remote_dir: str) -> Optional[tuple]:
+        """
+        Returns the last listing of a remote directory stored in the cache, without any request. It is used whatever
+        its age, unless the cache is disabled.
+        :param remote_dir: The remote directory.
+        :return: (list of dicts with the path and size of each file, time of the listing) tuple, or None if the
+        directory was never listed.
+        """
+        if self.cache is None or self.cache.ttl <= 0:
+            return None
+        cached = self.cache.get(Cache.account_key(f"listing:{remote_dir}", self.cookies), ttl=float("inf"))
+        if not isinstance(cached, dict):
+            return None
+        return [{"path": path, "size": size} for path, size in cached.get("files", [])], cached.get("time", 0)
+
+    def fallback_listing(self, remote_dir: str) -> Optional[list]:
+        """
+        Returns the last listing of a remote directory stored in the cache, for an upload that couldn't list it
+        :param remote_dir: The remote directory.
+        :return: list of dicts with the path and size of each file, or None if the directory was never listed, and
+        the upload must stop instead of uploading every file again.
+        """
+        cached = self.cached_listing(remote_dir)
+        if cached is None:
+            self.log.error("remote fetch", f"The remote directory {remote_dir} was never listed, so the files on the "
+                                           f"cloud can't be skipped. Stopping the upload...")
+            return None
+        files, listed = cached
+        age = max(0, int(time.time() - listed))
+        self.log.warning("remote fetch", f"Using the listing of {remote_dir} from {age // 3600}h"
+                                         f"{age % 3600 // 60:02d}m ago ({len(files)} files). The files uploaded "
+                                         f"since then are uploaded again.")
+        return files
+
+    def file_metas(self, paths: list, dlink: bool = False) -> list:
+        """
+        Returns the metadata of several remote files in a single request
+        :param paths: Full cloud paths of the files.
+        :param dlink: If True, the download link of each file is also returned.
+        :return: list of dicts with the path, size, md5, block_list (and dlink) of each file found.
+        """
+        data = self.request("filemetas", "GET", "/api/filemetas",
+                            headers={"Referer": self.base_url + "/main"},
+                            params={"app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "0",
+                                    "jsToken": f"{self.jstoken}", "target": json.dumps(paths), "blocks": "1",
+                                    "dlink": "1" if dlink else "0"})
+        return data.get("info", [])
+
+    def file_manager(self, operation: str, filelist: list, ondup: str = "fail") -> list:
+        """
+        Moves, copies, renames or deletes several remote files or directories in a single request
+        :param operation: "move", "copy", "rename" or "delete".
+        :param filelist: Paths to delete, or dicts with the "path" and the "dest" and/or "newname" of each entry.
+        :param ondup: What to do when the destination exists: "fail", "newcopy", "overwrite" or "skip".
+        :return: list of dicts with the path and the errno of each entry.
+        """
+        # A repeated copy with newcopy would create a second copy of every entry the lost attempt already copied
+        attempts = 1 if operation == "copy" and ondup == "newcopy" else None
+        data = self.request(operation, "POST", "/api/filemanager", accept=(PARTIAL_ERRNO,), attempts=attempts,
+                            headers={"Origin": self.base_url, "Content-Type": "application/x-www-form-urlencoded"},
+                            params={"opera": operation, "async": "0", "onnest": "fail", "ondup": ondup,
+                                    "app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "0",
+                                    "jsToken": f"{self.jstoken}"},
+                            data={"filelist": json.dumps(filelist)})
+        return data.get("info", [])
+
+    def create_directory(self, remote_dir: str) -> dict:
+        """
+        Creates a remote directory and its missing parents
+        :param remote_dir: Full cloud path of the directory.
+        :return: The response of the create request. Raises TransferError if the request failed.
+        """
+        return self.request("mkdir", "POST", "/api/create",
+                            headers={"Origin": self.base_url, "Content-Type": "application/x-www-form-urlencoded"},
+                            params={"a": "commit", "app_id": "250528", "jsToken": f"{self.jstoken}"},
+                            data={"path": "/" + remote_dir.strip("/"), "isdir": "1", "rtype": "0", "block_list": "[]"})
+
+    def precreate(self, remote_path: str, target_dir: str, block_list: str) -> str:
+        """
+        Precreates a file for upload
+        :param remote_path: Full cloud path of the file.
+        :param target_dir: Cloud directory the file is uploaded to.
+        :param block_list: JSON list of the MD5 hashes of the file parts.
+        :return: The upload ID of the file. Raises TransferError if the precreate failed.
+        """
+        data = self.request("precreate", "POST", "/api/precreate",
+                            headers={"Origin": self.base_url, "Referer": self.base_url + "/main?category=all",
+                                     "Content-Type": "application/x-www-form-urlencoded"},
+                            data={"app_id": "250528", "web": "1", "channel": "dubox", "clienttype": "0",
+                                  "jsToken": f"{self.jstoken}", "path": remote_path, "autoinit": "1",
+                                  "target_path": target_dir, "block_list": block_list})
+        if "uploadid" not in data:
+            raise TransferError("exception", None, f"No upload ID in response: {data}")
+        return data["uploadid"]
+
+    def _upload_host(self) -> str:
+        with self._lock:
+            if not self._host_probed:
+                self._host_probed = True
+                self.log.info("endpoint", "Probing upload hosts...")
+                self.selector.locate(params={"app_id": "250528", "upload_version": "2.0"}, cookies=self.cookies,
+                                     headers={"User-Agent": self.user_agent})
+                self.log.success("endpoint", f"Using upload host {self.selector.probe()}.")
+            if self.curl_binary is None:
+                self.curl_binary = ensure_curl(self.log, self.cache)
+        return self.selector.current()
+
+    @staticmethod
+    def _run_curl(command: list, on_progress: Callable[[int], None]) -> bytes:
+        # Reads curl's progress meter from stderr instead of showing it, and reports the uploaded bytes
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def read_meter() -> None:
+            pending = b""
+            for data in iter(lambda: process.stderr.read1(4096), b""):
+                pending += data.replace(b"\r", b"\n")
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    fields = line.split()
+                    # Columns: % Total, Total, % Received, Received, % Xferd, Xferd, ...
+                    if len(fields) >= 6 and fields[0].isdigit():
+                        sent = parse_curl_size(fields[5].decode(errors="replace"))
+                        if sent is not None:
+                            on_progress(sent)
+
+        reader = threading.Thread(target=read_meter, daemon=True)
+        reader.start()
+        stdout = process.stdout.read()
+        process.wait()
+        reader.join()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout)
+        return stdout
+
+    def upload_part(self, local_path: str, remote_path: str, uploadid: str, md5hash: str, partseq: int = 0,
+                    on_progress: Optional[Callable[[int], None]] = None) -> str:
+        """
+        Uploads a file or a part of a file with curl
+        :param local_path: Path of the local file or part.
+        :param remote_path: Full cloud path of the file.
+        :param uploadid: The upload ID of the file.
+        :param md5hash: The MD5 hash of the file/piece to upload.
+        :param partseq: The part sequence of the file. Default is 0 (for single file upload).
+        :param on_progress: Function called with the bytes sent so far. If set, curl's progress meter is not shown.
+        :return: The MD5 hash returned by the server. Raises TransferError if the upload failed or the MD5 hash
+        does not match.
+        """
+        def attempt() -> str:
+            host = self._upload_host()
+            command = [self.curl_binary, "-X", "POST", "-w", "\n%{http_code}"] + self.throttle.curl_args() + [
+                "-H", f"User-Agent:{self.user_agent}",
+                "-H", f"Origin:{self.base_url}",
+                "-H", f"Referer:{self.base_url}/main?category=all",
+                "-H", "Content-Type:multipart/form-data",
+                "-b", f"{self.cookies_str}",
+                "-F", f"file=@{local_path}",
+                f"{host}/rest/2.0/pcs/superfile2?"
+                f"method=upload&type=tmpfile&app_id=250528&path={quote_plus(remote_path)}&"
+                f"uploadid={uploadid}&partseq={partseq}"]
+            limit = self.throttle.limit
+            self.throttle.start_transfer()
+            concurrency = self.throttle.active
+            sent_bytes = 0
+            started = time.monotonic()
+            try:
+                with get_tracer().span("curl", "curl", part=partseq, host=host):
+                    if on_progress is None:
+                        stdout = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+                    else:
+                        on_progress(0)
+                        stdout = self._run_curl(command, on_progress)
+                sent_bytes = os.path.getsize(local_path)
+            except subprocess.CalledProcessError as e:
+                self.selector.report(host, 0, time.monotonic() - started, False)
+                raise TransferError("curl", e.returncode, "curl exited with an error") from e
+            except OSError as e:
+                raise TransferError("exception", None, str(e)) from e
+            finally:
+                self.throttle.end_transfer(sent_bytes)
+
+            body, _, status = stdout.decode('utf-8', errors="replace").rpartition("\n")
+            # The status is reported before the body is read, so the error pages of gateways that aren't JSON
+            # still count against the host
+            if status.isdigit() and int(status) != 200:
+                self.selector.report(host, 0, time.monotonic() - started, int(status) < 500)
+            else:
+                self.selector.report(host, sent_bytes, time.monotonic() - started, True, concurrency, limit)
+            try:
+                uresp = json.loads(body)
+            except json.JSONDecodeError as e:
+                if status.isdigit() and int(status) != 200:
+                    raise TransferError("http", int(status), body[:200]) from e
+                # A truncated or garbled answer to an upload that went through, which is worth another attempt
+                raise TransferError("exception", None, f"Invalid JSON response: {body[:200]}") from e
+            if status.isdigit() and int(status) != 200:
+                raise TransferError("http", int(status), str(uresp))
+            if 'error_code' in uresp:
+                raise TransferError("errno", uresp['error_code'], str(uresp))
+            if uresp["md5"] != md5hash:
+                raise TransferError("md5", None, f"MD5 hash mismatch for cloud file {remote_path} after upload.")
+            return uresp["md5"]
+
+        return self.retry.run("upload", attempt)
+
+    def create(self, remote_path: str, target_dir: str, uploadid: str, size: int, block_list: str) -> dict:
+        """
+        Creates a file on the cloud from its uploaded parts
+        :param remote_path: Full cloud path of the file.
+        :param target_dir: Cloud directory the file is uploaded to.
+        :param uploadid: The upload ID of the file requested previously.
+        :param size: The size of the file in bytes.
+        :param block_list: JSON list of the MD5 hashes of the file parts.
+        :return: The response of the create file request. Raises TransferError if the request failed.
+        """
+        return self.request("create", "POST", "/api/create",
+                            headers={"Origin": self.base_url, "Content-Type": "application/x-www-form-urlencoded"},
+                            params={"isdir": "0", "rtype": "1", "app_id": "250528", "jsToken": f"{self.jstoken}"},
+                            data={"path": remote_path, "uploadid": uploadid, "target_path": f"{target_dir}/",
+                                  "size": f"{size}", "block_list": block_list})
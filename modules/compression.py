@@ -0,0 +1,171 @@
+"""
+TeraBox Uploader CLI: compression.py
+This module is used to compress the files while they are encrypted, before they are uploaded.
+Logs and database dumps often shrink several times, which saves upload time and quota. The files are compressed as a
+stream with gzip or, if the zstandard library is installed, with zstd. Files that are already compressed (archives,
+pictures, videos) are recognized by their extension or by the entropy of a sample, and are left as they are.
+Used in: encryption.py, uploader.py, verify.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import math
+import os
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ALGORITHMS = ("zstd", "gzip")
+DEFAULT_LEVELS = {"zstd": 3, "gzip": 6}
+COMPRESSED_EXTENSIONS = {
+    ".7z", ".aac", ".apk", ".avi", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz", ".heic", ".jar", ".jpeg", ".jpg",
+    ".lz4", ".lzma", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4", ".odt", ".ogg", ".opus", ".png", ".pptx", ".rar",
+    ".tgz", ".webm", ".webp", ".xlsx", ".xz", ".zip", ".zst",
+}
+SAMPLE_SIZE = 64 * 1024
+# Bits per byte above which a sample is considered already compressed or encrypted. Text is usually below 5.
+ENTROPY_THRESHOLD = 7.5
+
+
+class CompressionSettingException(Exception):
+    """
+    Exception raised when the compression settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class CompressionUnavailableException(Exception):
+    """
+    Exception raised when zstd compression is requested but the zstandard library is not installed.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def entropy(data: bytes) -> float:
+    """
+    Calculates the Shannon entropy of some data
+    :param data: The data.
+    :return: Entropy in bits per byte, between 0 and 8.
+    """
+    if not data:
+        return 0.0
+    total = len(data)
+    counts = (data.count(byte) for byte in range(256))
+    return -sum(count / total * math.log2(count / total) for count in counts if count)
+
+
+def decompressor(algorithm: str):
+    """
+    Creates a streaming decompressor
+    :param algorithm: "zstd" or "gzip".
+    :return: object with decompress(data) and flush() methods.
+    """
+    if algorithm == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if algorithm == "zstd":
+        if zstandard is None:
+            raise CompressionUnavailableException("This file is compressed with zstd, which requires the zstandard "
+                                                  "library. Install it with \"pip install zstandard\".")
+        return _ZstdStream(zstandard.ZstdDecompressor().decompressobj())
+    raise ValueError(f"Unknown compression algorithm: {algorithm}")
+
+
+class _ZstdStream:
+    # Gives the zstd decompressor the flush() method of the zlib objects
+    def __init__(self, stream):
+        self.stream = stream
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.stream.decompress(data)
+
+    @staticmethod
+    def flush() -> bytes:
+        return b""
+
+
+class Compression:
+    """
+    Settings of the compression stage, and the compressors built from them.
+    """
+
+    def __init__(self, enabled: bool = False, algorithm: str = "gzip", level: Optional[int] = None,
+                 threads: int = 0, skip_extensions: Optional[set] = None, entropy_threshold: float = ENTROPY_THRESHOLD):
+        """
+        :param enabled: If False, no file is compressed.
+        :param algorithm: "gzip", or "zstd", which needs the optional zstandard library.
+        :param level: Compression level. Defaults to 3 for zstd and 6 for gzip.
+        :param threads: Threads used by zstd to compress a file. 0 compresses in the calling thread, -1 uses one
+        thread per CPU. gzip always uses the calling thread.
+        :param skip_extensions: Extensions of the files that are not compressed. Defaults to COMPRESSED_EXTENSIONS.
+        :param entropy_threshold: Files whose first bytes have a higher entropy are not compressed.
+        """
+        if algorithm not in ALGORITHMS:
+            raise CompressionSettingException(f"Invalid compression algorithm: {algorithm}. Use one of "
+                                              f"{', '.join(ALGORITHMS)}.")
+        if enabled and algorithm == "zstd" and zstandard is None:
+            raise CompressionSettingException("zstd compression requires the zstandard library. Install it with "
+                                              "\"pip install zstandard\", or use gzip.")
+        self.enabled = enabled
+        self.algorithm = algorithm
+        self.level = DEFAULT_LEVELS[algorithm] if level is None else level
+        self.threads = threads
+        self.skip_extensions = COMPRESSED_EXTENSIONS if skip_extensions is None else skip_extensions
+        self.entropy_threshold = entropy_threshold
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "Compression":
+        """
+        Builds the compression stage from the "compression" section of settings.json
+        :param section: dict with the optional "enabled", "algorithm", "level", "threads", "skipextensions" and
+        "entropy" keys.
+        :return: Compression object
+        """
+        skip = section.get("skipextensions")
+        if skip is not None:
+            skip = {"." + extension.lower().lstrip(".") for extension in skip}
+        try:
+            level = str(section.get("level", "")).strip()
+            level = int(level) if level else None
+            threads = int(section.get("threads", "0"))
+            entropy_threshold = float(section.get("entropy", ENTROPY_THRESHOLD))
+        except ValueError as e:
+            raise CompressionSettingException(f"Invalid compression settings: {e}") from e
+        return cls(str(section.get("enabled", "false")).lower() == "true",
+                   str(section.get("algorithm", "gzip")).lower(), level, threads, skip, entropy_threshold)
+
+    def should_compress(self, path: str) -> bool:
+        """
+        Decides if a file is worth compressing
+        :param path: Path of the file.
+        :return: False if compression is disabled, or if the file looks already compressed.
+        """
+        if not self.enabled:
+            return False
+        if os.path.splitext(path)[1].lower() in self.skip_extensions:
+            return False
+        with open(path, "rb") as f:
+            sample = f.read(SAMPLE_SIZE)
+        return entropy(sample) < self.entropy_threshold
+
+    def compressor(self):
+        """
+        Creates a streaming compressor
+        :return: object with compress(data) and flush() methods.
+        """
+        if self.algorithm == "gzip":
+            return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return zstandard.ZstdCompressor(level=self.level, threads=self.threads).compressobj()
@@ -0,0 +1,183 @@
+"""
+TeraBox Uploader CLI: config.py
+This module is used to load and validate the secrets.json and settings.json files.
+Used in: main.py, uploader.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+
+class SettingsException(Exception):
+    """
+    Exception raised when the secrets.json or settings.json files are missing or invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def _is_true(value) -> bool:
+    return str(value).lower() == "true"
+
+
+def _read_json(path: str, name: str) -> dict:
+    if not os.path.exists(path):
+        raise SettingsException(f"{name} file not found.")
+    try:
+        with open(path, "r", encoding="utf8") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        raise SettingsException(f"Invalid JSON format in {name}: {e}") from e
+    except OSError as e:
+        raise SettingsException(f"An error occurred while reading the {name} file: {e}") from e
+
+
+def _account(secrets: dict, name: str) -> dict:
+    try:
+        jstoken = secrets["jstoken"]
+        cookies = secrets["cookies"]
+    except KeyError as e:
+        raise SettingsException(f"Key {e} not found in secrets.json.") from e
+    if not any(char.isdigit() for char in jstoken):
+        raise SettingsException(f"Invalid jstoken of account {name}." if name != "default" else "Invalid jstoken.")
+    return {"name": name, "jstoken": jstoken, "cookies": cookies}
+
+
+def load_accounts(path: str = "secrets.json") -> list:
+    """
+    Loads the authentication tokens of every account. secrets.json holds either the tokens of a single account, or
+    an "accounts" list of them, each with an optional "name".
+    :param path: Path of the secrets.json file.
+    :return: list of dicts with the "name", the "jstoken" and the "cookies" of each account.
+    """
+    secrets = _read_json(path, "secrets.json")
+    if "accounts" not in secrets:
+        return [_account(secrets, "default")]
+    if not isinstance(secrets["accounts"], list) or not secrets["accounts"]:
+        raise SettingsException("The accounts of secrets.json must be a non-empty list.")
+    accounts = []
+    for index, entry in enumerate(secrets["accounts"], 1):
+        if not isinstance(entry, dict):
+            raise SettingsException(f"Account {index} in secrets.json is not an object.")
+        account = _account(entry, str(entry.get("name", f"account{index}")))
+        if not re.match(r"^[A-Za-z0-9._-]+$", account["name"]):
+            raise SettingsException(f"Invalid account name: {account['name']}. Use letters, digits, dots, dashes and "
+                                    f"underscores.")
+        if any(other["name"] == account["name"] for other in accounts):
+            raise SettingsException(f"There is more than one account named {account['name']} in secrets.json.")
+        accounts.append(account)
+    return accounts
+
+
+def load_secrets(path: str = "secrets.json") -> dict:
+    """
+    Loads the authentication tokens. With several accounts, the first one is used.
+    :param path: Path of the secrets.json file.
+    :return: dict with the "jstoken" and the "cookies" of the session.
+    """
+    account = load_accounts(path)[0]
+    return {"jstoken": account["jstoken"], "cookies": account["cookies"]}
+
+
+class Settings:
+    """
+    Program settings loaded from settings.json.
+    """
+
+    def __init__(self, data: Optional[dict] = None):
+        """
+        Reads the settings from the content of settings.json
+        :param data: The decoded settings.json content.
+        """
+        data = data or {}
+        self.raw = data
+        try:
+            directories = data.get("directories", {})
+            files = data.get("files", {})
+            encryption = data.get("encryption", {})
+            self.source_dir = directories.get("sourcedir", "")
+            self.remote_dir = directories.get("remotedir", "")
+            self.uploaded_dir = directories.get("uploadeddir", "")
+            self.move_files = _is_true(files.get("movefiles", "false"))
+            self.delete_source = _is_true(files.get("deletesource", "false"))
+            self.encryption_enabled = _is_true(encryption.get("enabled", "false"))
+            self.encryption_key = encryption.get("encryptionkey", "")
+            self.encryption_buffer = int(encryption.get("buffersize", "0") or 0)
+            self.ignored_files = data.get("ignoredfiles", [])
+            self.show_quota = _is_true(data.get("appearance", {}).get("showquota", "false"))
+            self.progress = str(data.get("appearance", {}).get("progress", "auto")).lower()
+        except AttributeError as e:
+            raise SettingsException(f"Invalid section in settings.json: {e}") from e
+        except ValueError as e:
+            raise SettingsException(f"Invalid encryption buffer size in settings.json: {e}") from e
+        self.bandwidth = data.get("bandwidth", {})
+        self.retry = data.get("retry", {})
+        self.upload = data.get("upload", {})
+        self.cache = data.get("cache", {})
+        self.logging = data.get("logging", {})
+        self.metrics = data.get("metrics", {})
+        self.tracing = data.get("tracing", {})
+        self.packing = data.get("packing", {})
+        self.compression = data.get("compression", {})
+        self.scheduling = data.get("scheduling", {})
+        self.files = data.get("files", {})
+        self.temp = data.get("temp", {})
+        self.integrity = data.get("integrity", {})
+        self.snapshot = data.get("snapshot", {})
+        self.jobs = data.get("jobs", [])
+        self.accounts = data.get("accounts", {})
+        # normalize important paths to absolute paths so display helpers work reliably
+        if self.source_dir:
+            self.source_dir = os.path.abspath(self.source_dir)
+        if self.uploaded_dir:
+            self.uploaded_dir = os.path.abspath(self.uploaded_dir)
+        if self.encryption_key:
+            self.encryption_key = os.path.abspath(self.encryption_key)
+
+    @classmethod
+    def load(cls, path: str = "settings.json", upload: bool = True) -> "Settings":
+        """
+        Loads and validates the settings file
+        :param path: Path of the settings.json file.
+        :param upload: If False, the directories and the encryption key of an upload aren't checked.
+        :return: Settings object
+        """
+        settings = cls(_read_json(path, "settings.json"))
+        settings.validate(upload)
+        return settings
+
+    def validate(self, upload: bool = True) -> None:
+        """
+        Checks that the settings can be used for an upload. Raises SettingsException if not.
+        :param upload: If False, only the settings used by every command are checked, so the commands that don't
+        read the source directory, like restore, can run without it.
+        :return:
+        """
+        if self.delete_source and self.move_files:
+            raise SettingsException("You cannot have move and delete files settings configured as true at the "
+                                    "same time.")
+        if not isinstance(self.jobs, list):
+            raise SettingsException("The jobs setting must be a list of jobs.")
+        if self.jobs or not upload:
+            # Every job is validated with its own directories and encryption key
+            return
+        if not self.source_dir or not self.remote_dir:
+            raise SettingsException("Invalid directory paths. Please check the settings.json file for missing "
+                                    "paths.")
+        if not os.path.isdir(self.source_dir):
+            raise SettingsException("Source directory does not exist. Please check the path.")
+        if self.move_files and not os.path.isdir(self.uploaded_dir):
+            raise SettingsException("Move to directory does not exist. Please check the path.")
+        if self.encryption_enabled and not self.encryption_key:
+            raise SettingsException("Encryption key path is not set.")
@@ -0,0 +1,103 @@
+"""
+TeraBox Uploader CLI: curl.py
+This module is used to find curl, which is used for the file uploads, and to install it when it is missing.
+The location of curl can be kept in the cache between runs, so the lookup only happens when it expires.
+Used in: client.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import os
+import shutil
+import subprocess
+import zipfile
+from typing import Optional
+
+from modules.cache import Cache
+from modules.formatting import Formatting
+
+CURL_URL = "https://curl.se/windows/dl-8.13.0_5/curl-8.13.0_5-win64-mingw.zip"
+CURL_CACHE_TTL = 7 * 86400
+
+
+class CurlNotFoundException(Exception):
+    """
+    Exception raised when curl is not installed and could not be installed.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def ensure_curl(log: Optional[Formatting] = None, cache: Optional[Cache] = None) -> str:
+    """
+    Finds curl and installs it if it is missing
+    :param log: Formatting object used for logging.
+    :param cache: Cache of the location of curl. The cached location is used while the file still exists.
+    :return: Path or name of the curl executable.
+    """
+    if cache is not None:
+        cached = cache.get("curl", min(cache.ttl, CURL_CACHE_TTL))
+        if cached and os.path.isfile(cached):
+            return cached
+    found = _find_curl(log or Formatting(timestamps=True))
+    if cache is not None:
+        cache.set("curl", os.path.abspath(found))
+    return found
+
+
+def _find_curl(log: Formatting) -> str:
+    if os.name == "nt":
+        log.info("CURL", "Windows host detected. Checking if curl is installed...")
+        curl_path = os.path.join("curl", "bin", "curl.exe")
+        if os.path.exists(curl_path):
+            log.success("CURL", "curl is already installed or exists in the current folder.")
+            return curl_path
+        if os.path.exists("curl.exe"):
+            log.success("CURL", "curl is already installed or exists in the current folder.")
+            return os.path.abspath("curl.exe")
+        import requests
+
+        log.info("CURL", f"curl.exe not found. Downloading curl from {CURL_URL}...")
+        curlreq = requests.get(CURL_URL, timeout=10)
+        with open("curl.zip", "wb") as f:
+            f.write(curlreq.content)
+        log.info("CURL", "Extracting curl...")
+        with zipfile.ZipFile("curl.zip", "r") as zip_ref:
+            zip_ref.extractall(".")
+        extracted_dir = "curl-8.13.0_5-win64-mingw"
+        if os.path.exists(extracted_dir):
+            os.rename(extracted_dir, "curl")
+        log.info("CURL", "Curl extracted.")
+        os.remove("curl.zip")
+        return curl_path
+
+    log.info("CURL", "Checking for curl...")
+    found = shutil.which("curl")
+    if found:
+        log.info("CURL", "Curl is already installed or exists in the current folder.")
+        return found
+
+    log.info("CURL", "curl not found. Installing curl...")
+    try:
+        if shutil.which("brew"):
+            log.info("CURL", "Installing curl using Homebrew...")
+            subprocess.run(["brew", "install", "curl"], check=True)
+        elif shutil.which("apt"):  # Assuming Debian-based distros
+            log.info("CURL", "Installing curl using apt...")
+            subprocess.run(["sudo", "apt", "install", "-y", "curl"], check=True)
+        else:
+            raise CurlNotFoundException("Your OS is not supported for automatic curl installation. Please install "
+                                        "curl manually.")
+    except subprocess.CalledProcessError as e:
+        raise CurlNotFoundException(f"curl could not be installed: {e}") from e
+    found = shutil.which("curl")
+    if not found:
+        raise CurlNotFoundException("curl could not be installed. Please install curl manually.")
+    return found
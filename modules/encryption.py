@@ -1,7 +1,9 @@
 """
 TeraBox Uploader CLI: encryption.py
 This module is used to encrypt and decrypt files using AES and Fernet encryption.
-It uses the cryptography library to handle encryption and decryption.
+It uses the cryptography library to handle encryption and decryption. Files can be compressed before they are
+encrypted; the header line of the encrypted file then names the compression algorithm, so they are decompressed
+when they are decrypted.
 Used in: main.py
 
 This program is provided as-is, without any warranty.
@@ -15,11 +17,14 @@ If you find any bugs, please open an issue in the GitHub repository mentioned in
 
 import os
 import os.path
+import zlib
 from pathlib import Path
 
 import base64
 import random
 import string
+from typing import Optional
+
 from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -27,8 +32,14 @@ from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
 
+from modules.compression import Compression, CompressionUnavailableException, decompressor
 from modules.formatting import Formatting
 
+DEFAULT_CHUNK_SIZE = 64 * 1024
+HEADER = b"ENC-TERABOXUPLOADERCLI"
+# Header suffixes of the files compressed before they were encrypted
+COMPRESSION_SUFFIXES = {"gzip": b"-GZIP", "zstd": b"-ZSTD"}
+
 
 class GenerateKeyException(Exception):
     """
@@ -75,13 +86,60 @@ class FileNotEncryptedException(Exception):
         super().__init__(self.message)
 
 
+def container_header(key_type: str, algorithm: Optional[str] = None) -> bytes:
+    """
+    Builds the header line of an encrypted file
+    :param key_type: "AES" or "Fernet"
+    :param algorithm: compression algorithm of the content, or None if it isn't compressed
+    :return: the header line, like b"ENC-TERABOXUPLOADERCLI-AES\n"
+    """
+    return HEADER + (b"-AES" if key_type == "AES" else b"") + COMPRESSION_SUFFIXES.get(algorithm, b"") + b"\n"
+
+
+def parse_header(line: bytes) -> tuple:
+    """
+    Reads the header line of an encrypted file
+    :param line: the first line of the file
+    :return: (key type, compression algorithm or None) tuple
+    """
+    line = line.rstrip(b"\n")
+    if not line.startswith(HEADER):
+        raise FileNotEncryptedException("File is not encrypted with Fernet or AES encryption by TeraboxUploaderCLI.")
+    rest = line[len(HEADER):]
+    key_type = "Fernet"
+    if rest.startswith(b"-AES"):
+        key_type, rest = "AES", rest[len(b"-AES"):]
+    algorithm = next((name for name, suffix in COMPRESSION_SUFFIXES.items() if suffix == rest), None)
+    if rest and algorithm is None:
+        raise DecryptFileException(f"Unknown encrypted file header: {line.decode(errors='replace')}")
+    return key_type, algorithm
+
+
 class Encryption:
     """
     Class to handle encryption and decryption of files
     """
 
-    def __init__(self):
-        self.chunk_size = 64 * 1024
+    def __init__(self, chunk_size: Optional[int] = None, compression: Optional[Compression] = None,
+                 temp_dir: str = "./temp"):
+        """
+        :param chunk_size: Size of the blocks read and encrypted at once with an AES key. Defaults to 64KiB; the
+        "bench encryption" command finds the fastest size for the current machine.
+        :param compression: Compression applied to the files before they are encrypted. None disables it.
+        :param temp_dir: Directory the encrypted and decrypted files are written to.
+        """
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self.compression = compression
+        self.temp_dir = temp_dir
+
+    def _compressor(self, filepath: str) -> tuple:
+        """
+        Creates the compressor of a file
+        :return: (algorithm, compressor) tuple, or (None, None) if the file is not compressed
+        """
+        if self.compression is None or not self.compression.should_compress(filepath):
+            return None, None
+        return self.compression.algorithm, self.compression.compressor()
 
     @staticmethod
     def generate_key(keyfile='keyfile.key', password=None, key_size=32) -> bool:
@@ -154,17 +212,17 @@ class Encryption:
         # VERIFY IF FILE IS ALREADY ENCRYPTED
         if "enc" in filepath:
             original = Path(filepath).read_bytes()
-            Path(os.path.join("./temp", f"{os.path.basename(filepath)}.enc")).write_bytes(original)
+            Path(os.path.join(self.temp_dir, f"{os.path.basename(filepath)}.enc")).write_bytes(original)
             raise FileEncryptedException(f"File {filepath} is already encrypted. Reusing file.")
 
         if Path(filepath).read_bytes().startswith(b"ENC-TERABOXUPLOADERCLI"):
             original = Path(filepath).read_bytes()
-            Path(os.path.join("./temp", f"{os.path.basename(filepath)}.enc")).write_bytes(original)
+            Path(os.path.join(self.temp_dir, f"{os.path.basename(filepath)}.enc")).write_bytes(original)
             raise FileEncryptedException(f"File {filepath} is already encrypted with Fernet encryption.")
 
         if Path(filepath).read_bytes().startswith(b"ENC-TERABOXUPLOADERCLI-AES"):
             original = Path(filepath).read_bytes()
-            Path(os.path.join("./temp", f"{os.path.basename(filepath)}.enc")).write_bytes(original)
+            Path(os.path.join(self.temp_dir, f"{os.path.basename(filepath)}.enc")).write_bytes(original)
             raise FileEncryptedException(f"File {filepath} is already encrypted with AES encryption.")
 
         if len(base64.urlsafe_b64decode(Path(keypath).read_bytes())) == 32:
@@ -172,6 +230,55 @@ class Encryption:
 
         return self.encrypt_file_fernet(keypath, filepath)
 
+    @staticmethod
+    def aes_decryptor(keypath: str, iv: bytes):
+        """
+        Creates an AES-CBC decryptor, to decrypt the content of an AES encrypted file as it is read
+        :param keypath: path to the keyfile
+        :param iv:      the IV of the file, or the 16 bytes before the first block to decrypt
+        :return: decryptor object with update() and finalize() methods. The padding is not removed.
+        """
+        key = base64.urlsafe_b64decode(Path(keypath).read_bytes())
+        return Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+
+    @staticmethod
+    def fernet(keypath: str) -> Fernet:
+        """
+        Loads a Fernet key
+        :param keypath: path to the keyfile
+        :return: Fernet object
+        """
+        return Fernet(base64.urlsafe_b64encode(Path(keypath).read_bytes()))
+
+    @staticmethod
+    def encrypted_size(keypath: str, filepath: str, size: Optional[int] = None,
+                       compression: Optional[Compression] = None) -> Optional[int]:
+        """
+        Calculates the size of the file produced by encrypt_file, without encrypting the file
+        :param keypath:     path to the keyfile
+        :param filepath:    path to the file to encrypt
+        :param size:        size of the file in bytes. Read from the file if None.
+        :param compression: compression applied before the encryption, if any
+        :return: size of the encrypted file in bytes, or None if the file is compressed, as its size is only known
+        once it is compressed
+        """
+        size = os.path.getsize(filepath) if size is None else size
+        # Files that are already encrypted are copied as they are
+        if "enc" in filepath:
+            return size
+        with open(filepath, 'rb') as f:
+            if f.read(22) == b"ENC-TERABOXUPLOADERCLI":
+                return size
+        if compression is not None and compression.should_compress(filepath):
+            return None
+
+        # PKCS7 always adds between 1 and 16 bytes of padding
+        padded = (size // 16 + 1) * 16
+        if len(base64.urlsafe_b64decode(Path(keypath).read_bytes())) == 32:
+            return len(b"ENC-TERABOXUPLOADERCLI-AES\n") + 16 + padded
+        # Fernet token: version, timestamp, IV, ciphertext and HMAC, base64 encoded
+        return len(b"ENC-TERABOXUPLOADERCLI\n") + 4 * -(-(1 + 8 + 16 + padded + 32) // 3)
+
     def decrypt_file(self, keypath: str, filename: str) -> bool:
         """
         Decrypts a file using the keyfile
@@ -220,12 +327,13 @@ class Encryption:
         except Exception as e:
             raise EncryptFileException(f"Something went wrong when loading keyfile: {e}") from e
 
-        destination = os.path.join("./temp", f"{os.path.basename(filepath)}.enc")
+        destination = os.path.join(self.temp_dir, f"{os.path.basename(filepath)}.enc")
 
         # OPEN FILE, ENCRYPT AND SAVE
         try:
+            algorithm, compressor = self._compressor(filepath)
             with open(filepath, 'rb') as infile, open(destination, 'wb') as outfile:
-                outfile.write(b"ENC-TERABOXUPLOADERCLI-AES\n")
+                outfile.write(container_header("AES", algorithm))
 
                 iv = os.urandom(16)
                 cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
@@ -236,9 +344,12 @@ class Encryption:
                 while True:
                     chunk = infile.read(self.chunk_size)
                     if len(chunk) == 0:
-                        outfile.write(encryptor.update(padder.finalize()) + encryptor.finalize())
+                        tail = compressor.flush() if compressor else b""
+                        outfile.write(encryptor.update(padder.update(tail) + padder.finalize()) + encryptor.finalize())
                         break
 
+                    if compressor:
+                        chunk = compressor.compress(chunk)
                     padded_chunk = padder.update(chunk)
                     encrypted_chunk = encryptor.update(padded_chunk)
                     outfile.write(encrypted_chunk)
@@ -261,16 +372,20 @@ class Encryption:
         except Exception as e:
             raise EncryptFileException(f"Something went wrong when loading keyfile: {e}") from e
 
-        destination = os.path.join("./temp", f"{os.path.basename(filepath)}.enc")
+        destination = os.path.join(self.temp_dir, f"{os.path.basename(filepath)}.enc")
 
         # OPEN FILE, ENCRYPT AND SAVE
         try:
+            algorithm, compressor = self._compressor(filepath)
             with open(filepath, 'rb') as infile, open(destination, 'wb') as outfile:
-                outfile.write(b"ENC-TERABOXUPLOADERCLI\n")
+                outfile.write(container_header("Fernet", algorithm))
 
                 key = base64.urlsafe_b64encode(key)
                 fernet = Fernet(key)
-                outfile.write(fernet.encrypt(infile.read()))
+                data = infile.read()
+                if compressor:
+                    data = compressor.compress(data) + compressor.flush()
+                outfile.write(fernet.encrypt(data))
 
         except Exception as e:
             raise EncryptFileException(f"Something went wrong when encrypting file: {e}") from e
@@ -303,12 +418,13 @@ class Encryption:
         except Exception as e:
             raise DecryptFileException(f"Something went wrong when loading keyfile: {e}") from e
 
-        destination = os.path.join("./temp", f"{os.path.basename(filename)[:-4]}.dec")
+        destination = os.path.join(self.temp_dir, f"{os.path.basename(filename)[:-4]}.dec")
 
         # OPEN FILE, DECRYPT AND SAVE
         try:
             with open(filename, 'rb') as infile, open(destination, 'wb') as outfile:
-                infile.readline()
+                _, algorithm = parse_header(infile.readline())
+                decompress = decompressor(algorithm) if algorithm else None
                 iv = infile.read(16)
 
                 cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
@@ -318,12 +434,15 @@ class Encryption:
                 while True:
                     chunk = infile.read(self.chunk_size)
                     if len(chunk) == 0:
-                        outfile.write(unpadder.finalize())
+                        tail = unpadder.update(decryptor.finalize()) + unpadder.finalize()
+                        outfile.write(decompress.decompress(tail) + decompress.flush() if decompress else tail)
                         break
 
                     decrypted_chunk = unpadder.update(decryptor.update(chunk))
-                    outfile.write(decrypted_chunk)
+                    outfile.write(decompress.decompress(decrypted_chunk) if decompress else decrypted_chunk)
 
+        except CompressionUnavailableException as e:
+            raise DecryptFileException(e.message) from e
         except Exception as e:
             raise DecryptFileException(f"Something went wrong when decrypting file: {e}") from e
 
@@ -355,17 +474,23 @@ class Encryption:
         except Exception as e:
             raise DecryptFileException(f"Something went wrong when loading keyfile: {e}") from e
 
-        destination = os.path.join("./temp", f"{os.path.basename(filename)[:-4]}.dec")
+        destination = os.path.join(self.temp_dir, f"{os.path.basename(filename)[:-4]}.dec")
 
         # OPEN FILE, DECRYPT AND SAVE
         try:
             with open(filename, 'rb') as infile, open(destination, 'wb') as outfile:
-                infile.readline()
+                _, algorithm = parse_header(infile.readline())
                 key = base64.urlsafe_b64encode(key)
                 fernet = Fernet(key)
-                outfile.write(fernet.decrypt(infile.read()))
+                data = fernet.decrypt(infile.read())
+                if algorithm:
+                    decompress = decompressor(algorithm)
+                    data = decompress.decompress(data) + decompress.flush()
+                outfile.write(data)
         except InvalidToken as exc:
             raise DecryptFileException("Invalid key or file") from exc
+        except (CompressionUnavailableException, zlib.error) as exc:
+            raise DecryptFileException(f"Something went wrong when decompressing file: {exc}") from exc
 
         except Exception as e:
             raise DecryptFileException(f"Something went wrong when decrypting file: {e}") from e
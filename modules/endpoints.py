@@ -0,0 +1,251 @@
+"""
+TeraBox Uploader CLI: endpoints.py
+This module is used to select the upload host used for the file uploads.
+It probes the candidate PCS hosts (configured or returned by the locate-upload API), picks the fastest one and fails
+over to the next one when the selected host gets slow or keeps failing during the run.
+Used in: client.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from modules.formatting import Formatting
+
+
+class NoUploadHostException(Exception):
+    """
+    Exception raised when no upload host could be reached.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HostStats:
+    """
+    Probe results and observed performance of a single upload host.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.rtt = None
+        self.probe_throughput = None
+        self.throughput = None
+        # Throughput of the host across the transfers running at the same time, and the best one observed
+        self.rate = None
+        self.baseline = None
+        self.failures = 0
+        self.degraded_until = 0.0
+
+    @property
+    def score(self) -> float:
+        """
+        Estimated seconds to send 8MB to the host. Lower is better.
+        """
+        if self.rtt is None:
+            return float("inf")
+        speed = self.throughput or self.probe_throughput
+        if not speed:
+            return self.rtt
+        return self.rtt + (8 * 1024 * 1024) / speed
+
+    @property
+    def available(self) -> bool:
+        """
+        True if the host was reachable and is not cooling down after being degraded
+        """
+        return self.rtt is not None and time.monotonic() >= self.degraded_until
+
+
+class EndpointSelector:
+    """
+    Picks the fastest upload host and fails over to the next one when it slows down.
+    """
+
+    def __init__(self, candidates: list, locate_url: str = "", probe_size: int = 0, timeout: float = 5.0,
+                 degrade_ratio: float = 0.5, max_failures: int = 2, cooldown: float = 300.0,
+                 session=None, log: Optional[Formatting] = None):
+        """
+        :param candidates: Base URLs of the candidate upload hosts (e.g. https://c-jp.terabox.com).
+        :param locate_url: URL of the locate-upload API. Its answer is added to the candidates. Empty to skip it.
+        :param probe_size: Size in bytes of the payload sent to measure the throughput of each host. 0 only measures
+        the round-trip time.
+        :param timeout: Timeout of each probe in seconds.
+        :param degrade_ratio: A host is degraded when its observed throughput across the concurrent transfers falls
+        below this fraction of its best observed throughput, or of the bandwidth limit if it is lower.
+        :param max_failures: A host is degraded after this many consecutive failed uploads.
+        :param cooldown: Seconds a degraded host is skipped before it can be selected again.
+        :param session: requests session used for the probes. Created on first use if None.
+        :param log: Formatting object used for logging.
+        """
+        self.hosts = {}
+        for url in candidates:
+            self._add(url)
+        self.locate_url = locate_url
+        self.probe_size = probe_size
+        self.timeout = timeout
+        self.degrade_ratio = degrade_ratio
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._session = session
+        self.log = log or Formatting(timestamps=True)
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        requests session used for the probes
+        """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def _add(self, url: str) -> None:
+        url = url.rstrip("/")
+        if url and url not in self.hosts:
+            self.hosts[url] = HostStats(url)
+
+    def locate(self, params: Optional[dict] = None, cookies: Optional[dict] = None,
+               headers: Optional[dict] = None) -> list:
+        """
+        Asks the server which upload hosts should be used and adds them to the candidates
+        :param params: Extra query parameters of the locate-upload request.
+        :param cookies: Cookies of the session.
+        :param headers: Headers of the request.
+        :return: list of the host URLs returned by the server.
+        """
+        if not self.locate_url:
+            return []
+        import requests
+
+        try:
+            response = self.session.get(self.locate_url, params=params, cookies=cookies, headers=headers,
+                                        timeout=self.timeout)
+            data = json.loads(response.text)
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            self.log.warning("endpoint", f"Could not locate the upload hosts: {e}")
+            return []
+        found = []
+        if data.get("host"):
+            host = data["host"]
+            found.append(host if "://" in host else f"https://{host}")
+        for key in ("servers", "bak_servers", "quic_servers"):
+            for entry in data.get(key, []) or []:
+                server = entry.get("server", "") if isinstance(entry, dict) else str(entry)
+                if server.startswith("http"):
+                    found.append(server)
+        for url in found:
+            self._add(url)
+        return found
+
+    def _probe(self, host: HostStats) -> None:
+        import requests
+
+        url = f"{host.url}/rest/2.0/pcs/superfile2"
+        try:
+            start = time.monotonic()
+            self.session.get(url, timeout=self.timeout)
+            host.rtt = time.monotonic() - start
+            if self.probe_size > 0:
+                payload = os.urandom(self.probe_size)
+                start = time.monotonic()
+                self.session.post(url, params={"method": "upload"}, data=payload, timeout=self.timeout * 4)
+                host.probe_throughput = self.probe_size / max(time.monotonic() - start - host.rtt, 1e-3)
+        except requests.RequestException as e:
+            host.rtt = None
+            self.log.warning("endpoint", f"Upload host {host.url} is unreachable: {e}")
+
+    def probe(self) -> str:
+        """
+        Probes every candidate in parallel and selects the fastest one
+        :return: Base URL of the selected host.
+        """
+        threads = [threading.Thread(target=self._probe, args=(host,), daemon=True) for host in self.hosts.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for host in sorted(self.hosts.values(), key=lambda h: h.score):
+            if host.rtt is None:
+                continue
+            speed = f", {host.probe_throughput / 1024 / 1024:.2f} MB/s" if host.probe_throughput else ""
+            self.log.debug("endpoint", f"Upload host {host.url}: RTT {host.rtt * 1000:.0f} ms{speed}")
+        return self._select()
+
+    def _select(self) -> str:
+        with self._lock:
+            available = [host for host in self.hosts.values() if host.available]
+            if not available:
+                # Every host is degraded or unreachable: fall back to the best known one instead of stopping
+                available = [host for host in self.hosts.values() if host.rtt is not None] or \
+                            list(self.hosts.values())
+            if not available:
+                raise NoUploadHostException("No upload host is configured.")
+            self._current = min(available, key=lambda h: h.score).url
+            return self._current
+
+    def current(self) -> str:
+        """
+        Returns the upload host to use for the next upload
+        :return: Base URL of the host.
+        """
+        if self._current is None:
+            return self._select()
+        return self._current
+
+    def report(self, url: str, nbytes: int, seconds: float, ok: bool, concurrency: int = 1,
+               limit: Optional[int] = None) -> None:
+        """
+        Feeds the result of an upload back to the selector. Switches host when the current one degrades.
+        :param url: Base URL of the host used.
+        :param nbytes: Amount of bytes sent.
+        :param seconds: Duration of the upload in seconds.
+        :param ok: True if the upload succeeded.
+        :param concurrency: Amount of transfers sharing the bandwidth when the upload started.
+        :param limit: Bandwidth limit in bytes per second when the upload started, None if unlimited.
+        :return:
+        """
+        host = self.hosts.get(url.rstrip("/"))
+        if host is None:
+            return
+        degraded = False
+        with self._lock:
+            if not ok:
+                host.failures += 1
+                degraded = host.failures >= self.max_failures
+            else:
+                host.failures = 0
+                # Small uploads are dominated by latency and say little about the host throughput
+                if nbytes >= 1024 * 1024 and seconds > 0:
+                    speed = nbytes / seconds
+                    host.throughput = speed if host.throughput is None else 0.7 * host.throughput + 0.3 * speed
+                    # A transfer sharing the bandwidth with others or throttled to a lower limit is slower without
+                    # the host being any slower, so the rate of the host is compared across the concurrent
+                    # transfers, and with the limit when it is under the best rate
+                    rate = speed * max(1, concurrency)
+                    host.rate = rate if host.rate is None else 0.7 * host.rate + 0.3 * rate
+                    host.baseline = max(host.baseline or 0.0, host.rate)
+                    expected = min(host.baseline, limit) if limit else host.baseline
+                    degraded = host.rate < expected * self.degrade_ratio and len(self.hosts) > 1
+            if degraded:
+                host.degraded_until = time.monotonic() + self.cooldown
+                host.failures = 0
+                host.baseline = host.rate
+        if degraded and self._current == host.url:
+            new = self._select()
+            if new != host.url:
+                self.log.warning("endpoint", f"Upload host {host.url} degraded. Switching to {new}.")
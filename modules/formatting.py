@@ -1,8 +1,8 @@
 """
 TeraBox Uploader CLI: formatting.py
 This module is used to format the output of the program.
-It uses the colorama library to color the output.
-Used in: main.py
+The messages are written through the log backend, which colors the console output with the colorama library.
+Used in: main.py and every module in this folder
 
 This program is provided as-is, without any warranty.
 This program is not affiliated with Terabox in any way.
@@ -13,28 +13,118 @@ For more information, please visit https://github.com/dnigamer/TeraboxUploaderCL
 If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
 """
 
+import math
+import os
 from datetime import datetime
+from typing import Optional
 
-from colorama import Fore, Back, Style
+from modules.logbackend import LEVELS, LogBackend, get_backend
+
+
+def convert_size(size_bytes: int) -> str:
+    """
+    Converts bytes to human-readable size
+    :param size_bytes: The size in bytes to convert.
+    :return: The size as a human-readable string.
+    """
+    if size_bytes == 0:
+        return "0 B"
+    size_name = ("B", "KB", "MB", "GB", "TB")
+    it = min(int(math.floor(math.log(size_bytes, 1024))), len(size_name) - 1)
+    p = math.pow(1024, it)
+    size = round(size_bytes / p, 2)
+    return f"{size} {size_name[it]}"
+
+
+def short_path(path: str, prefer_base: Optional[str] = None) -> str:
+    """
+    Return a short display path for logs.
+    - Prefer a path relative to cwd when possible.
+    - If that results in a leading '..', and prefer_base is provided, return a path relative to prefer_base
+      prefixed with the base directory name (e.g. 'source/sub1/file').
+    - Fall back to absolute path if relpaths fail.
+    Paths are returned using the OS-native separators.
+    """
+    try:
+        abs_path = os.path.abspath(path)
+    except Exception:
+        return str(path)
+
+    # If we have a prefer_base (usually SOURCE_DIR), try to show path relative to it
+    if prefer_base:
+        try:
+            abs_base = os.path.abspath(prefer_base)
+            # If path is inside prefer_base, show as 'basename_of_base/relative/path'
+            try:
+                common = os.path.commonpath([abs_path, abs_base])
+            except Exception:
+                common = None
+            if common == abs_base:
+                rel = os.path.relpath(abs_path, abs_base)
+                if rel == '.' or rel == './':
+                    return os.path.normpath(os.path.basename(abs_base))
+                return os.path.normpath(os.path.join(os.path.basename(abs_base), rel))
+
+            # If not strictly inside, try relative to parent of prefer_base to get 'source/..' style
+            base_parent = os.path.dirname(abs_base)
+            try:
+                rel2 = os.path.relpath(abs_path, base_parent)
+                if not rel2.startswith('..'):
+                    return os.path.normpath(rel2)
+            except Exception:
+                pass
+        except Exception:
+            pass
+
+    # Fallback to a relpath to cwd if it doesn't go outside, otherwise absolute
+    try:
+        relcwd = os.path.relpath(abs_path, os.getcwd())
+        if not relcwd.startswith('..'):
+            return os.path.normpath(relcwd)
+    except Exception:
+        pass
+
+    return os.path.normpath(abs_path)
 
 
 class Formatting:
     """
     This class is used to format the output of the program.
-    It uses the colorama library to color the output.
+    The messages are written by the log backend (see logbackend.py), which colors the console output with the
+    colorama library and can also write them to JSON-lines files.
     """
-    def __init__(self, timestamps=False):
+    def __init__(self, timestamps=False, backend: Optional[LogBackend] = None):
         """
-        This method initializes the colorama library.
         :param timestamps: If True, the output will be formatted with a timestamp.
+        :param backend: Backend the messages are written to. Defaults to the backend shared by the program.
         """
         if timestamps:
             self.timestamps = True
         else:
             self.timestamps = False
-        self.fore = Fore
-        self.back = Back
-        self.style = Style
+        self.backend = backend
+        self._colorama = None
+
+    @property
+    def _colors(self):
+        # colorama is only imported when the first message is printed
+        if self._colorama is None:
+            import colorama
+
+            self._colorama = colorama
+        return self._colorama
+
+    @property
+    def fore(self):
+        return self._colors.Fore
+
+    @property
+    def back(self):
+        return self._colors.Back
+
+    @property
+    def style(self):
+        return self._colors.Style
 
     def timestamp(self) -> str:
         """
@@ -44,52 +134,65 @@ class Formatting:
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') if self.timestamps else ''
         return f"{self.style.BRIGHT}[{timestamp}]{self.style.RESET_ALL}"
 
-    def error(self, subject: str, message: str) -> None:
+    def enabled(self, level: str) -> bool:
+        """
+        Checks if the messages of a level are written, to skip building expensive messages
+        :param level: debug, info, success, warning or error.
+        :return: True if the messages of the level are written.
+        """
+        return (self.backend or get_backend()).enabled(level)
+
+    def _log(self, level: str, subject: str, message: str, fields: dict) -> None:
+        backend = self.backend or get_backend()
+        if LEVELS[level] >= backend.level:
+            backend.emit(level, subject, message, self.timestamps, fields)
+
+    def error(self, subject: str, message: str, **fields) -> None:
         """
         This method is used to format a error message.
         :param subject: Add a classification to the logged message.
         :param message: The error message.
+        :param fields: Extra values of the message, written to the JSON-lines logs.
         :return:
         """
-        return print(f"{self.timestamp()}{self.style.BRIGHT}{self.fore.RED} {subject.upper().ljust(12)}: "
-                     f"{self.style.RESET_ALL}{message}")
+        self._log("error", subject, message, fields)
 
-    def warning(self, subject: str, message: str) -> None:
+    def warning(self, subject: str, message: str, **fields) -> None:
         """
         This method is used to format a warning message.
         :param subject: Add a classification to the logged message.
         :param message: The warning message.
+        :param fields: Extra values of the message, written to the JSON-lines logs.
         :return:
         """
-        return print(f"{self.timestamp()}{self.style.BRIGHT}{self.fore.YELLOW} {subject.upper().ljust(12)}: "
-                     f"{self.style.RESET_ALL}{message}")
+        self._log("warning", subject, message, fields)
 
-    def success(self, subject: str, message: str) -> None:
+    def success(self, subject: str, message: str, **fields) -> None:
         """
         This method is used to format a success message.
         :param subject: Add a classification to the logged message.
         :param message: The success message.
+        :param fields: Extra values of the message, written to the JSON-lines logs.
         :return:
         """
-        return print(f"{self.timestamp()}{self.style.BRIGHT}{self.fore.GREEN} {subject.upper().ljust(12)}: "
-                     f"{self.style.RESET_ALL}{message}")
+        self._log("success", subject, message, fields)
 
-    def info(self, subject: str, message: str) -> None:
+    def info(self, subject: str, message: str, **fields) -> None:
         """
         This method is used to format an info message.
         :param subject: Add a classification to the logged message.
         :param message: The info message.
+        :param fields: Extra values of the message, written to the JSON-lines logs.
         :return:
         """
-        return print(f"{self.timestamp()}{self.style.BRIGHT}{self.fore.CYAN} {subject.upper().ljust(12)}: "
-                     f"{self.style.RESET_ALL}{message}")
+        self._log("info", subject, message, fields)
 
-    def debug(self, subject: str, message: str) -> None:
+    def debug(self, subject: str, message: str, **fields) -> None:
         """
         This method is used to format a debug message.
         :param subject: Add a classification to the logged message.
         :param message: The debug message.
+        :param fields: Extra values of the message, written to the JSON-lines logs.
         :return:
         """
-        return print(f"{self.timestamp()}{self.style.BRIGHT}{self.fore.MAGENTA} {subject.upper().ljust(12)}: "
-                     f"{self.style.RESET_ALL}{message}")
+        self._log("debug", subject, message, fields)
@@ -0,0 +1,328 @@
+"""
+TeraBox Uploader CLI: integrity.py
+This module is used to keep a signed record of the content of the uploaded files.
+The MD5 hashes sent to Terabox when a file is uploaded only cover its parts of 120MB, and they are thrown away after
+the run. With integrity enabled, every uploaded file is also hashed with SHA-256 in blocks of a few MB, in the same
+pass as the MD5 hashes, and the hashes of its blocks are combined into a Merkle root. The hashes of the files of a run
+are saved in a manifest signed with HMAC-SHA256, which can also be uploaded next to the files. The verify command
+checks the blocks of the files on the cloud in parallel against the manifests, and the restore command downloads
+again only the blocks that don't match.
+Used in: uploader.py, verify.py, restore.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import Optional
+
+from modules.formatting import Formatting
+from modules.throttle import BandwidthSettingException, parse_rate
+
+INTEGRITY_VERSION = 1
+INTEGRITY_DIR = "integrity"
+KEY_FILE = "integrity.key"
+BLOCK_SIZE = 4 * 1024 * 1024
+# Directory of the uploaded manifests, inside the remote directory
+REMOTE_DIR = ".integrity"
+READ_BLOCK = 1024 * 1024
+
+
+class IntegritySettingException(Exception):
+    """
+    Exception raised when the integrity settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def merkle_root(blocks: list) -> str:
+    """
+    Combines the SHA-256 hashes of the blocks of a file into a single hash
+    :param blocks: list of hex digests of the blocks.
+    :return: Hex digest of the root. Each pair of nodes of a level is hashed together, and the last node of a level
+    with an odd amount of nodes goes up as it is.
+    """
+    level = [bytes.fromhex(block) for block in blocks]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        paired = [hashlib.sha256(b"\x01" + level[index] + level[index + 1]).digest()
+                  for index in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+
+def block_digests(path: str, size: int, chunk_size: int, split_threshold: int, block_size: int = BLOCK_SIZE) -> tuple:
+    """
+    Calculates the MD5 hash of every part of a file and the SHA-256 hash of every block of it, reading it once
+    :param path: Path of the file.
+    :param size: Size of the file in bytes.
+    :param chunk_size: Size of each part when the file is split.
+    :param split_threshold: Files of this size or bigger are split in parts.
+    :param block_size: Size of the blocks hashed with SHA-256.
+    :return: (list of MD5 hex digests, one per part, list of SHA-256 hex digests, one per block) tuple.
+    """
+    part_size = chunk_size if size >= split_threshold else max(size, 1)
+    md5s, shas = [], []
+    md5, sha = hashlib.md5(), hashlib.sha256()
+    in_part = in_block = 0
+    remaining = size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            data = f.read(min(READ_BLOCK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            view = memoryview(data)
+            while view:
+                take = min(len(view), part_size - in_part, block_size - in_block)
+                md5.update(view[:take])
+                sha.update(view[:take])
+                view = view[take:]
+                in_part += take
+                in_block += take
+                if in_part == part_size:
+                    md5s.append(md5.hexdigest())
+                    md5, in_part = hashlib.md5(), 0
+                if in_block == block_size:
+                    shas.append(sha.hexdigest())
+                    sha, in_block = hashlib.sha256(), 0
+    if in_part or not md5s:
+        md5s.append(md5.hexdigest())
+    if in_block or not shas:
+        shas.append(sha.hexdigest())
+    return md5s, shas
+
+
+def data_blocks(data: bytes, block_size: int = BLOCK_SIZE) -> list:
+    """
+    Calculates the SHA-256 hash of every block of data in memory
+    :param data: The data.
+    :param block_size: Size of the blocks.
+    :return: list of hex digests.
+    """
+    return [hashlib.sha256(data[offset:offset + block_size]).hexdigest()
+            for offset in range(0, len(data), block_size)] or [hashlib.sha256(b"").hexdigest()]
+
+
+def file_blocks(path: str, block_size: int = BLOCK_SIZE, workers: int = 4) -> list:
+    """
+    Calculates the SHA-256 hash of every block of a file, hashing the blocks in parallel
+    :param path: Path of the file.
+    :param block_size: Size of the blocks.
+    :param workers: Amount of blocks hashed at the same time.
+    :return: list of hex digests.
+    """
+    size = os.path.getsize(path)
+
+    def digest(offset: int) -> str:
+        sha = hashlib.sha256()
+        remaining = min(block_size, size - offset)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while remaining > 0:
+                data = f.read(min(READ_BLOCK, remaining))
+                if not data:
+                    break
+                sha.update(data)
+                remaining -= len(data)
+        return sha.hexdigest()
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        return list(pool.map(digest, range(0, size, block_size) or [0]))
+
+
+def corrupted(expected: list, actual: list) -> list:
+    """
+    Compares the block hashes of a file with the hashes of its manifest
+    :param expected: Hex digests of the manifest.
+    :param actual: Hex digests of the file.
+    :return: list of the indexes of the blocks that differ.
+    """
+    return [index for index, (wanted, found) in enumerate(zip_longest(expected, actual)) if wanted != found]
+
+
+def remote_key(path: str) -> str:
+    """
+    Normalizes a cloud path for comparisons
+    :param path: The cloud path.
+    :return: The path with forward slashes, a leading slash and no trailing slash.
+    """
+    return "/" + path.replace("\\", "/").strip("/")
+
+
+class IntegrityManifest:
+    """
+    Signed record of the block hashes of the files uploaded by a run.
+    """
+
+    def __init__(self, enabled: bool = False, directory: str = INTEGRITY_DIR, block_size: int = BLOCK_SIZE,
+                 keypath: str = KEY_FILE, upload: bool = False, log: Optional[Formatting] = None):
+        """
+        :param enabled: If True, the uploaded files are hashed and recorded.
+        :param directory: Directory of the manifests of every run.
+        :param block_size: Size of the blocks hashed with SHA-256.
+        :param keypath: Path of the key the manifests are signed with. It is created with the first manifest.
+        :param upload: If True, the manifest of a run is also uploaded to the .integrity directory of the remote
+        directory.
+        :param log: Formatting object used for logging.
+        """
+        self.enabled = enabled
+        self.directory = directory
+        self.block_size = block_size
+        self.keypath = keypath
+        self.upload = upload
+        self.log = log or Formatting(timestamps=True)
+        self.files = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, section: dict, log: Optional[Formatting] = None) -> "IntegrityManifest":
+        """
+        Builds the manifest from the "integrity" section of settings.json
+        :param section: dict with the optional "enabled", "directory", "blocksize", "key" and "upload" keys.
+        :param log: Formatting object used for logging.
+        :return: IntegrityManifest object
+        """
+        try:
+            block_size = parse_rate(section.get("blocksize", "4MB"))
+        except BandwidthSettingException as e:
+            raise IntegritySettingException(f"Invalid integrity block size in settings.json: "
+                                            f"{section.get('blocksize')}") from e
+        if not block_size:
+            raise IntegritySettingException("The integrity block size in settings.json must be more than 0.")
+        return cls(str(section.get("enabled", "false")).lower() == "true",
+                   section.get("directory", INTEGRITY_DIR) or INTEGRITY_DIR, block_size,
+                   section.get("key", KEY_FILE) or KEY_FILE, str(section.get("upload", "false")).lower() == "true",
+                   log)
+
+    def _key(self, create: bool = False) -> Optional[bytes]:
+        if not os.path.exists(self.keypath):
+            if not create:
+                return None
+            # Readable by the owner only, like the encryption key should be
+            fd = os.open(self.keypath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(base64.urlsafe_b64encode(os.urandom(32)))
+            self.log.warning("integrity", f"Created the integrity key {self.keypath}. Keep a copy of it to check the "
+                                          f"manifests on another machine.")
+        with open(self.keypath, "rb") as f:
+            return base64.urlsafe_b64decode(f.read().strip())
+
+    @staticmethod
+    def _signature(body: dict, key: bytes) -> str:
+        return hmac.new(key, json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf8"),
+                        hashlib.sha256).hexdigest()
+
+    def add(self, cloud_path: str, size: int, blocks: list, md5s: list, encrypted: bool) -> None:
+        """
+        Records an uploaded file
+        :param cloud_path: Path of the file on the cloud.
+        :param size: Size of the uploaded file in bytes.
+        :param blocks: SHA-256 hex digests of its blocks.
+        :param md5s: MD5 hex digests of its parts, the block list sent to Terabox.
+        :param encrypted: True if the uploaded file is the encrypted copy of the source file.
+        :return:
+        """
+        entry = {"size": size, "root": merkle_root(blocks), "blocks": blocks, "md5": md5s, "encrypted": encrypted}
+        with self._lock:
+            self.files[remote_key(cloud_path)] = entry
+
+    def save(self, remote_dir: str) -> Optional[str]:
+        """
+        Writes the signed manifest of the files recorded since the last save
+        :param remote_dir: Remote directory the files were uploaded to.
+        :return: Path of the manifest, or None if no file was recorded.
+        """
+        with self._lock:
+            files, self.files = self.files, {}
+        if not files:
+            return None
+        body = {"version": INTEGRITY_VERSION, "created": time.time(), "remotedir": remote_key(remote_dir),
+                "blocksize": self.block_size, "files": files}
+        manifest = dict(body, signature=self._signature(body, self._key(create=True)))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.json")
+        with open(f"{path}.part", "w", encoding="utf8") as f:
+            json.dump(manifest, f)
+        os.replace(f"{path}.part", path)
+        return path
+
+    def upload_manifest(self, client, path: str, remote_dir: str) -> str:
+        """
+        Uploads a saved manifest to the .integrity directory of the remote directory
+        :param client: TeraboxClient of the account the files were uploaded to.
+        :param path: Path of the manifest.
+        :param remote_dir: Remote directory the files were uploaded to.
+        :return: Cloud path of the manifest. Raises TransferError if the upload failed.
+        """
+        from modules.uploader import block_md5s
+
+        size = os.path.getsize(path)
+        md5s = block_md5s(path, size)
+        remote_path = f"{remote_dir.rstrip('/')}/{REMOTE_DIR}/{os.path.basename(path)}"
+        uploadid = client.precreate(remote_path, remote_dir, json.dumps(md5s))
+        client.upload_part(path, remote_path, uploadid, md5s[0], 0)
+        client.create(remote_path, remote_dir, uploadid, size, json.dumps(md5s))
+        return remote_path
+
+    def read(self, data: bytes, origin: str) -> Optional[dict]:
+        """
+        Reads a manifest and checks its signature
+        :param data: Content of the manifest.
+        :param origin: Path of the manifest in the logs.
+        :return: The manifest without its signature, or None if it can't be read or its signature is wrong.
+        """
+        try:
+            manifest = json.loads(data)
+            signature = manifest.pop("signature", "")
+            key = self._key()
+        except (ValueError, AttributeError, OSError) as e:
+            self.log.warning("integrity", f"The integrity manifest {origin} can't be read: {e}")
+            return None
+        if key is None:
+            self.log.warning("integrity", f"The integrity manifest {origin} can't be checked without the key "
+                                          f"{self.keypath}. Ignoring it.")
+            return None
+        if not hmac.compare_digest(str(signature), self._signature(manifest, key)):
+            self.log.warning("integrity", f"The signature of the integrity manifest {origin} is wrong. Ignoring it.")
+            return None
+        return manifest
+
+    def load(self, extra: Optional[list] = None) -> dict:
+        """
+        Reads the manifests of the directory and the manifests given, keeping the newest record of every file
+        :param extra: list of (content, origin) tuples of other manifests, like the uploaded ones.
+        :return: dict of cloud path to the record of the file, with the "blocksize" of its manifest.
+        """
+        sources = list(extra or [])
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith(".json"):
+                    path = os.path.join(self.directory, name)
+                    with open(path, "rb") as f:
+                        sources.append((f.read(), path))
+        manifests = [manifest for manifest in (self.read(data, origin) for data, origin in sources) if manifest]
+        files = {}
+        for manifest in sorted(manifests, key=lambda item: item.get("created", 0)):
+            for path, entry in manifest.get("files", {}).items():
+                files[remote_key(path)] = dict(entry, blocksize=manifest["blocksize"])
+        return files
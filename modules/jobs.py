@@ -0,0 +1,166 @@
+"""
+TeraBox Uploader CLI: jobs.py
+This module is used to run several upload jobs in one process.
+Each job of the "jobs" list of settings.json uploads its own source directory to its own remote directory, with its
+own ignore list, encryption key and post-upload action. The jobs share the client of the account (its connections,
+account type, upload host and curl checks), the tracker of the available quota, the temp space and its budget and a
+pool of workers, and the bandwidth limit is split equally between the running jobs.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import copy
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from modules.accounts import AccountPool
+from modules.client import TeraboxClient
+from modules.config import Settings, SettingsException
+from modules.formatting import Formatting
+from modules.progress import Dashboard, Progress
+from modules.quota import QuotaTracker
+from modules.tempspace import TempSpace
+from modules.uploader import Uploader, UploadResult, log_transfer_summary
+
+# Sections of settings.json a job can override. The other sections are shared by every job.
+JOB_SECTIONS = ("directories", "files", "encryption", "compression", "packing", "ignoredfiles")
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+DEFAULT_WORKERS = 4
+
+
+class Job:
+    """
+    A source directory uploaded to a remote directory, with its own settings.
+    """
+
+    def __init__(self, name: str, settings: Settings):
+        """
+        :param name: Name of the job, used in the logs and for its temp directory.
+        :param settings: Settings of the job.
+        """
+        self.name = name
+        self.settings = settings
+
+
+def job_settings(settings: Settings, job: dict) -> Settings:
+    """
+    Builds the settings of a job, overriding the sections of settings.json with the sections of the job
+    :param settings: Program settings.
+    :param job: Entry of the "jobs" list.
+    :return: Settings object of the job. The sections of the job are merged into the sections of the program
+    settings, except "ignoredfiles", which replaces the program list.
+    """
+    data = copy.deepcopy(settings.raw)
+    data.pop("jobs", None)
+    for section in JOB_SECTIONS:
+        if section not in job:
+            continue
+        if isinstance(job[section], dict):
+            data[section] = {**data.get(section, {}), **job[section]}
+        else:
+            data[section] = job[section]
+    return Settings(data)
+
+
+def load_jobs(settings: Settings) -> list:
+    """
+    Reads and validates the "jobs" list of settings.json
+    :param settings: Program settings.
+    :return: list of Job objects. Empty if the settings have no jobs.
+    """
+    jobs = []
+    for index, entry in enumerate(settings.jobs, 1):
+        if not isinstance(entry, dict):
+            raise SettingsException(f"Job {index} in settings.json is not an object.")
+        name = str(entry.get("name", f"job{index}"))
+        if not NAME_PATTERN.match(name):
+            raise SettingsException(f"Invalid job name: {name}. Use letters, digits, dots, dashes and underscores.")
+        if any(job.name == name for job in jobs):
+            raise SettingsException(f"There is more than one job named {name}.")
+        unknown = set(entry) - set(JOB_SECTIONS) - {"name"}
+        if unknown:
+            raise SettingsException(f"Job {name} has unknown settings: {', '.join(sorted(unknown))}. A job can only "
+                                    f"set {', '.join(JOB_SECTIONS)}.")
+        try:
+            job = Job(name, job_settings(settings, entry))
+            job.settings.validate()
+        except SettingsException as e:
+            raise SettingsException(f"Job {name}: {e.message}") from e
+        jobs.append(job)
+    return jobs
+
+
+class JobRunner:
+    """
+    Runs upload jobs in parallel with a shared client, quota tracker and progress.
+    """
+
+    def __init__(self, client: TeraboxClient, jobs: list, workers: int = DEFAULT_WORKERS, temp_dir: str = "./temp",
+                 log: Optional[Formatting] = None, accounts: Optional[AccountPool] = None):
+        """
+        :param client: Client of the account, shared by every job.
+        :param jobs: list of Job objects.
+        :param workers: Amount of jobs running at the same time.
+        :param temp_dir: Directory holding the temp directory of each run, unless set by the temp settings. The
+        jobs share the temp space and its budget, each with its own directory.
+        :param log: Formatting object used for logging.
+        :param accounts: AccountPool the files of every job are spread over, if there are several accounts.
+        """
+        self.client = client
+        self.jobs = jobs
+        self.workers = max(1, min(workers, len(jobs) or 1))
+        self.log = log or client.log
+        # The temp section can't be overridden by a job
+        self.temp = TempSpace.from_settings(jobs[0].settings.temp if jobs else {}, temp_dir, self.log)
+        self.quota = QuotaTracker(client)
+        self.progress = Progress()
+        self.accounts = accounts
+
+    def _run_job(self, job: Job) -> UploadResult:
+        self.log.info("job", f"Starting job {job.name}: {job.settings.source_dir} -> {job.settings.remote_dir}.")
+        with self.client.throttle.job(job.name):
+            uploader = Uploader(self.client, job.settings, temp_dir=self.temp.directory(job.name),
+                                log=self.log, progress=self.progress, quota=self.quota, shared=True,
+                                accounts=self.accounts, temp=self.temp)
+            result = uploader.run()
+        summary = (f"Job {job.name} finished: {len(result.uploaded)} uploaded, {len(result.skipped)} skipped, "
+                   f"{len(result.failed)} failed.")
+        if result.ok:
+            self.log.success("job", summary)
+        else:
+            self.log.warning("job", summary)
+        return result
+
+    def run(self) -> UploadResult:
+        """
+        Runs every job
+        :return: UploadResult with the outcome of the files of every job.
+        """
+        self.log.info("job", f"Running {len(self.jobs)} upload jobs, {self.workers} at a time...")
+        total = UploadResult()
+        # The jobs share one progress, shown by a single dashboard
+        dashboard = Dashboard(self.progress, self.log, mode=self.jobs[0].settings.progress if self.jobs else "false")
+        dashboard.start()
+        self.temp.open()
+        # Every job uploads one file at a time, or one per account
+        transfers = self.workers * (len(self.accounts) if self.accounts is not None else 1)
+        try:
+            with self.client.throttle.parallel(transfers), \
+                    ThreadPoolExecutor(self.workers, thread_name_prefix="job") as pool:
+                for result in pool.map(self._run_job, self.jobs):
+                    for status in ("uploaded", "skipped", "failed"):
+                        for path in getattr(result, status):
+                            total.add(status, path)
+        finally:
+            self.temp.close()
+            dashboard.stop()
+        log_transfer_summary(self.client, self.log)
+        return total
@@ -0,0 +1,322 @@
+"""
+TeraBox Uploader CLI: logbackend.py
+This module is used to write the messages of the Formatting class to one or more sinks, like the colored console
+output or a JSON-lines file. Messages below the level of every sink are dropped before anything is formatted, and
+the sinks can be written in batches by a background thread, so logging doesn't slow down the uploads.
+Used in: formatting.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+from typing import Optional
+
+LEVELS = {"debug": 10, "info": 20, "success": 25, "warning": 30, "error": 40}
+COLORS = {"debug": "MAGENTA", "info": "CYAN", "success": "GREEN", "warning": "YELLOW", "error": "RED"}
+BATCH_SIZE = 512
+
+
+class LogSettingException(Exception):
+    """
+    Exception raised when the logging settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def parse_level(value) -> int:
+    """
+    Parses a log level name
+    :param value: Level name (debug, info, success, warning or error) or number.
+    :return: Level number.
+    """
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().lower()
+    if text.isdigit():
+        return int(text)
+    if text not in LEVELS:
+        raise LogSettingException(f"Invalid log level: {value}. Use one of {', '.join(LEVELS)}.")
+    return LEVELS[text]
+
+
+class LogRecord:
+    """
+    A single log message.
+    """
+    __slots__ = ("time", "level", "levelno", "subject", "message", "timestamps", "fields")
+
+    def __init__(self, level: str, subject: str, message: str, timestamps: bool = True,
+                 fields: Optional[dict] = None):
+        self.time = time.time()
+        self.level = level
+        self.levelno = LEVELS[level]
+        self.subject = subject
+        self.message = message
+        self.timestamps = timestamps
+        self.fields = fields
+
+
+class Sink:
+    """
+    Destination of the log messages. Subclasses implement write.
+    """
+
+    def __init__(self, level="debug"):
+        """
+        :param level: Minimum level of the messages written to this sink.
+        """
+        self.level = parse_level(level)
+
+    def write(self, record: LogRecord) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class ConsoleSink(Sink):
+    """
+    Writes the messages to the console, colored by level, like the program always did.
+    """
+
+    def __init__(self, level="debug", stream=None, colors: bool = True):
+        """
+        :param level: Minimum level of the messages written to the console.
+        :param stream: Stream the messages are written to. Defaults to the current sys.stdout.
+        :param colors: If False, the messages are written without color codes.
+        """
+        super().__init__(level)
+        self.stream = stream
+        self.colors = colors
+        # Live output kept under the messages (the progress dashboard), with clear() and draw() methods
+        self.overlay = None
+        self._second = None
+        self._stamp = ""
+
+    def _timestamp(self, when: float) -> str:
+        # The timestamp only has second precision, so it is formatted once per second
+        second = int(when)
+        if second != self._second:
+            self._second = second
+            self._stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        return self._stamp
+
+    def format(self, record: LogRecord) -> str:
+        """
+        Formats a message for the console
+        :param record: The message.
+        :return: The formatted line, without line break.
+        """
+        stamp = self._timestamp(record.time) if record.timestamps else ""
+        if not self.colors:
+            return f"[{stamp}] {record.subject.upper().ljust(12)}: {record.message}"
+        from colorama import Fore, Style
+
+        return (f"{Style.BRIGHT}[{stamp}]{Style.RESET_ALL}{Style.BRIGHT}{getattr(Fore, COLORS[record.level])} "
+                f"{record.subject.upper().ljust(12)}: {Style.RESET_ALL}{record.message}")
+
+    def write(self, record: LogRecord) -> None:
+        if self.overlay is not None:
+            self.overlay.clear()
+        (self.stream or sys.stdout).write(self.format(record) + "\n")
+
+    def flush(self) -> None:
+        (self.stream or sys.stdout).flush()
+        if self.overlay is not None:
+            self.overlay.draw()
+
+
+class JsonLinesSink(Sink):
+    """
+    Appends the messages to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str, level="debug"):
+        """
+        :param path: Path of the log file.
+        :param level: Minimum level of the messages written to the file.
+        """
+        super().__init__(level)
+        self.path = path
+        self._file = None
+
+    def write(self, record: LogRecord) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf8", buffering=65536)
+        entry = {"time": round(record.time, 3), "level": record.level, "subject": record.subject,
+                 "message": record.message}
+        if record.fields:
+            entry.update(record.fields)
+        self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogBackend:
+    """
+    Sends the messages to the sinks, directly or through a background writer thread.
+    """
+
+    def __init__(self, sinks: Optional[list] = None, background: bool = False, queue_size: int = 10000):
+        """
+        :param sinks: list of Sink objects. Defaults to the colored console output.
+        :param background: If True, the messages are queued and written in batches by a background thread.
+        :param queue_size: Maximum amount of queued messages. Logging waits for the writer when it is full.
+        """
+        self.sinks = [ConsoleSink()] if sinks is None else sinks
+        self.level = min((sink.level for sink in self.sinks), default=max(LEVELS.values()) + 1)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(queue_size)
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "LogBackend":
+        """
+        Builds the backend from the "logging" section of settings.json
+        :param section: dict with the optional "level", "colors", "file", "filelevel" and "background" keys.
+        :return: LogBackend object
+        """
+        sinks = [ConsoleSink(section.get("level", "debug"),
+                             colors=str(section.get("colors", "true")).lower() == "true")]
+        if section.get("file"):
+            sinks.append(JsonLinesSink(section["file"], section.get("filelevel", "debug")))
+        return cls(sinks, background=str(section.get("background", "true")).lower() == "true")
+
+    def enabled(self, level: str) -> bool:
+        """
+        Checks if messages of a level are written by any sink
+        :param level: Level name.
+        :return: True if the messages of the level are written.
+        """
+        return LEVELS[level] >= self.level
+
+    def emit(self, level: str, subject: str, message: str, timestamps: bool = True,
+             fields: Optional[dict] = None) -> None:
+        """
+        Writes a message to the sinks
+        :param level: Level name.
+        :param subject: Classification of the message.
+        :param message: The message.
+        :param timestamps: If False, the console output has no timestamp.
+        :param fields: Extra values of the message, only written to the JSON-lines files.
+        :return:
+        """
+        if LEVELS[level] < self.level:
+            return
+        record = LogRecord(level, subject, message, timestamps, fields)
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(record)
+        else:
+            self._write([record])
+
+    def _write(self, records: list) -> None:
+        with self._lock:
+            for sink in self.sinks:
+                try:
+                    for record in records:
+                        if record.levelno >= sink.level:
+                            sink.write(record)
+                    sink.flush()
+                except (OSError, ValueError):
+                    # A closed console or a full disk must not stop the uploads
+                    pass
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write([record for record in batch if record is not None])
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                return
+
+    def flush(self) -> None:
+        """
+        Waits until every queued message is written
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        else:
+            self._write([])
+
+    def close(self) -> None:
+        """
+        Writes the queued messages, stops the writer thread and closes the sinks
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._queue is not None:
+            # Messages queued while the writer was stopping
+            remaining = []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            self._write([record for record in remaining if record is not None])
+        with self._lock:
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except (OSError, ValueError):
+                    pass
+
+
+_backend = None
+
+
+def get_backend() -> LogBackend:
+    """
+    Returns the backend used by every Formatting object without its own backend
+    :return: LogBackend object. Defaults to a direct, colored console output.
+    """
+    global _backend
+    if _backend is None:
+        _backend = LogBackend()
+    return _backend
+
+
+def set_backend(backend: LogBackend) -> None:
+    """
+    Replaces the backend used by every Formatting object without its own backend
+    :param backend: The new backend. The queued messages of the previous one are written first.
+    :return:
+    """
+    global _backend
+    previous = _backend
+    _backend = backend
+    if previous is not None and previous is not backend:
+        previous.close()
@@ -0,0 +1,378 @@
+"""
+TeraBox Uploader CLI: metrics.py
+This module is used to collect counters and histograms of the uploads (bytes, files per outcome, stage durations,
+API errors and retries) and to export them in the Prometheus text format, through an HTTP endpoint or a file for
+the textfile collector of the node exporter.
+Used in: main.py, uploader.py, retry.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from modules.formatting import Formatting
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+                   1800.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsSettingException(Exception):
+    """
+    Exception raised when the metrics settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base class of the metrics. Values are kept per combination of label values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        """
+        :param name: Metric name.
+        :param documentation: Help text of the metric.
+        :param labelnames: Names of the labels of the metric.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> list:
+        """
+        Returns the samples of the metric
+        :return: list of (suffix, label string, value) tuples.
+        """
+        with self._lock:
+            return [("", _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        """
+        Formats the metric in the Prometheus text format
+        :return: The metric lines.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_number(value)}" for suffix, labels, value in self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    Value that only goes up.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down. Can also be read from a function when the metrics are exported.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        """
+        Reads the value of the gauge (without labels) from a function
+        :param function: Function returning the value, or None to use the set value again.
+        :return:
+        """
+        self._function = function
+
+    def samples(self) -> list:
+        if self._function is not None:
+            return [("", "", self._function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    samples.append(("_bucket", _labels(self.labelnames, key, f'le="{_number(bound)}"'),
+                                    cumulative))
+                samples.append(("_sum", _labels(self.labelnames, key), total))
+                samples.append(("_count", _labels(self.labelnames, key), count))
+        return samples
+
+
+class Metrics:
+    """
+    Metrics of the uploader. It listens to the stage, transfer and file events of the Progress tracker.
+    """
+
+    def __init__(self):
+        self.bytes_uploaded = Counter("terabox_uploaded_bytes_total", "Bytes of the files and parts uploaded.")
+        self.files = Counter("terabox_files_total", "Processed files per outcome (uploaded, skipped, failed or "
+                                                    "mismatch).", ("outcome",))
+        self.stage_seconds = Histogram("terabox_stage_duration_seconds", "Duration of each stage of the upload "
+                                                                         "(scan, encrypt, hash, precreate, upload, "
+                                                                         "create, post).", ("stage",))
+        self.part_seconds = Histogram("terabox_part_upload_duration_seconds", "Duration of each file or part "
+                                                                              "upload.")
+        self.api_errors = Counter("terabox_api_errors_total", "Failed requests per operation, error kind and "
+                                                              "errno, HTTP status or curl exit code.",
+                                  ("operation", "kind", "code"))
+        self.retries = Counter("terabox_retries_total", "Retried requests per operation.", ("operation",))
+        self.throughput = Gauge("terabox_upload_throughput_bytes_per_second", "Upload throughput of the last "
+                                                                              "seconds.")
+        self.run_timestamp = Gauge("terabox_last_run_timestamp_seconds", "End time of the last run.")
+        self.run_duration = Gauge("terabox_last_run_duration_seconds", "Duration of the last run.")
+        self.run_success = Gauge("terabox_last_run_success", "1 if every file of the last run was uploaded or "
+                                                             "skipped, 0 otherwise.")
+        self.metrics = [self.bytes_uploaded, self.files, self.stage_seconds, self.part_seconds, self.api_errors,
+                        self.retries, self.throughput, self.run_timestamp, self.run_duration, self.run_success]
+
+    def on_stage(self, key: str, stage: str, started: float, ended: float) -> None:
+        self.stage_seconds.observe(ended - started, stage=stage)
+
+    def on_transfer(self, key: str, part: int, nbytes: int, started: float, ended: float, ok: bool) -> None:
+        if ok:
+            self.bytes_uploaded.inc(nbytes)
+            self.part_seconds.observe(ended - started)
+
+    def on_finish(self, key: str, status: str, size: int) -> None:
+        self.files.inc(outcome=status)
+
+    def record_error(self, operation: str, error) -> None:
+        """
+        Counts a failed request
+        :param operation: Name of the operation.
+        :param error: The TransferError of the request.
+        :return:
+        """
+        self.api_errors.inc(operation=operation, kind=error.kind, code="" if error.code is None else error.code)
+
+    def record_run(self, started: float, ok: bool) -> None:
+        """
+        Records the end of a run
+        :param started: time.time() at the start of the run.
+        :param ok: True if every file was uploaded or skipped.
+        :return:
+        """
+        now = time.time()
+        self.run_timestamp.set(now)
+        self.run_duration.set(now - started)
+        self.run_success.set(1 if ok else 0)
+
+    def render(self) -> str:
+        """
+        Formats every metric in the Prometheus text format
+        :return: The exposition text.
+        """
+        return "".join(metric.render() for metric in self.metrics)
+
+
+_metrics = None
+
+
+def get_metrics() -> Metrics:
+    """
+    Returns the metrics shared by the program
+    :return: Metrics object
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+class MetricsExporter:
+    """
+    Exports the metrics through an HTTP endpoint and/or a file written periodically.
+    """
+
+    def __init__(self, metrics: Optional[Metrics] = None, port: Optional[int] = None, address: str = "127.0.0.1",
+                 textfile: str = "", interval: float = 15.0, log: Optional[Formatting] = None):
+        """
+        :param metrics: Exported metrics. Defaults to the metrics shared by the program.
+        :param port: Port of the HTTP endpoint (/metrics). Disabled if None.
+        :param address: Address the HTTP endpoint listens on.
+        :param textfile: Path of the file for the textfile collector. Disabled if empty.
+        :param interval: Time between writes of the file in seconds. It is also written when the exporter stops.
+        :param log: Formatting object used for logging.
+        """
+        self.metrics = metrics or get_metrics()
+        self.port = port
+        self.address = address
+        self.textfile = textfile
+        self.interval = interval
+        self.log = log or Formatting(timestamps=True)
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_settings(cls, section: dict, metrics: Optional[Metrics] = None,
+                      log: Optional[Formatting] = None) -> "MetricsExporter":
+        """
+        Builds the exporter from the "metrics" section of settings.json
+        :param section: dict with the optional "port", "address", "textfile" and "interval" keys.
+        :param metrics: Exported metrics.
+        :param log: Formatting object used for logging.
+        :return: MetricsExporter object
+        """
+        try:
+            port = int(section["port"]) if str(section.get("port", "")).strip() else None
+            interval = float(section.get("interval", "15"))
+        except ValueError as e:
+            raise MetricsSettingException(f"Invalid metrics settings: {e}") from e
+        return cls(metrics, port, section.get("address", "127.0.0.1"), section.get("textfile", ""), interval, log)
+
+    @property
+    def enabled(self) -> bool:
+        return self.port is not None or bool(self.textfile)
+
+    def start(self) -> None:
+        """
+        Starts the HTTP endpoint and the textfile writer
+        :return:
+        """
+        if self.port is not None:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", CONTENT_TYPE)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+            except OSError as e:
+                self.log.error("metrics", f"Could not start the metrics endpoint on {self.address}:{self.port}: {e}")
+            else:
+                self._server.daemon_threads = True
+                thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+                self.log.info("metrics", f"Serving metrics on http://{self.address}:{self.port}/metrics")
+        if self.textfile:
+            thread = threading.Thread(target=self._write_periodically, name="metrics-textfile", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _write_periodically(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write_textfile()
+
+    def write_textfile(self) -> None:
+        """
+        Writes the metrics to the textfile, atomically
+        :return:
+        """
+        temp_path = f"{self.textfile}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf8") as f:
+                f.write(self.metrics.render())
+            os.replace(temp_path, self.textfile)
+        except OSError as e:
+            self.log.warning("metrics", f"Could not write the metrics file {self.textfile}: {e}")
+
+    def stop(self) -> None:
+        """
+        Writes the textfile a last time and stops the HTTP endpoint
+        :return:
+        """
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.textfile:
+            self.write_textfile()
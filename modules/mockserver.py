@@ -0,0 +1,470 @@
+"""
+TeraBox Uploader CLI: mockserver.py
+This module is a local stand-in for the Terabox API, used to try and benchmark the uploader without an account.
+It implements the endpoints used by the program (list, filemetas, precreate, create, filemanager, quota, membership
+query, locate-upload and the superfile2 upload) and keeps the uploaded files in memory, optionally with their content so
+they can be downloaded again with range requests. Latency, bandwidth and errors can be injected to see how the
+uploader behaves on a slow or flaky connection.
+Used in: benchmark.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from modules.formatting import Formatting
+from modules.throttle import TokenBucket
+
+OPERATIONS = ("list", "filemetas", "precreate", "upload", "create", "filemanager", "quota", "vip", "locate",
+              "download")
+ERROR_KINDS = ("http", "errno", "md5", "drop")
+READ_BLOCK = 256 * 1024
+# Not an authentication or a permanent errno, so the uploader retries it
+INJECTED_ERRNO = 31034
+# Errnos of the file manager: source missing, destination exists, some entries failed
+MISSING_ERRNO = -9
+EXISTS_ERRNO = -8
+PARTIAL_ERRNO = 12
+
+
+class MockTerabox:
+    """
+    Local HTTP server answering like the Terabox API.
+    """
+
+    def __init__(self, address: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 bandwidth: Optional[int] = None, error_rate: float = 0.0, errors: tuple = ("http", "errno"),
+                 operations: Optional[tuple] = None, vip: bool = False, quota: int = 2 ** 40,
+                 seed: Optional[int] = None, store_content: bool = False, log: Optional[Formatting] = None):
+        """
+        :param address: Address the server listens on.
+        :param port: Port the server listens on. 0 picks a free port.
+        :param latency: Seconds added before every response.
+        :param bandwidth: Upload bandwidth in bytes per second, shared by every connection. None is unlimited.
+        :param error_rate: Probability of an injected error for every request, between 0 and 1.
+        :param errors: Kinds of injected errors: "http" (HTTP 500), "errno" (Terabox errno), "md5" (wrong MD5 hash
+        of an uploaded part) and "drop" (connection closed without a response).
+        :param operations: Operations that get injected errors (see OPERATIONS). Defaults to all of them.
+        :param vip: Answer of the membership query.
+        :param quota: Total quota of the account in bytes.
+        :param seed: Seed of the injected errors, to repeat a run.
+        :param store_content: If True, the content of the uploaded files is kept, so they can be downloaded.
+        :param log: Formatting object used for logging.
+        """
+        for kind in errors:
+            if kind not in ERROR_KINDS:
+                raise ValueError(f"Invalid error kind: {kind}. Use one of {', '.join(ERROR_KINDS)}.")
+        self.address = address
+        self.port = port
+        self.latency = latency
+        self.bucket = TokenBucket(bandwidth)
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.operations = set(operations or OPERATIONS)
+        self.vip = vip
+        self.quota = quota
+        self.store_content = store_content
+        self.log = log or Formatting(timestamps=True)
+        self.files = {}
+        # Directories created with mkdir. The others only exist through the files inside them
+        self.dirs = set()
+        self.uploads = {}
+        self.requests = {}
+        self.injected = {}
+        self.received_bytes = 0
+        self._next_id = 1
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the running server, to use as the base URL and the upload host of the client
+        """
+        return f"http://{self.address}:{self.port}"
+
+    def start(self) -> str:
+        """
+        Starts the server in a background thread
+        :return: Base URL of the server.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # The headers and the body are written separately, and Nagle's algorithm would hold the body back until
+            # the client acknowledges the headers, adding the delayed ACK of the client to every reply
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                mock.handle(self, "GET")
+
+            def do_POST(self):
+                mock.handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-terabox", daemon=True)
+        self._thread.start()
+        self.log.info("mock", f"Mock Terabox server listening on {self.url}.")
+        return self.url
+
+    def stop(self) -> None:
+        """
+        Stops the server
+        :return:
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def used(self) -> int:
+        """
+        Returns the bytes used by the stored files
+        :return: Size in bytes.
+        """
+        with self._lock:
+            return sum(entry["size"] for entry in self.files.values())
+
+    def _inject(self, operation: str) -> Optional[str]:
+        if not self.error_rate or operation not in self.operations:
+            return None
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return None
+            kind = self._random.choice(self.errors)
+            if kind == "md5" and operation != "upload":
+                kind = "errno"
+            self.injected[operation] = self.injected.get(operation, 0) + 1
+        return kind
+
+    @staticmethod
+    def _reply(handler, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _read_body(self, handler, upload: bool = False):
+        """
+        Reads the request body
+        :return: The body, or the MD5 hash and the content (if stored) of the uploaded file for a multipart upload.
+        """
+        remaining = int(handler.headers.get("Content-Length", 0) or 0)
+        if not upload:
+            return handler.rfile.read(remaining) if remaining else b""
+        content = [] if self.store_content else None
+        boundary = handler.headers.get("Content-Type", "").partition("boundary=")[2].strip('"').encode()
+        tail = len(boundary) + 8  # "\r\n--" + boundary + "--\r\n"
+        md5, pending, started = hashlib.md5(), b"", False
+        total = remaining
+        while remaining > 0:
+            data = handler.rfile.read(min(READ_BLOCK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            self.bucket.consume(len(data))
+            pending += data
+            if not started:
+                # Skip the headers of the file part
+                head_end = pending.find(b"\r\n\r\n")
+                if head_end < 0:
+                    continue
+                pending, started = pending[head_end + 4:], True
+            if len(pending) > tail:
+                md5.update(pending[:-tail])
+                if content is not None:
+                    content.append(pending[:-tail])
+                pending = pending[-tail:]
+        # Whatever is left before the closing boundary is file content
+        end = pending.rfind(b"\r\n--" + boundary)
+        md5.update(pending[:end] if end >= 0 else pending)
+        if content is not None:
+            content.append(pending[:end] if end >= 0 else pending)
+        with self._lock:
+            self.received_bytes += total
+        return md5.hexdigest(), None if content is None else b"".join(content)
+
+    def handle(self, handler, method: str) -> None:
+        """
+        Answers a request of the HTTP server
+        :param handler: The request handler.
+        :param method: HTTP method of the request.
+        :return:
+        """
+        url = urlsplit(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        routes = {("GET", "/api/list"): ("list", self._list),
+                  ("GET", "/api/filemetas"): ("filemetas", self._filemetas),
+                  ("POST", "/api/precreate"): ("precreate", self._precreate),
+                  ("POST", "/rest/2.0/pcs/superfile2"): ("upload", self._upload),
+                  ("GET", "/rest/2.0/pcs/superfile2"): ("probe", lambda params: {"errno": 0}),
+                  ("POST", "/api/create"): ("create", self._create),
+                  ("POST", "/api/filemanager"): ("filemanager", self._filemanager),
+                  ("GET", "/api/quota"): ("quota", self._quota),
+                  ("GET", "/rest/2.0/membership/proxy/user"): ("vip", self._vip),
+                  ("GET", "/rest/2.0/pcs/file"): ("locate", self._locate)}
+        operation, action = routes.get((method, url.path), (None, None))
+        if method == "GET" and url.path.startswith(("/d/", "/file/")):
+            operation = "download"
+        body = self._read_body(handler, upload=operation == "upload")
+        if operation is None:
+            self._reply(handler, {"errno": 404, "errmsg": f"Unknown endpoint {method} {url.path}"}, 404)
+            return
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        kind = self._inject(operation)
+        if kind == "drop":
+            handler.close_connection = True
+            return
+        if kind == "http":
+            self._reply(handler, {"errno": -1, "errmsg": "injected server error"}, 500)
+            return
+        if kind == "errno":
+            self._reply(handler, {"error_code": INJECTED_ERRNO, "error_msg": "injected error"} if operation == "upload"
+                        else {"errno": INJECTED_ERRNO, "errmsg": "injected error"})
+            return
+        if operation == "download":
+            self._download(handler, url.path)
+            return
+
+        params = dict(query)
+        if operation == "upload":
+            params["md5"] = "0" * 32 if kind == "md5" else body[0]
+            params["content"] = body[1]
+        elif body:
+            params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+        self._reply(handler, action(params))
+
+    def _list(self, params: dict) -> dict:
+        directory = "/" + params.get("dir", "/").strip("/")
+        prefix = directory.rstrip("/") + "/"
+        entries, subdirs = [], set()
+        with self._lock:
+            for path, entry in self.files.items():
+                if not path.startswith(prefix):
+                    continue
+                name, _, rest = path[len(prefix):].partition("/")
+                if rest:
+                    subdirs.add(name)
+                else:
+                    entries.append({"server_filename": name, "path": path, "size": entry["size"], "isdir": 0,
+                                    "fs_id": entry["fs_id"], "md5": entry["md5"], "server_mtime": entry["mtime"]})
+            for path in self.dirs:
+                if path.startswith(prefix):
+                    subdirs.add(path[len(prefix):].partition("/")[0])
+        entries += [{"server_filename": name, "path": prefix + name, "size": 0, "isdir": 1} for name in subdirs]
+        entries.sort(key=lambda entry: entry["path"])
+        num, page = int(params.get("num", 1000)), int(params.get("page", 1))
+        return {"errno": 0, "list": entries[(page - 1) * num:page * num]}
+
+    def _filemetas(self, params: dict) -> dict:
+        info = []
+        with self._lock:
+            for path in json.loads(params.get("target", "[]")):
+                entry = self.files.get("/" + path.strip("/"))
+                if entry is not None:
+                    info.append({"path": "/" + path.strip("/"), "size": entry["size"], "isdir": 0,
+                                 "fs_id": entry["fs_id"], "md5": entry["md5"], "block_list": entry["block_list"],
+                                 "server_mtime": entry["mtime"]})
+                    if params.get("dlink") == "1":
+                        info[-1]["dlink"] = f"{self.url}/d/{entry['fs_id']}"
+        return {"errno": 0, "info": info}
+
+    def _precreate(self, params: dict) -> dict:
+        block_list = json.loads(params.get("block_list", "[]"))
+        uploadid = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[uploadid] = {"path": params.get("path", ""), "parts": {}}
+        return {"errno": 0, "uploadid": uploadid, "return_type": 1, "block_list": list(range(len(block_list)))}
+
+    def _upload(self, params: dict) -> dict:
+        uploadid = params.get("uploadid", "")
+        with self._lock:
+            upload = self.uploads.get(uploadid)
+            if upload is None:
+                return {"error_code": 31299, "error_msg": f"Unknown upload ID {uploadid}"}
+            upload["parts"][int(params.get("partseq", 0))] = params["md5"]
+            if params.get("content") is not None:
+                upload.setdefault("content", {})[int(params.get("partseq", 0))] = params["content"]
+        return {"md5": params["md5"], "uploadid": uploadid, "partseq": params.get("partseq", "0")}
+
+    def _create(self, params: dict) -> dict:
+        if params.get("isdir") == "1":
+            return self._mkdir(params)
+        uploadid = params.get("uploadid", "")
+        block_list = json.loads(params.get("block_list", "[]"))
+        size = int(params.get("size", 0))
+        path = "/" + params.get("path", "").strip("/")
+        with self._lock:
+            upload = self.uploads.get(uploadid)
+            if upload is None:
+                return {"errno": 31299, "errmsg": f"Unknown upload ID {uploadid}"}
+            if [upload["parts"].get(index) for index in range(len(block_list))] != block_list:
+                return {"errno": 31363, "errmsg": "block miss in superfile2"}
+            if sum(entry["size"] for entry in self.files.values()) + size > self.quota:
+                return {"errno": -10, "errmsg": "quota exceeded"}
+            del self.uploads[uploadid]
+            fs_id = self._next_id
+            self._next_id += 1
+            self.files[path] = {"size": size, "md5": block_list[0] if len(block_list) == 1 else "",
+                                "block_list": block_list, "fs_id": fs_id, "mtime": int(time.time())}
+            if "content" in upload:
+                self.files[path]["content"] = b"".join(upload["content"][index] for index in range(len(block_list)))
+        return {"errno": 0, "fs_id": fs_id, "path": path, "size": size, "isdir": 0}
+
+    def _mkdir(self, params: dict) -> dict:
+        path = "/" + params.get("path", "").strip("/")
+        with self._lock:
+            if path in self.files:
+                return {"errno": EXISTS_ERRNO, "errmsg": f"{path} is a file"}
+            parts = path.strip("/").split("/")
+            self.dirs.update("/" + "/".join(parts[:index]) for index in range(1, len(parts) + 1))
+            fs_id = self._next_id
+            self._next_id += 1
+        return {"errno": 0, "fs_id": fs_id, "path": path, "isdir": 1}
+
+    def _under(self, path: str) -> tuple:
+        # Files and created directories at or below a path
+        prefix = path.rstrip("/") + "/"
+        files = [name for name in self.files if name == path or name.startswith(prefix)]
+        dirs = [name for name in self.dirs if name == path or name.startswith(prefix)]
+        return files, dirs
+
+    def _transfer(self, operation: str, item: dict, ondup: str) -> int:
+        """
+        Moves, copies or renames a file or a directory with everything inside it
+        :return: errno of the entry.
+        """
+        source = "/" + item.get("path", "").strip("/")
+        parent = source.rpartition("/")[0]
+        destination = parent if operation == "rename" else "/" + item.get("dest", "").strip("/")
+        name = item.get("newname") or source.rpartition("/")[2]
+        target = f"{destination.rstrip('/')}/{name}"
+        files, dirs = self._under(source)
+        if not files and not dirs:
+            return MISSING_ERRNO
+        if target == source or target.startswith(source.rstrip("/") + "/"):
+            return EXISTS_ERRNO
+        existing = self._under(target)
+        if existing[0] or existing[1]:
+            if ondup == "skip":
+                return 0
+            if ondup == "overwrite":
+                for path in existing[0]:
+                    del self.files[path]
+                self.dirs.difference_update(existing[1])
+            elif ondup == "newcopy":
+                copy = 1
+                while any(self._under(f"{target}({copy})")):
+                    copy += 1
+                target = f"{target}({copy})"
+            else:
+                return EXISTS_ERRNO
+        for path in files:
+            entry = self.files[path] if operation != "copy" else dict(self.files[path], fs_id=self._next_id)
+            if operation == "copy":
+                self._next_id += 1
+            else:
+                del self.files[path]
+            self.files[target + path[len(source):]] = entry
+        if operation != "copy":
+            self.dirs.difference_update(dirs)
+        self.dirs.update(target + path[len(source):] for path in dirs)
+        return 0
+
+    def _filemanager(self, params: dict) -> dict:
+        operation = params.get("opera", "")
+        if operation not in ("move", "copy", "rename", "delete"):
+            return {"errno": 2, "errmsg": f"Unknown operation {operation}"}
+        info = []
+        with self._lock:
+            for item in json.loads(params.get("filelist", "[]")):
+                if operation == "delete":
+                    path = "/" + str(item).strip("/")
+                    files, dirs = self._under(path)
+                    for name in files:
+                        del self.files[name]
+                    self.dirs.difference_update(dirs)
+                    info.append({"errno": 0 if files or dirs else MISSING_ERRNO, "path": path})
+                else:
+                    errno = self._transfer(operation, item, params.get("ondup", "fail"))
+                    info.append({"errno": errno, "path": "/" + item.get("path", "").strip("/")})
+        failed = any(entry["errno"] for entry in info)
+        return {"errno": PARTIAL_ERRNO if failed else 0, "info": info, "taskid": 0}
+
+    def _download(self, handler, path: str) -> None:
+        """
+        Answers a download link with a redirect to the file, like Terabox does, and the file with range support
+        """
+        kind, _, fs_id = path.strip("/").partition("/")
+        with self._lock:
+            content = next((entry.get("content") for entry in self.files.values()
+                            if str(entry["fs_id"]) == fs_id), None)
+        if content is None:
+            self._reply(handler, {"errno": 31066, "errmsg": "file does not exist or has no stored content"}, 404)
+            return
+        if kind == "d":
+            handler.send_response(302)
+            handler.send_header("Location", f"{self.url}/file/{fs_id}")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        start, end = 0, len(content) - 1
+        ranged = handler.headers.get("Range", "").startswith("bytes=")
+        if ranged:
+            first, _, last = handler.headers["Range"][6:].partition("-")
+            start, end = int(first or 0), min(int(last) if last else end, end)
+            if start > end:
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{len(content)}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+        handler.send_response(206 if ranged else 200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", str(end - start + 1))
+        handler.send_header("Accept-Ranges", "bytes")
+        if ranged:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        handler.end_headers()
+        for offset in range(start, end + 1, READ_BLOCK):
+            data = content[offset:min(offset + READ_BLOCK, end + 1)]
+            self.bucket.consume(len(data))
+            handler.wfile.write(data)
+
+    def _quota(self, params: dict) -> dict:
+        return {"errno": 0, "total": self.quota, "used": self.used(), "free": 0}
+
+    def _vip(self, params: dict) -> dict:
+        return {"errno": 0, "data": {"member_info": {"is_vip": 1 if self.vip else 0}}}
+
+    def _locate(self, params: dict) -> dict:
+        return {"errno": 0, "host": self.url, "servers": [{"server": self.url}]}
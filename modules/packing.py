@@ -0,0 +1,300 @@
+"""
+TeraBox Uploader CLI: packing.py
+This module is used to pack small files into tar or zip bundles before the upload.
+Each upload pays for a precreate and a create request besides the upload itself, so thousands of tiny files spend
+most of their time waiting for the API. The small files are grouped into bundles up to a maximum size, which are
+uploaded (and encrypted) like any other file, together with a sidecar JSON index listing the offset of every file in
+the bundle, so a single file can be extracted, or downloaded with a range request, without reading the whole bundle.
+The bundles end at points chosen from the files themselves, so a new or removed file only changes its own bundle, and
+the bundles already on the cloud aren't written again.
+Used in: uploader.py, verify.py, planner.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import hashlib
+import json
+import os
+import struct
+from typing import Callable, Optional
+
+from modules.formatting import Formatting, convert_size
+from modules.throttle import BandwidthSettingException, parse_rate
+
+FORMATS = ("tar", "zip")
+DEFAULT_THRESHOLD = 1024 * 1024
+DEFAULT_BUNDLE_SIZE = 256 * 1024 * 1024
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+# Size of the fixed part of a zip local file header
+ZIP_HEADER = 30
+# Size of a tar block and of a tar record, the unit tar files are padded to
+TAR_BLOCK = 512
+TAR_RECORD = 20 * 512
+
+
+class PackingSettingException(Exception):
+    """
+    Exception raised when the packing settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class Packer:
+    """
+    Groups the small files of a scan into bundles.
+    """
+
+    def __init__(self, enabled: bool = False, threshold: int = DEFAULT_THRESHOLD,
+                 bundle_size: int = DEFAULT_BUNDLE_SIZE, archive: str = "tar", directory: str = "bundles",
+                 temp_dir: str = "./temp", log: Optional[Formatting] = None):
+        """
+        :param enabled: If False, pack() returns the files unchanged.
+        :param threshold: Files smaller than this size in bytes are packed.
+        :param bundle_size: Maximum size of a bundle in bytes. Bundles are about half of it on average.
+        :param archive: Format of the bundles, "tar" or "zip". Zip bundles are stored without compression.
+        :param directory: Directory of the bundles, relative to the remote directory.
+        :param temp_dir: Directory the bundles are written to before the upload.
+        :param log: Formatting object used for logging.
+        """
+        if archive not in FORMATS:
+            raise PackingSettingException(f"Invalid packing format: {archive}. Use one of {', '.join(FORMATS)}.")
+        self.enabled = enabled
+        self.threshold = threshold
+        self.bundle_size = bundle_size
+        self.archive = archive
+        self.directory = directory.replace("\\", "/").strip("/")
+        self.temp_dir = temp_dir
+        self.log = log or Formatting(timestamps=True)
+
+    @classmethod
+    def from_settings(cls, section: dict, temp_dir: str = "./temp", log: Optional[Formatting] = None) -> "Packer":
+        """
+        Builds the packer from the "packing" section of settings.json
+        :param section: dict with the optional "enabled", "threshold", "bundlesize", "format" and "directory" keys.
+        :param temp_dir: Directory the bundles are written to.
+        :param log: Formatting object used for logging.
+        :return: Packer object
+        """
+        try:
+            threshold = parse_rate(section.get("threshold", "1MB")) or 0
+            bundle_size = parse_rate(section.get("bundlesize", "256MB")) or DEFAULT_BUNDLE_SIZE
+        except BandwidthSettingException as e:
+            raise PackingSettingException(f"Invalid packing size: {e.message}") from e
+        if threshold > bundle_size:
+            raise PackingSettingException("The packing threshold can't be larger than the bundle size.")
+        return cls(str(section.get("enabled", "false")).lower() == "true", threshold, bundle_size,
+                   str(section.get("format", "tar")).lower(), section.get("directory", "bundles"), temp_dir, log)
+
+    def _cut(self, file: dict) -> bool:
+        """
+        Checks if a bundle ends after a file. The answer only depends on the path and the size of the file, so a file
+        added or removed in a bundle doesn't move the end of the following bundles, which keep their names.
+        :param file: The file entry.
+        :return: True for about one file every bundle_size / 2 bytes.
+        """
+        digest = hashlib.sha1(file['relative_path'].replace("\\", "/").encode("utf8", "surrogateescape")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64 < file['sizebytes'] / (self.bundle_size / 2)
+
+    def groups(self, files: dict) -> list:
+        """
+        Groups the small files of a scan into bundles. Files of the same directory stay next to each other.
+        :param files: dict of files, grouped by directory, as returned by Uploader.scan.
+        :return: list of the file entries of each bundle.
+        """
+        small = [file for entries in files.values() for file in entries if file['sizebytes'] < self.threshold]
+        groups, current, size = [], [], 0
+        for file in sorted(small, key=lambda entry: entry['relative_path'].replace("\\", "/")):
+            if current and size + file['sizebytes'] > self.bundle_size:
+                groups.append(current)
+                current, size = [], 0
+            current.append(file)
+            size += file['sizebytes']
+            if self._cut(file):
+                groups.append(current)
+                current, size = [], 0
+        if current:
+            groups.append(current)
+        # A bundle of a single file only adds overhead
+        return [group for group in groups if len(group) > 1]
+
+    @staticmethod
+    def bundle_name(members: list, archive: str) -> str:
+        """
+        Names a bundle after its content, so an unchanged set of files gets the same bundle name in the next run and
+        is skipped like any other file that already exists on the cloud
+        :param members: File entries of the bundle.
+        :param archive: Format of the bundle.
+        :return: The file name of the bundle.
+        """
+        digest = hashlib.sha1()
+        for file in members:
+            digest.update(f"{file['relative_path']}\0{file['sizebytes']}\0{os.stat(file['path']).st_mtime_ns}\n"
+                          .encode("utf8", "surrogateescape"))
+        return f"bundle-{digest.hexdigest()[:16]}.{archive}"
+
+    def estimate(self, members: list) -> tuple:
+        """
+        Estimates the size of a bundle and of its index without writing them
+        :param members: File entries of the bundle.
+        :return: (bundle size, index size) tuple in bytes.
+        """
+        names = [file['relative_path'].replace("\\", "/") for file in members]
+        if self.archive == "tar":
+            size = 2 * TAR_BLOCK
+            for name, file in zip(names, members):
+                # Every file has an extended PAX header with its exact mtime, and with its name if it is long or
+                # non-ASCII
+                extended = 32 + (len(name.encode("utf8")) + 12 if len(name) > 100 or not name.isascii() else 0)
+                size += (2 * TAR_BLOCK + -(-extended // TAR_BLOCK) * TAR_BLOCK
+                         + -(-file['sizebytes'] // TAR_BLOCK) * TAR_BLOCK)
+            size = -(-size // TAR_RECORD) * TAR_RECORD
+        else:
+            size = 22 + sum(ZIP_HEADER + 46 + 2 * len(name.encode("utf8")) + file['sizebytes']
+                            for name, file in zip(names, members))
+        index = {"version": INDEX_VERSION, "bundle": self.bundle_name(members, self.archive), "format": self.archive,
+                 "files": [{"path": name, "offset": size, "size": file['sizebytes'],
+                            "mtime": int(os.path.getmtime(file['path']))} for name, file in zip(names, members)]}
+        return size, len(json.dumps(index, indent=1).encode("utf8"))
+
+    def _write_tar(self, path: str, members: list) -> list:
+        import tarfile
+
+        def anonymize(info):
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            return info
+
+        with tarfile.open(path, "w", format=tarfile.PAX_FORMAT) as tar:
+            for file in members:
+                tar.add(file['path'], arcname=file['relative_path'].replace("\\", "/"), recursive=False,
+                        filter=anonymize)
+        with tarfile.open(path, "r") as tar:
+            return [(info.name, info.offset_data, info.size) for info in tar.getmembers()]
+
+    def _write_zip(self, path: str, members: list) -> list:
+        import zipfile
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+            for file in members:
+                archive.write(file['path'], arcname=file['relative_path'].replace("\\", "/"))
+            infos = archive.infolist()
+        offsets = []
+        with open(path, "rb") as f:
+            for info in infos:
+                # The data starts after the local header, whose name and extra field lengths are at bytes 26-30
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack("<HH", f.read(4))
+                offsets.append((info.filename, info.header_offset + ZIP_HEADER + name_length + extra_length,
+                                info.file_size))
+        return offsets
+
+    def _relative(self, name: str) -> str:
+        return f"{self.directory}/{name}" if self.directory else name
+
+    def _bundle(self, members: list) -> tuple:
+        """
+        Writes a bundle and its index to the temp directory
+        :return: (bundle entry, index entry) tuple of file entries, like the entries of a scan.
+        """
+        name = self.bundle_name(members, self.archive)
+        path = os.path.abspath(os.path.join(self.temp_dir, name))
+        writer = self._write_tar if self.archive == "tar" else self._write_zip
+        offsets = writer(path, members)
+        index = {"version": INDEX_VERSION, "bundle": name, "format": self.archive,
+                 "files": [{"path": member, "offset": offset, "size": size,
+                            "mtime": int(os.path.getmtime(file['path']))}
+                           for (member, offset, size), file in zip(offsets, members)]}
+        index_path = f"{path}{INDEX_SUFFIX}"
+        with open(index_path, "w", encoding="utf8") as f:
+            json.dump(index, f, indent=1)
+
+        relative = self._relative(name)
+        bundle = {"name": name, "path": path, "relative_path": relative, "sizebytes": os.path.getsize(path),
+                  "encrypted": False, "encrypterror": False, "md5mismatch": False, "packed": True,
+                  "members": members}
+        index_entry = {"name": name + INDEX_SUFFIX, "path": index_path, "relative_path": relative + INDEX_SUFFIX,
+                       "sizebytes": os.path.getsize(index_path), "encrypted": False, "encrypterror": False,
+                       "md5mismatch": False, "packed": True, "members": []}
+        return bundle, index_entry
+
+    def pack(self, files: dict, uploaded: Optional[Callable[[str], bool]] = None) -> dict:
+        """
+        Replaces the small files of a scan by bundles
+        :param files: dict of files, grouped by directory, as returned by Uploader.scan.
+        :param uploaded: Function telling if a path relative to the remote directory exists on the cloud. The bundles
+        already on the cloud with their index aren't written, and are returned with "exists" set instead.
+        :return: dict of files with the same layout. The bundles and their indexes are grouped under the temp
+        directory, and each bundle lists the entries of its files in "members".
+        """
+        if not self.enabled:
+            return files
+        groups = self.groups(files)
+        if not groups:
+            return files
+        packed = {id(file) for group in groups for file in group}
+        result = {}
+        for directory, entries in files.items():
+            kept = [file for file in entries if id(file) not in packed]
+            if kept:
+                result[directory] = kept
+
+        os.makedirs(self.temp_dir, exist_ok=True)
+        bundles = result.setdefault(os.path.abspath(self.temp_dir), [])
+        for members in groups:
+            name = self.bundle_name(members, self.archive)
+            relative = self._relative(name)
+            if uploaded is not None and uploaded(relative) and uploaded(relative + INDEX_SUFFIX):
+                # Its source files are still moved or deleted, like after an upload
+                bundles.append({"name": name, "path": os.path.abspath(os.path.join(self.temp_dir, name)),
+                                "relative_path": relative, "sizebytes": self.estimate(members)[0],
+                                "encrypted": False, "encrypterror": False, "md5mismatch": False, "packed": True,
+                                "members": members, "exists": True})
+                continue
+            bundle, index = self._bundle(members)
+            bundles.extend((bundle, index))
+            size = convert_size(sum(file['sizebytes'] for file in members))
+            self.log.success("pack", f"Packed {len(members)} files ({size}) into {bundle['name']}.")
+        existing = sum(1 for bundle in bundles if bundle.get("exists"))
+        self.log.info("pack", f"Packed {len(packed)} small files into {len(groups)} bundles"
+                              f"{f', {existing} of them already on the cloud' if existing else ''}.")
+        return result
+
+
+def load_index(path: str) -> dict:
+    """
+    Reads the sidecar index of a bundle
+    :param path: Path of the index.
+    :return: dict of the path of each file inside the bundle to its "offset", "size" and "mtime".
+    """
+    with open(path, "r", encoding="utf8") as f:
+        return {entry["path"]: entry for entry in json.load(f)["files"]}
+
+
+def extract(bundle: str, entry: dict, target: str) -> None:
+    """
+    Extracts a single file of a bundle, reading only its bytes
+    :param bundle: Path of the bundle.
+    :param entry: Entry of the file in the index of the bundle.
+    :param target: Path the file is written to.
+    :return:
+    """
+    with open(bundle, "rb") as source, open(target, "wb") as output:
+        source.seek(entry["offset"])
+        remaining = entry["size"]
+        while remaining > 0:
+            data = source.read(min(remaining, 1024 * 1024))
+            if not data:
+                raise OSError(f"Bundle {bundle} ends before the end of {entry['path']}.")
+            output.write(data)
+            remaining -= len(data)
+    if entry.get("mtime"):
+        os.utime(target, (entry["mtime"], entry["mtime"]))
@@ -0,0 +1,217 @@
+"""
+TeraBox Uploader CLI: planner.py
+This module is used to plan an upload without making it.
+The local files are scanned with the ignore rules of the settings, the small files are grouped into bundles, the size
+of the encrypted files and the amount of parts of the large ones are calculated, and the files that already exist on
+the cloud are found in the last listing of the remote directory kept in the cache. No request is made and nothing is
+written to the temp directory. The plan lists the files to upload, skip or leave out, and estimates how long the
+upload takes at a given bandwidth.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import time
+from typing import Optional
+
+from modules.cache import Cache
+from modules.client import TeraboxClient
+from modules.config import Settings
+from modules.formatting import Formatting
+from modules.integrity import remote_key
+from modules.packing import INDEX_SUFFIX
+from modules.uploader import Uploader, part_count
+
+PLAN_VERSION = 1
+# Time taken by a precreate, create or part upload request besides the transfer of the data
+REQUEST_TIME = 0.5
+VIP_MAX_SIZE = 21474836479
+FREE_MAX_SIZE = 4294967296
+
+
+class Plan:
+    """
+    Files of a planned upload and what happens to each of them.
+    """
+
+    def __init__(self, bandwidth: Optional[int] = None, request_time: float = REQUEST_TIME):
+        """
+        :param bandwidth: Upload speed in bytes per second used for the estimate. None if unknown.
+        :param request_time: Seconds taken by each request besides the transfer of the data.
+        """
+        self.bandwidth = bandwidth
+        self.request_time = request_time
+        self.files = []
+        self.listings = []
+
+    def add(self, entry: dict) -> None:
+        """
+        Adds a file to the plan
+        :param entry: dict with the "job", "files", "cloud_path", "action", "reason", "size", "estimated" and "parts"
+        of the file.
+        :return:
+        """
+        self.files.append(entry)
+
+    def totals(self) -> dict:
+        """
+        Sums the files of the plan
+        :return: dict with the amount of files and bytes of each action, the parts and the requests of the upload.
+        """
+        totals = {action: {"files": 0, "bytes": 0} for action in ("upload", "skip", "fail")}
+        parts = split = 0
+        for entry in self.files:
+            totals[entry["action"]]["files"] += 1
+            totals[entry["action"]]["bytes"] += entry["size"]
+            if entry["action"] == "upload":
+                parts += entry["parts"]
+                split += entry["parts"] > 1
+        totals["upload"].update({"parts": parts, "split": split,
+                                 "requests": parts + 2 * totals["upload"]["files"]})
+        return totals
+
+    def estimated_seconds(self) -> Optional[float]:
+        """
+        Estimates the duration of the upload: the transfer of the data at the bandwidth, and the time of the requests
+        made one after the other
+        :return: Seconds, or None if the bandwidth is unknown.
+        """
+        if not self.bandwidth:
+            return None
+        upload = self.totals()["upload"]
+        return upload["bytes"] / self.bandwidth + upload["requests"] * self.request_time
+
+    def to_dict(self) -> dict:
+        """
+        Returns the plan as a JSON-serializable dict
+        :return: dict with the files, the totals and the estimate.
+        """
+        seconds = self.estimated_seconds()
+        return {"version": PLAN_VERSION, "created": int(time.time()), "bandwidth": self.bandwidth,
+                "requesttime": self.request_time, "listings": self.listings, "totals": self.totals(),
+                "estimatedseconds": None if seconds is None else round(seconds, 1), "files": self.files}
+
+
+class Planner:
+    """
+    Plans the upload of the source directory of the settings.
+    """
+
+    def __init__(self, client: TeraboxClient, settings: Settings, log: Optional[Formatting] = None,
+                 job: Optional[str] = None):
+        """
+        :param client: Client of the account. Only its cache is read, no request is made.
+        :param settings: Program settings, or the settings of an upload job.
+        :param log: Formatting object used for logging.
+        :param job: Name of the upload job, if the settings are the settings of a job.
+        """
+        self.client = client
+        self.settings = settings
+        self.log = log or client.log
+        self.job = job
+
+    def max_file_size(self) -> tuple:
+        """
+        Returns the size from which files are too big for the account, from the account type kept in the cache
+        :return: (size in bytes, True if the account type is known) tuple. The limit of a free account is used if the
+        account type isn't in the cache.
+        """
+        cache = self.client.cache
+        vip = cache.get(Cache.account_key("vip", self.client.cookies)) if cache is not None else None
+        if vip is None:
+            return FREE_MAX_SIZE, False
+        return (VIP_MAX_SIZE if vip else FREE_MAX_SIZE), True
+
+    def _remote_files(self, plan: Plan) -> list:
+        remote_dir = self.settings.remote_dir
+        cached = self.client.cached_listing(remote_dir)
+        if cached is None:
+            self.log.warning("plan", f"The remote directory {remote_dir} was never listed, so no file is skipped. "
+                                     f"Run an upload to list it.")
+            plan.listings.append({"job": self.job, "remote": remote_dir, "cached": False, "age": None})
+            return []
+        files, listed = cached
+        age = max(0, int(time.time() - listed))
+        self.log.info("plan", f"Using the listing of {remote_dir} from {age // 3600}h{age % 3600 // 60:02d}m ago "
+                              f"({len(files)} files).")
+        plan.listings.append({"job": self.job, "remote": remote_dir, "cached": True, "age": age})
+        return files
+
+    def _upload_size(self, file: dict, compression) -> tuple:
+        """
+        Returns the size of a file once it is encrypted
+        :return: (size in bytes, True if the size is an estimate) tuple. Files that are compressed before the
+        encryption are estimated with their uncompressed size, which is the most they can take.
+        """
+        from modules.encryption import Encryption
+
+        size = Encryption.encrypted_size(self.settings.encryption_key, file['path'], file['sizebytes'],
+                                         compression)
+        if size is None:
+            return Encryption.encrypted_size(self.settings.encryption_key, file['path'], file['sizebytes']), True
+        return size, False
+
+    def plan(self, paths: Optional[list] = None, plan: Optional[Plan] = None) -> Plan:
+        """
+        Plans the upload of files and directories
+        :param paths: list of local files and directories. Defaults to the source directory of the settings.
+        :param plan: Plan the files are added to. A new one is used if None.
+        :return: The plan.
+        """
+        plan = plan or Plan()
+        compression = None
+        if self.settings.encryption_enabled:
+            from modules.compression import Compression
+
+            compression = Compression.from_settings(self.settings.compression)
+            compression = compression if compression.enabled else None
+        uploader = Uploader(self.client, self.settings, log=self.log)
+        # Exact cloud paths, like the upload engines compare them
+        remote_paths = {remote_key(entry["path"]) for entry in self._remote_files(plan)}
+        max_size, known = self.max_file_size()
+        if not known:
+            self.log.warning("plan", "The account type is unknown, so the file size limit of a free account is used.")
+
+        scanned = uploader.scan(paths or [self.settings.source_dir])
+        entries = []
+        if uploader.packer.enabled:
+            packer = uploader.packer
+            packed = set()
+            for members in packer.groups(scanned):
+                bundle = packer.bundle_name(members, packer.archive)
+                relative = f"{packer.directory}/{bundle}" if packer.directory else bundle
+                size, index_size = packer.estimate(members)
+                for name, length in ((relative, size), (relative + INDEX_SUFFIX, index_size)):
+                    entries.append({"name": name.split("/")[-1], "path": members[0]['path'], "relative_path": name,
+                                    "sizebytes": length, "encrypted": False, "packed": True, "members": members})
+                packed.update(id(file) for file in members)
+            scanned = {directory: [file for file in files if id(file) not in packed]
+                       for directory, files in scanned.items()}
+        entries.extend(file for files in scanned.values() for file in files)
+
+        for file in uploader.scheduler.order(entries):
+            size, estimated = file['sizebytes'], bool(file.get("packed"))
+            action, reason = "upload", None
+            if self.settings.encryption_enabled:
+                try:
+                    if not file.get("packed"):
+                        size, estimated = self._upload_size(file, compression)
+                    file['encrypted'] = True
+                except (OSError, ValueError) as e:
+                    action, reason = "fail", f"the encrypted size could not be calculated: {e}"
+            cloud_relative = uploader.cloud_relative(file)
+            if action == "upload" and remote_key(f"{self.settings.remote_dir}/{cloud_relative}") in remote_paths:
+                action, reason = "skip", "already on the cloud"
+            elif action == "upload" and size >= max_size:
+                action, reason = "fail", "too big for the account"
+            plan.add({"job": self.job, "files": uploader.source_paths(file),
+                      "cloud_path": f"{self.settings.remote_dir}/{cloud_relative}", "action": action,
+                      "reason": reason, "size": size, "estimated": estimated, "parts": part_count(size),
+                      "packed": bool(file.get("packed")), "encrypted": file['encrypted']})
+        return plan
@@ -0,0 +1,287 @@
+"""
+TeraBox Uploader CLI: postupload.py
+This module is used to move or delete the source files once they are uploaded.
+Every action is written to a journal before it runs and marked as done after it, so an action interrupted by a crash
+or a power cut is finished by the next run instead of being forgotten. Every run writes its own journal, and only the
+journals of the runs that are no longer running are replayed, so two runs started from the same directory never run
+each other's actions. The actions are run in batches, with one flush of the journal to the disk per batch instead of
+one per file. Moved files keep their directory structure under
+the uploaded directory, and files moved to another filesystem are copied, flushed to the disk and then unlinked.
+Used in: uploader.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import errno
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Optional
+
+from modules.config import SettingsException
+from modules.formatting import Formatting
+from modules.tempspace import running
+
+JOURNAL_FILE = "postupload.journal"
+BATCH_SIZE = 64
+# The uploaders of a run (the upload jobs) replay the journals of the same path once
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+_REPLAYED = set()
+
+
+def _path_lock(path: str) -> threading.Lock:
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def _fsync_directory(path: str) -> None:
+    # Makes the creation, rename or removal of the entries of a directory durable. Not supported on Windows.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def move_file(source: str, target: str) -> None:
+    """
+    Moves a file, creating the directories of the target. Across filesystems, the file is copied to a temporary name
+    next to the target, flushed to the disk and renamed to the target before the source is unlinked, so the target is
+    either missing or complete.
+    :param source: Path of the file.
+    :param target: New path of the file. An existing file is replaced.
+    :return:
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        partial = f"{target}.part"
+        with open(source, "rb") as src, open(partial, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copystat(source, partial)
+        os.replace(partial, target)
+        _fsync_directory(os.path.dirname(target))
+        os.remove(source)
+    _fsync_directory(os.path.dirname(source))
+
+
+class PostUploadJournal:
+    """
+    Write-ahead journal of the moves and deletes of the uploaded source files.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE, batch_size: int = BATCH_SIZE, log: Optional[Formatting] = None):
+        """
+        :param path: Path of the journal. The journal of the run is written next to it, with the process ID and a
+        random suffix added to its name.
+        :param batch_size: Amount of actions run together.
+        :param log: Formatting object used for logging.
+        """
+        self.base = os.path.abspath(path)
+        self.path = self._run_path()
+        self.batch_size = max(1, batch_size)
+        self.log = log or Formatting(timestamps=True)
+        self.failed = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, section: dict, log: Optional[Formatting] = None) -> "PostUploadJournal":
+        """
+        Builds the journal from the "files" section of settings.json
+        :param section: dict with the optional "journal" and "journalbatch" keys.
+        :param log: Formatting object used for logging.
+        :return: PostUploadJournal object
+        """
+        try:
+            batch_size = int(section.get("journalbatch", BATCH_SIZE))
+        except ValueError as e:
+            raise SettingsException(f"Invalid journal batch size in settings.json: {e}") from e
+        return cls(section.get("journal", JOURNAL_FILE) or JOURNAL_FILE, batch_size, log)
+
+    def _run_path(self) -> str:
+        return f"{self.base}.{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _append(self, records: list, sync: bool, path: Optional[str] = None) -> None:
+        with open(path or self.path, "a", encoding="utf8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def _read(self, path: Optional[str] = None) -> tuple:
+        path = path or self.path
+        intents, done = [], set()
+        if not os.path.exists(path):
+            return intents, done
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a journal cut by a crash
+                    continue
+                if "done" in record:
+                    done.add(record["done"])
+                else:
+                    intents.append(record)
+        return intents, done
+
+    def add(self, action: str, source: str, target: Optional[str] = None, name: Optional[str] = None) -> None:
+        """
+        Records a move or a delete. It runs with the next batch.
+        :param action: "move" or "delete".
+        :param source: Path of the source file.
+        :param target: Path the file is moved to.
+        :param name: Name of the file in the logs.
+        :return:
+        """
+        stat = os.stat(source)
+        record = {"id": uuid.uuid4().hex, "action": action, "source": source, "target": target,
+                  "size": stat.st_size, "mtime": stat.st_mtime_ns, "name": name or os.path.basename(source)}
+        with self._lock:
+            # Written right away, so the action isn't lost if the process dies before the batch runs
+            self._append([record], sync=False)
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    @staticmethod
+    def _unchanged(record: dict) -> bool:
+        # A file created at the same path after the upload must not be moved or deleted
+        try:
+            stat = os.stat(record["source"])
+        except OSError:
+            return False
+        return stat.st_size == record["size"] and stat.st_mtime_ns == record["mtime"]
+
+    def _run(self, record: dict) -> bool:
+        name = record.get("name", os.path.basename(record["source"]))
+        if not self._unchanged(record):
+            # Already done, by this run or by a run that crashed before marking it as done
+            return True
+        try:
+            if record["action"] == "move":
+                move_file(record["source"], record["target"])
+                self.log.success("move", f"File {name} moved successfully to {record['target']}.")
+            else:
+                os.remove(record["source"])
+                _fsync_directory(os.path.dirname(record["source"]))
+                self.log.success("delete", f"File {name} deleted successfully.")
+        except OSError as e:
+            if e.errno == errno.ENOENT and not os.path.exists(record["source"]):
+                # Removed by someone else since it was checked, so there is nothing left to move or delete
+                self.log.warning(record["action"], f"File {name} was already removed.")
+                return True
+            self.log.error(record["action"], f"File {name} could not be "
+                                             f"{'moved' if record['action'] == 'move' else 'deleted'}.")
+            self.log.error(record["action"], f"More information about this error: {e}")
+            return False
+        return True
+
+    def _commit(self, records: list, path: Optional[str] = None) -> list:
+        """
+        Runs a batch of recorded actions and marks them as done. The actions that failed stay in the journal and are
+        tried again by the next run.
+        :param path: Path of the journal of the actions. Defaults to the journal of the run.
+        :return: list of the source files whose action failed.
+        """
+        path = path or self.path
+        # The intents must be on the disk before any file is touched
+        self._append([], sync=True, path=path)
+        failed = [record for record in records if not self._run(record)]
+        self._append([{"done": record["id"]} for record in records if record not in failed], sync=True, path=path)
+        intents, done = self._read(path)
+        if all(intent["id"] in done for intent in intents):
+            # Nothing is left to replay
+            os.remove(path)
+        return [record["source"] for record in failed]
+
+    def flush(self) -> None:
+        """
+        Runs the recorded actions that are waiting for their batch
+        :return:
+        """
+        with self._lock:
+            records, self._pending = self._pending, []
+            if records:
+                self.failed.extend(self._commit(records))
+
+    def stale(self) -> list:
+        """
+        Returns the journals of the runs that are no longer running, and the journal shared by every run of the
+        previous versions
+        :return: list of paths.
+        """
+        directory, prefix = os.path.split(self.base)
+        journals = []
+        if not os.path.isdir(directory):
+            return journals
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name == prefix:
+                journals.append(path)
+                continue
+            pid = name[len(prefix) + 1:].split("-")[0] if name.startswith(f"{prefix}.") else ""
+            if pid.isdigit() and not running(int(pid), path):
+                journals.append(path)
+        return journals
+
+    def _claim(self, path: str) -> Optional[str]:
+        # The journal is renamed to a name of this run before it is read, so two runs never replay the same journal
+        claimed = self._run_path()
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            # Claimed by another run
+            return None
+        return claimed
+
+    def replay(self) -> int:
+        """
+        Finishes the actions recorded by the previous runs that stopped or failed before running them. The journals
+        are only replayed once per process.
+        :return: Amount of actions that were replayed.
+        """
+        replayed = 0
+        with _path_lock(self.base):
+            with _LOCKS_LOCK:
+                if self.base in _REPLAYED:
+                    return 0
+                _REPLAYED.add(self.base)
+            for journal in self.stale():
+                path = self._claim(journal)
+                if path is None:
+                    continue
+                intents, done = self._read(path)
+                pending = [intent for intent in intents if intent["id"] not in done]
+                if pending:
+                    self.log.warning("journal", f"Finishing {len(pending)} moves and deletes of a previous run...")
+                failed = self._commit(pending, path)
+                for source in failed:
+                    # The journal is left under the name of this run, and replayed by the next run
+                    self.log.error("journal", f"The action of {source} stays in the journal {path} for the next "
+                                              f"run.")
+                replayed += len(pending)
+        return replayed
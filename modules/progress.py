@@ -0,0 +1,394 @@
+"""
+TeraBox Uploader CLI: progress.py
+This module is used to track the progress of the uploads (bytes sent per file and part, throughput, files in each
+stage and ETA) and to show it as a live dashboard under the console messages.
+When the output is not a terminal, a single progress line is logged from time to time instead.
+Used in: uploader.py, asyncengine.py, client.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from modules.formatting import Formatting, convert_size
+from modules.logbackend import ConsoleSink, get_backend
+
+STAGES = ("hash", "precreate", "upload", "create", "post")
+RATE_WINDOW = 10.0
+CURL_UNITS = {"k": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
+
+def parse_curl_size(value: str) -> Optional[int]:
+    """
+    Parses a size of the curl progress meter
+    :param value: Size like "512", "1024k" or "12.3M".
+    :return: Size in bytes, or None if the value is not a size.
+    """
+    multiplier = CURL_UNITS.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in CURL_UNITS else value
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        return None
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """
+    Formats a duration for the progress output
+    :param seconds: Duration in seconds, or None if unknown.
+    :return: Duration like "1h02m", "5m12s" or "--".
+    """
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """
+    Thread-safe tracker of the upload progress. Files are identified by a key (their local path) and their parts
+    by the key and the part number.
+    Listeners (like the metrics) are told about every finished stage, transfer and file through their on_stage,
+    on_transfer and on_finish methods.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.listeners = []
+        self.files_total = 0
+        self.bytes_total = 0
+        self.outcomes = {"uploaded": 0, "skipped": 0, "failed": 0}
+        self.started = time.monotonic()
+        self._stages = {}
+        self._stage_started = {}
+        self._transfers = {}
+        self._file_sent = {}
+        self._done_bytes = 0
+        self._sent = 0
+        self._samples = deque()
+
+    def add_listener(self, listener) -> None:
+        """
+        Adds a listener of the progress events
+        :param listener: Object with the on_stage, on_transfer and on_finish methods.
+        :return:
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def _end_stage(self, key: str, now: float) -> None:
+        stage = self._stages.get(key)
+        if stage is not None:
+            started = self._stage_started.pop(key)
+            for listener in self.listeners:
+                listener.on_stage(key, stage, started, now)
+
+    def start(self, files: int, total_bytes: int) -> None:
+        """
+        Starts tracking a run
+        :param files: Amount of files of the run.
+        :param total_bytes: Total size of the files of the run.
+        :return:
+        """
+        with self._lock:
+            self.files_total += files
+            self.bytes_total += total_bytes
+
+    def stage(self, key: str, name: str) -> None:
+        """
+        Records the stage a file is in
+        :param key: Key of the file.
+        :param name: Stage name, one of STAGES.
+        :return:
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._end_stage(key, now)
+            self._stages[key] = name
+            self._stage_started[key] = now
+
+    def finish(self, key: str, status: str, size: int) -> None:
+        """
+        Records the outcome of a file
+        :param key: Key of the file.
+        :param status: "uploaded", "skipped", "failed" or "mismatch" (failed because of an MD5 mismatch).
+        :param size: Size of the file.
+        :return:
+        """
+        with self._lock:
+            self._end_stage(key, time.monotonic())
+            self._stages.pop(key, None)
+            self.outcomes[status] = self.outcomes.get(status, 0) + 1
+            self._done_bytes += max(0, size - self._file_sent.pop(key, 0))
+            for transfer in [transfer for transfer in self._transfers if transfer[0] == key]:
+                del self._transfers[transfer]
+            for listener in self.listeners:
+                listener.on_finish(key, status, size)
+
+    def start_transfer(self, key: str, part: int, label: str, total: int) -> None:
+        """
+        Records the start of the upload of a file or part
+        :param key: Key of the file.
+        :param part: Part number.
+        :param label: Name shown in the dashboard.
+        :param total: Size of the part.
+        :return:
+        """
+        with self._lock:
+            self._transfers[(key, part)] = [label, 0, total, time.monotonic()]
+
+    def update_transfer(self, key: str, part: int, sent: int) -> None:
+        """
+        Records the bytes sent for a file or part
+        :param key: Key of the file.
+        :param part: Part number.
+        :param sent: Bytes sent for this part so far. A smaller value than before means the part was restarted.
+        :return:
+        """
+        with self._lock:
+            transfer = self._transfers.get((key, part))
+            if transfer is None:
+                return
+            sent = min(sent, transfer[2])
+            if sent > transfer[1]:
+                self._sent += sent - transfer[1]
+                self._samples.append((time.monotonic(), self._sent))
+            transfer[1] = sent
+
+    def end_transfer(self, key: str, part: int, ok: bool) -> None:
+        """
+        Records the end of the upload of a file or part
+        :param key: Key of the file.
+        :param part: Part number.
+        :param ok: True if the part was uploaded.
+        :return:
+        """
+        with self._lock:
+            transfer = self._transfers.pop((key, part), None)
+            if transfer is None:
+                return
+            for listener in self.listeners:
+                listener.on_transfer(key, part, transfer[2], transfer[3], time.monotonic(), ok)
+            if not ok:
+                return
+            if transfer[2] > transfer[1]:
+                self._sent += transfer[2] - transfer[1]
+                self._samples.append((time.monotonic(), self._sent))
+            self._file_sent[key] = self._file_sent.get(key, 0) + transfer[2]
+            self._done_bytes += transfer[2]
+
+    def callback(self, key: str, part: int):
+        """
+        Returns a function that records the bytes sent for a part, for the upload functions
+        :param key: Key of the file.
+        :param part: Part number.
+        :return: Function called with the bytes sent so far.
+        """
+        return lambda sent: self.update_transfer(key, part, sent)
+
+    def rate(self) -> float:
+        """
+        Returns the throughput of the last seconds
+        :return: Bytes per second.
+        """
+        with self._lock:
+            return self._rate(time.monotonic())
+
+    def _rate(self, now: float) -> float:
+        while self._samples and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+        if not self._samples:
+            return 0.0
+        first_time, first_sent = self._samples[0]
+        elapsed = max(now - first_time, 1.0)
+        return (self._sent - first_sent) / elapsed if len(self._samples) > 1 else 0.0
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current progress
+        :return: dict with the files, bytes, rate, ETA, files per stage and active transfers.
+        """
+        with self._lock:
+            now = time.monotonic()
+            rate = self._rate(now)
+            in_flight = sum(transfer[1] for transfer in self._transfers.values())
+            done_bytes = min(self._done_bytes + in_flight, self.bytes_total)
+            remaining = self.bytes_total - done_bytes
+            stages = {stage: 0 for stage in STAGES}
+            for stage in self._stages.values():
+                stages[stage] = stages.get(stage, 0) + 1
+            finished = sum(self.outcomes.values())
+            return {
+                "files_total": self.files_total,
+                "files_done": finished,
+                "outcomes": dict(self.outcomes),
+                "queued": max(0, self.files_total - finished - len(self._stages)),
+                "stages": stages,
+                "bytes_total": self.bytes_total,
+                "bytes_done": done_bytes,
+                "bytes_sent": self._sent,
+                "rate": rate,
+                "eta": remaining / rate if rate > 0 else (0.0 if remaining == 0 else None),
+                "elapsed": now - self.started,
+                "transfers": [{"label": label, "sent": sent, "total": total}
+                              for label, sent, total, _ in sorted(self._transfers.values(), key=lambda t: t[3])],
+            }
+
+
+class Dashboard:
+    """
+    Shows the progress under the console messages, redrawn a few times per second. When the output is not a
+    terminal, a progress line is logged every quiet_interval seconds instead.
+    """
+
+    def __init__(self, progress: Progress, log: Optional[Formatting] = None, mode: str = "auto",
+                 stream=None, interval: float = 0.5, quiet_interval: float = 30.0, max_rows: int = 5):
+        """
+        :param progress: The tracked progress.
+        :param log: Formatting object used for logging and colors.
+        :param mode: "auto" (live dashboard only on terminals), "true" (always live) or "false" (no output).
+        :param stream: Stream of the dashboard. Defaults to sys.stdout.
+        :param interval: Time between redraws of the live dashboard in seconds.
+        :param quiet_interval: Time between progress lines when the output is not a terminal, in seconds.
+        :param max_rows: Maximum amount of transfers shown in the live dashboard.
+        """
+        self.progress = progress
+        self.log = log or Formatting(timestamps=True)
+        self.stream = stream or sys.stdout
+        mode = str(mode).lower()
+        self.enabled = mode != "false"
+        self.live = mode == "true" or (mode == "auto" and hasattr(self.stream, "isatty") and self.stream.isatty())
+        self.interval = interval if self.live else quiet_interval
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._drawn = 0
+        self._suspended = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._sinks = []
+
+    def start(self) -> None:
+        """
+        Starts showing the progress
+        :return:
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        if self.live:
+            backend = self.log.backend or get_backend()
+            backend.flush()
+            self._sinks = [sink for sink in backend.sinks if isinstance(sink, ConsoleSink)]
+            for sink in self._sinks:
+                sink.overlay = self
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops showing the progress and logs the final progress line
+        :return:
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.live:
+            (self.log.backend or get_backend()).flush()
+            for sink in self._sinks:
+                sink.overlay = None
+            self.clear()
+        self.log.info("progress", self.summary(self.progress.snapshot()))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self.live:
+                self.draw(periodic=True)
+            else:
+                self.log.info("progress", self.summary(self.progress.snapshot()))
+
+    @staticmethod
+    def summary(snapshot: dict) -> str:
+        """
+        Formats the progress in a single line
+        :param snapshot: Progress snapshot.
+        :return: The progress line.
+        """
+        outcomes = snapshot["outcomes"]
+        return (f"{snapshot['files_done']}/{snapshot['files_total']} files ({outcomes['uploaded']} uploaded, "
+                f"{outcomes['skipped']} skipped, {outcomes['failed'] + outcomes.get('mismatch', 0)} failed) | "
+                f"{convert_size(snapshot['bytes_done'])} / {convert_size(snapshot['bytes_total'])} | "
+                f"{convert_size(int(snapshot['rate']))}/s | ETA {format_duration(snapshot['eta'])}")
+
+    def render(self, snapshot: dict) -> list:
+        """
+        Formats the live dashboard
+        :param snapshot: Progress snapshot.
+        :return: list of lines.
+        """
+        width = max(40, shutil.get_terminal_size().columns - 1)
+        style, fore = self.log.style, self.log.fore
+        stages = " | ".join(f"{stage} {count}" for stage, count in snapshot["stages"].items())
+        lines = [
+            f"{style.BRIGHT}{fore.BLUE}{'PROGRESS'.ljust(12)}: {style.RESET_ALL}{self.summary(snapshot)}",
+            f"{style.BRIGHT}{fore.BLUE}{'STAGES'.ljust(12)}: {style.RESET_ALL}queued {snapshot['queued']} | "
+            f"{stages}",
+        ]
+        transfers = snapshot["transfers"]
+        bar_width = 20
+        for transfer in transfers[:self.max_rows]:
+            fraction = transfer["sent"] / transfer["total"] if transfer["total"] else 1.0
+            filled = int(fraction * bar_width)
+            label = transfer["label"]
+            room = width - bar_width - 40
+            if len(label) > room > 3:
+                label = "..." + label[-(room - 3):]
+            lines.append(f"  [{'#' * filled}{'-' * (bar_width - filled)}] {fraction * 100:5.1f}% "
+                         f"{convert_size(transfer['sent'])}/{convert_size(transfer['total'])} {label}")
+        if len(transfers) > self.max_rows:
+            lines.append(f"  ... and {len(transfers) - self.max_rows} more transfers")
+        return lines
+
+    def clear(self) -> None:
+        """
+        Removes the dashboard from the console, before other output is written
+        :return:
+        """
+        with self._lock:
+            self._suspended = True
+            if self._drawn:
+                self.stream.write(f"\x1b[{self._drawn}F\x1b[J")
+                self._drawn = 0
+
+    def draw(self, periodic: bool = False) -> None:
+        """
+        Draws the dashboard under the console output
+        :param periodic: True for the redraws of the dashboard thread, which are skipped while other output is
+        being written.
+        :return:
+        """
+        lines = self.render(self.progress.snapshot())
+        with self._lock:
+            if periodic and self._suspended:
+                return
+            if self._drawn:
+                self.stream.write(f"\x1b[{self._drawn}F\x1b[J")
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+            self._drawn = len(lines)
+            self._suspended = False
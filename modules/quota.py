@@ -0,0 +1,53 @@
+"""
+TeraBox Uploader CLI: quota.py
+This module is used to keep track of the available quota of the account during a run.
+The quota is requested once and the uploaded files are subtracted from it, instead of asking the API before every
+file. One tracker is shared by every upload job of the process, so parallel jobs see each other's uploads.
+Used in: uploader.py, asyncengine.py, jobs.py, accounts.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import threading
+
+from modules.client import TeraboxClient
+
+
+class QuotaTracker:
+    """
+    Available quota of an account, shared by the uploads of a run.
+    """
+
+    def __init__(self, client: TeraboxClient):
+        """
+        :param client: Client of the account.
+        """
+        self.client = client
+        self._available = None
+        self._lock = threading.Lock()
+
+    def available(self) -> int:
+        """
+        Returns the available quota, requesting it on the first call
+        :return: Available quota in bytes. Raises TransferError if the quota request failed.
+        """
+        with self._lock:
+            if self._available is None:
+                self._available = self.client.quota()
+            return self._available
+
+    def consume(self, nbytes: int) -> None:
+        """
+        Subtracts an uploaded file from the available quota
+        :param nbytes: Size of the file in bytes.
+        :return:
+        """
+        with self._lock:
+            if self._available is not None:
+                self._available -= nbytes
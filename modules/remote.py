@@ -0,0 +1,224 @@
+"""
+TeraBox Uploader CLI: remote.py
+This module is used to manage the remote files in bulk: move, copy, rename, delete and create directories.
+The entries are packed into batched file manager requests, which are sent in parallel and retried according to the
+retry policy of the client, so reorganizing thousands of remote files takes a few requests instead of one per file.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import fnmatch
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from modules.client import TeraboxClient
+from modules.formatting import Formatting
+from modules.retry import CircuitOpenException, TransferError
+
+OPERATIONS = ("move", "copy", "rename", "delete", "mkdir")
+ONDUP_CHOICES = ("fail", "newcopy", "overwrite", "skip")
+BATCH_SIZE = 500
+# Errno of an entry that doesn't exist. A retried delete, move or rename finds the entries it already handled like this
+MISSING_ERRNO = -9
+ERRNO_MESSAGES = {-7: "invalid name", -8: "the destination already exists", -9: "the entry doesn't exist",
+                  111: "another file operation is running"}
+
+
+def remote_path(path: str) -> str:
+    """
+    Normalizes a cloud path
+    :param path: The cloud path.
+    :return: The path with forward slashes, a leading slash and no trailing slash.
+    """
+    return "/" + path.replace("\\", "/").strip("/")
+
+
+class BatchResult:
+    """
+    Outcome of a bulk operation.
+    """
+
+    def __init__(self):
+        self.done = []
+        self.failed = []
+
+    @property
+    def ok(self) -> bool:
+        """
+        True if every entry succeeded
+        """
+        return not self.failed
+
+
+class RemoteManager:
+    """
+    Runs move, copy, rename, delete and mkdir operations on many remote entries.
+    """
+
+    def __init__(self, client: TeraboxClient, log: Optional[Formatting] = None, workers: int = 4,
+                 batch_size: int = BATCH_SIZE, ondup: str = "fail"):
+        """
+        :param client: Client of the account the files are on.
+        :param log: Formatting object used for logging.
+        :param workers: Amount of parallel requests.
+        :param batch_size: Amount of entries per file manager request.
+        :param ondup: What to do when a destination exists: "fail", "newcopy", "overwrite" or "skip".
+        """
+        if ondup not in ONDUP_CHOICES:
+            raise ValueError(f"Invalid ondup value: {ondup}. Use one of {', '.join(ONDUP_CHOICES)}.")
+        self.client = client
+        self.log = log or client.log
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.ondup = ondup
+
+    def _run_batch(self, operation: str, batch: list) -> list:
+        """
+        Sends one batch of entries
+        :return: list of (path, errno or error message) tuples, errno 0 for the entries that succeeded.
+        """
+        paths = [entry if isinstance(entry, str) else entry["path"] for entry in batch]
+        try:
+            info = self.client.file_manager(operation, batch, ondup=self.ondup)
+        except (TransferError, CircuitOpenException) as e:
+            return [(path, str(e)) for path in paths]
+        errnos = {remote_path(entry.get("path", "")): entry.get("errno", 0) for entry in info}
+        if operation in ("move", "rename"):
+            self._find_moved(batch, errnos)
+        results = []
+        for path in paths:
+            errno = errnos.get(path, 0)
+            if operation == "delete" and errno == MISSING_ERRNO:
+                errno = 0
+            results.append((path, errno))
+        return results
+
+    def _find_moved(self, batch: list, errnos: dict) -> None:
+        """
+        Marks as done the moved or renamed entries that are missing because an attempt whose answer was lost already
+        handled them, which is the case when their destination exists
+        :param batch: Entries of the batch.
+        :param errnos: Errno of each path of the batch, updated in place.
+        """
+        destinations = {}
+        for entry in batch:
+            if errnos.get(entry["path"]) == MISSING_ERRNO:
+                directory = remote_path(entry.get("dest", posixpath.dirname(entry["path"])))
+                name = entry.get("newname") or posixpath.basename(entry["path"])
+                destinations[remote_path(posixpath.join(directory, name))] = entry["path"]
+        if not destinations:
+            return
+        try:
+            found = self.client.file_metas(list(destinations))
+        except (TransferError, CircuitOpenException) as e:
+            self.log.warning("remote", f"Could not check the destination of {len(destinations)} missing entries: {e}")
+            return
+        for meta in found:
+            path = destinations.get(remote_path(meta.get("path", "")))
+            if path is not None:
+                errnos[path] = 0
+
+    def run(self, operation: str, entries: list) -> BatchResult:
+        """
+        Runs an operation on many entries with batched, parallel requests
+        :param operation: "move", "copy", "rename", "delete" or "mkdir".
+        :param entries: Paths for delete and mkdir, or dicts with the "path" and the "dest" and/or "newname".
+        :return: BatchResult with the path of every entry.
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"Invalid operation: {operation}. Use one of {', '.join(OPERATIONS)}.")
+        result = BatchResult()
+        if not entries:
+            return result
+        with ThreadPoolExecutor(self.workers) as pool:
+            if operation == "mkdir":
+                self.log.info("remote", f"Creating {len(entries)} directories...")
+                # There is no batched mkdir, so the directories are created with parallel requests
+                futures = [(path, pool.submit(self.client.create_directory, path)) for path in entries]
+                outcomes = []
+                for path, future in futures:
+                    try:
+                        future.result()
+                        outcomes.append((path, 0))
+                    except (TransferError, CircuitOpenException) as e:
+                        outcomes.append((path, str(e)))
+            else:
+                batches = [entries[index:index + self.batch_size]
+                           for index in range(0, len(entries), self.batch_size)]
+                self.log.info("remote", f"Running {operation} on {len(entries)} entries in {len(batches)} "
+                                        f"requests...")
+                outcomes = [outcome for outcomes in pool.map(lambda batch: self._run_batch(operation, batch),
+                                                             batches) for outcome in outcomes]
+        for path, error in outcomes:
+            if error == 0:
+                result.done.append(path)
+            else:
+                if isinstance(error, int):
+                    error = f"errno {error}: {ERRNO_MESSAGES.get(error, 'unknown error')}"
+                self.log.error("remote", f"Could not {operation} {path}: {error}")
+                result.failed.append((path, error))
+        return result
+
+    def move(self, paths: list, destination: str) -> BatchResult:
+        """
+        Moves remote files or directories into a directory
+        :param paths: Cloud paths of the entries.
+        :param destination: Cloud directory the entries are moved to.
+        :return: BatchResult
+        """
+        return self.run("move", [{"path": remote_path(path), "dest": remote_path(destination),
+                                  "newname": posixpath.basename(remote_path(path))} for path in paths])
+
+    def copy(self, paths: list, destination: str) -> BatchResult:
+        """
+        Copies remote files or directories into a directory
+        :param paths: Cloud paths of the entries.
+        :param destination: Cloud directory the copies are created in.
+        :return: BatchResult
+        """
+        return self.run("copy", [{"path": remote_path(path), "dest": remote_path(destination),
+                                  "newname": posixpath.basename(remote_path(path))} for path in paths])
+
+    def rename(self, renames: list) -> BatchResult:
+        """
+        Renames remote files or directories, keeping them in their directory
+        :param renames: list of (cloud path, new name) tuples.
+        :return: BatchResult
+        """
+        return self.run("rename", [{"path": remote_path(path), "newname": name} for path, name in renames])
+
+    def delete(self, paths: list) -> BatchResult:
+        """
+        Deletes remote files or directories. Entries that don't exist are not an error.
+        :param paths: Cloud paths of the entries.
+        :return: BatchResult
+        """
+        return self.run("delete", [remote_path(path) for path in paths])
+
+    def mkdir(self, paths: list) -> BatchResult:
+        """
+        Creates remote directories and their missing parents
+        :param paths: Cloud paths of the directories.
+        :return: BatchResult
+        """
+        return self.run("mkdir", [remote_path(path) for path in paths])
+
+    def match(self, directories: list, pattern: str) -> list:
+        """
+        Lists the files of remote directories and their subdirectories whose name matches a pattern
+        :param directories: Cloud directories to search.
+        :param pattern: Shell-style pattern of the file names, like "*.part*".
+        :return: list of the cloud paths of the matching files.
+        """
+        with ThreadPoolExecutor(self.workers) as pool:
+            listings = pool.map(self.client.list_directory, directories)
+            return [remote_path(entry["path"]) for entries in listings for entry in entries
+                    if fnmatch.fnmatch(entry["name"], pattern)]
@@ -0,0 +1,591 @@
+"""
+TeraBox Uploader CLI: restore.py
+This module is used to download a remote directory back to the local disk, rebuilding its tree.
+Files are downloaded with parallel HTTP range requests over a pool of reused connections. Files encrypted with an AES
+key are decrypted while they are downloaded: every range also fetches the 16 bytes before it, which are the IV of its
+first block, so the ranges are decrypted independently. Files encrypted with a Fernet key are decrypted once they
+are complete, like decrypt.py does. Files that were compressed before they were encrypted are decompressed last.
+Files recorded in an integrity manifest, kept locally or uploaded to the .integrity directory of the remote directory,
+are checked block by block before they are decrypted, and only the blocks that don't match are downloaded again. AES
+files with a record are decrypted once they are checked instead of while they are downloaded.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from modules.client import TeraboxClient
+from modules.config import Settings
+from modules.formatting import Formatting, convert_size
+from modules.integrity import REMOTE_DIR, IntegrityManifest, corrupted, data_blocks, file_blocks
+from modules.retry import TransferError
+
+# Multiple of the AES block size, so the AES ranges start on a block
+RANGE_SIZE = 8 * 1024 * 1024
+READ_BLOCK = 1024 * 1024
+BATCH_SIZE = 100
+ENCRYPTED_HEADER = b"ENC-TERABOXUPLOADERCLI"
+# Enough bytes for the longest header line and the IV of an AES file
+PROBE_SIZE = 64
+# Downloads of the blocks that don't match the integrity manifest before a file fails
+REPAIR_ATTEMPTS = 2
+
+
+def local_path(target_dir: str, relative: str) -> Optional[str]:
+    """
+    Builds the local path of a remote file, refusing paths that would leave the target directory
+    :param target_dir: The local directory the files are restored to.
+    :param relative: Path of the file relative to the remote directory.
+    :return: The local path, or None if the relative path is unsafe.
+    """
+    parts = [part for part in relative.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return os.path.join(target_dir, *parts)
+
+
+class RestoreResult:
+    """
+    Outcome of a restore run.
+    """
+
+    def __init__(self):
+        self.restored = []
+        self.skipped = []
+        self.failed = []
+
+    @property
+    def ok(self) -> bool:
+        """
+        True if no file failed
+        """
+        return not self.failed
+
+    def add(self, status: str, path: str) -> None:
+        """
+        Records the outcome of a file
+        :param status: "restored", "skipped" or "failed".
+        :param path: Cloud path of the file.
+        :return:
+        """
+        getattr(self, status).append(path)
+
+
+class Restorer:
+    """
+    Downloads and decrypts the files of a remote directory.
+    """
+
+    def __init__(self, client: TeraboxClient, settings: Settings, log: Optional[Formatting] = None,
+                 workers: int = 8, range_size: int = RANGE_SIZE, overwrite: bool = False):
+        """
+        :param client: Client of the account the files are downloaded from.
+        :param settings: Program settings. The encryption key of the settings decrypts the .enc files.
+        :param log: Formatting object used for logging.
+        :param workers: Amount of parallel range requests, and of reused connections.
+        :param range_size: Size of each range request in bytes. Rounded down to a multiple of 16.
+        :param overwrite: If True, existing local files are replaced. Otherwise they are skipped.
+        """
+        self.client = client
+        self.settings = settings
+        self.log = log or client.log
+        self.workers = max(1, workers)
+        self.range_size = max(64 * 1024, range_size // 16 * 16)
+        self.overwrite = overwrite
+        key = settings.encryption_key
+        self.keypath = key if key and os.path.exists(key) else ""
+        self.integrity = IntegrityManifest.from_settings(settings.integrity, self.log)
+        self.manifests = []
+        self.downloaded_bytes = 0
+        self.repaired_blocks = 0
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self):
+        """
+        HTTP session of the downloads, keeping one connection per worker open
+        """
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = self.client.user_agent
+            session.cookies.update(self.client.cookies)
+            self._session = session
+        return self._session
+
+    def _fetch(self, url: str, start: int, end: int, open_sink: Callable) -> str:
+        """
+        Downloads a range of a file, retrying it according to the retry policy of the client
+        :param url: Download URL of the file.
+        :param start: First byte of the range.
+        :param end: Last byte of the range (inclusive).
+        :param open_sink: Function returning a context manager that yields the function consuming the data. It is
+        called again for every attempt.
+        :return: The URL the download was redirected to, to skip the redirect for the next ranges.
+        """
+        import requests
+
+        def attempt() -> str:
+            try:
+                with self.session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                                      timeout=30) as response:
+                    if response.status_code not in (200, 206):
+                        raise TransferError("http", response.status_code,
+                                            f"Download failed with HTTP status {response.status_code}")
+                    if response.headers.get("Content-Type", "").startswith("application/json"):
+                        # Terabox answers the errors of a download link with JSON
+                        error = response.json()
+                        code = error.get("errno", error.get("error_code"))
+                        raise TransferError("errno", code, error.get("errmsg", error.get("error_msg", "")))
+                    # A server without range support sends the whole file
+                    skip = start if response.status_code == 200 else 0
+                    remaining = end - start + 1
+                    with open_sink() as consume:
+                        for data in response.iter_content(READ_BLOCK):
+                            if skip:
+                                data, skip = data[skip:], max(0, skip - len(data))
+                            data = data[:remaining]
+                            if data:
+                                remaining -= len(data)
+                                consume(data)
+                            if remaining <= 0:
+                                break
+                    if remaining > 0:
+                        raise TransferError("exception", None, f"Download ended {remaining} bytes early")
+                    with self._lock:
+                        self.downloaded_bytes += end - start + 1
+                    return response.url
+            except (requests.RequestException, ValueError) as e:
+                raise TransferError("exception", None, str(e)) from e
+
+        return self.client.retry.run("download", attempt)
+
+    @staticmethod
+    @contextmanager
+    def _file_sink(path: str, offset: int):
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            yield f.write
+
+    @contextmanager
+    def _aes_sink(self, path: str, offset: int):
+        # The first 16 bytes of the range are the IV of its first block
+        from modules.encryption import Encryption
+
+        state = {"iv": b"", "decryptor": None}
+        with open(path, "r+b") as f:
+            f.seek(offset)
+
+            def consume(data: bytes) -> None:
+                if state["decryptor"] is None:
+                    needed = 16 - len(state["iv"])
+                    state["iv"] += data[:needed]
+                    data = data[needed:]
+                    if len(state["iv"]) < 16:
+                        return
+                    state["decryptor"] = Encryption.aes_decryptor(self.keypath, state["iv"])
+                f.write(state["decryptor"].update(data))
+
+            yield consume
+            if state["decryptor"] is not None:
+                f.write(state["decryptor"].finalize())
+
+    @staticmethod
+    @contextmanager
+    def _memory_sink(buffer: io.BytesIO):
+        # Drops the data of a failed attempt
+        buffer.seek(0)
+        buffer.truncate()
+        yield buffer.write
+
+    @staticmethod
+    @contextmanager
+    def _slice_sink(data: bytearray, offset: int):
+        position = [offset]
+
+        def consume(chunk: bytes) -> None:
+            data[position[0]:position[0] + len(chunk)] = chunk
+            position[0] += len(chunk)
+
+        yield consume
+
+    def _repair(self, job: dict, blocks: Callable, open_sink: Callable) -> None:
+        """
+        Checks the blocks of a downloaded file against its integrity record, and downloads again the blocks that
+        don't match
+        :param job: The file, with its "integrity" record.
+        :param blocks: Function returning the SHA-256 hex digests of the blocks of the downloaded data.
+        :param open_sink: Function returning the sink of the data of a block, given the offset of the block.
+        :return: Raises ValueError if blocks still don't match after REPAIR_ATTEMPTS downloads.
+        """
+        entry = job["integrity"]
+        block_size = entry["blocksize"]
+        for attempt in range(REPAIR_ATTEMPTS + 1):
+            bad = corrupted(entry["blocks"], blocks())
+            if not bad:
+                if attempt:
+                    self.log.success("integrity", f"File {job['path']} now matches its integrity manifest.")
+                return
+            if attempt == REPAIR_ATTEMPTS:
+                break
+            self.log.warning("integrity", f"{len(bad)} blocks of {job['path']} don't match the integrity manifest. "
+                                          f"Downloading them again...")
+            for index in bad:
+                start = index * block_size
+                self._fetch(job.get("url", job["dlink"]), start, min(start + block_size, job["size"]) - 1,
+                            lambda start=start: open_sink(start))
+            with self._lock:
+                self.repaired_blocks += len(bad)
+        raise ValueError(f"{len(bad)} blocks still don't match the integrity manifest after {REPAIR_ATTEMPTS} "
+                         f"downloads")
+
+    def _container(self, job: dict, head: bytes) -> None:
+        """
+        Reads the header of a file into the "mode" ("aes", "fernet" or "plain"), the "compression" algorithm and the
+        "body" offset of the job. The body of an AES file starts after its IV.
+        """
+        from modules.encryption import DecryptFileException, parse_header
+
+        job["mode"], job["compression"], job["body"] = "plain", None, 0
+        if not self.keypath or not head.startswith(ENCRYPTED_HEADER):
+            return
+        line = head.split(b"\n", 1)[0] + b"\n"
+        try:
+            key_type, job["compression"] = parse_header(line)
+        except DecryptFileException as e:
+            raise ValueError(e.message) from e
+        job["mode"] = key_type.lower()
+        job["body"] = len(line) + (16 if key_type == "AES" else 0)
+
+    def _decrypt_memory(self, job: dict, data: bytes) -> bytes:
+        from modules.encryption import Encryption
+
+        body = job["body"]
+        if job["mode"] == "fernet":
+            plain = Encryption.fernet(self.keypath).decrypt(data[body:])
+        else:
+            decryptor = Encryption.aes_decryptor(self.keypath, data[body - 16:body])
+            plain = self._unpad(decryptor.update(data[body:]) + decryptor.finalize())
+        if job["compression"]:
+            decompress = self._decompressor(job["compression"])
+            plain = decompress.decompress(plain) + decompress.flush()
+        return plain
+
+    @staticmethod
+    def _decompressor(algorithm: str):
+        from modules.compression import CompressionUnavailableException, decompressor
+
+        try:
+            return decompressor(algorithm)
+        except CompressionUnavailableException as e:
+            raise ValueError(e.message) from e
+
+    def _decompress_file(self, path: str, algorithm: str) -> None:
+        decompress = self._decompressor(algorithm)
+        with open(path, "rb") as source, open(f"{path}.plain", "wb") as output:
+            while True:
+                data = source.read(READ_BLOCK)
+                if not data:
+                    break
+                output.write(decompress.decompress(data))
+            output.write(decompress.flush())
+        os.replace(f"{path}.plain", path)
+
+    @staticmethod
+    def _unpad(plain: bytes) -> bytes:
+        if not plain or not 1 <= plain[-1] <= 16:
+            raise ValueError("Invalid padding. The encryption key is probably wrong.")
+        return plain[:-plain[-1]]
+
+    @staticmethod
+    def _target(job: dict, mode: str) -> str:
+        # A .enc file that turns out not to be encrypted keeps its name
+        return job["local"] + ".enc" if mode == "plain" and job["decrypted_name"] else job["local"]
+
+    def _download_small(self, job: dict) -> None:
+        buffer = io.BytesIO()
+        self._fetch(job["dlink"], 0, job["size"] - 1, lambda: self._memory_sink(buffer))
+        data = buffer.getvalue()
+        if "integrity" in job:
+            data = bytearray(data)
+            self._repair(job, lambda: data_blocks(data, job["integrity"]["blocksize"]),
+                         lambda start: self._slice_sink(data, start))
+            data = bytes(data)
+        self._container(job, data)
+        if job["mode"] != "plain":
+            try:
+                data = self._decrypt_memory(job, data)
+            except zlib.error as e:
+                raise ValueError(f"Invalid compressed data: {e}") from e
+        self._write(job, data, job["mode"])
+
+    def _write(self, job: dict, data: bytes, mode: str) -> None:
+        job["target"] = target = self._target(job, mode)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(f"{target}.part", "wb") as f:
+            f.write(data)
+        os.replace(f"{target}.part", target)
+
+    def _probe(self, job: dict) -> None:
+        buffer = io.BytesIO()
+        job["url"] = self._fetch(job["dlink"], 0, min(PROBE_SIZE, job["size"]) - 1, lambda: self._memory_sink(buffer))
+        self._container(job, buffer.getvalue())
+
+    def _ranges(self, job: dict) -> list:
+        """
+        Prepares the part file of a large file and returns its ranges
+        :return: list of (start, end, open_sink) tuples.
+        """
+        mode, size = job["mode"], job["size"]
+        job["target"] = target = self._target(job, mode)
+        job["part"] = f"{target}.part"
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        if mode == "aes" and "integrity" not in job:
+            start = job["body"]
+            body = size - start
+            with open(job["part"], "wb") as f:
+                f.truncate(body)
+            # Every range also fetches the last block before it, its IV
+            return [(start + offset - 16, start + min(offset + self.range_size, body) - 1,
+                     lambda offset=offset: self._aes_sink(job["part"], offset))
+                    for offset in range(0, body, self.range_size)]
+        with open(job["part"], "wb") as f:
+            f.truncate(size)
+        return [(offset, min(offset + self.range_size, size) - 1,
+                 lambda offset=offset: self._file_sink(job["part"], offset))
+                for offset in range(0, size, self.range_size)]
+
+    def _decrypt_part(self, job: dict) -> None:
+        """
+        Decrypts the part file of an AES file that was downloaded as it is to be checked, leaving the padding
+        """
+        from modules.encryption import Encryption
+
+        part = job["part"]
+        with open(part, "rb") as source, open(f"{part}.plain", "wb") as output:
+            source.seek(job["body"] - 16)
+            decryptor = Encryption.aes_decryptor(self.keypath, source.read(16))
+            while True:
+                data = source.read(READ_BLOCK)
+                if not data:
+                    break
+                output.write(decryptor.update(data))
+            output.write(decryptor.finalize())
+        os.replace(f"{part}.plain", part)
+
+    def _finish_large(self, job: dict) -> None:
+        part, mode = job["part"], job["mode"]
+        if "integrity" in job:
+            self._repair(job, lambda: file_blocks(part, job["integrity"]["blocksize"], self.workers),
+                         lambda start: self._file_sink(part, start))
+            if mode == "aes":
+                self._decrypt_part(job)
+        if mode == "aes":
+            with open(part, "r+b") as f:
+                f.seek(-1, os.SEEK_END)
+                padding = f.read(1)[0]
+                if not 1 <= padding <= 16:
+                    raise ValueError("Invalid padding. The encryption key is probably wrong.")
+                f.truncate(os.path.getsize(part) - padding)
+        elif mode == "fernet":
+            with open(part, "rb") as f:
+                data = f.read()
+            with open(part, "wb") as f:
+                # The part file holds the whole file, header included
+                f.write(self._decrypt_memory(dict(job, compression=None), data))
+        if job["compression"]:
+            try:
+                self._decompress_file(part, job["compression"])
+            except zlib.error as e:
+                raise ValueError(f"Invalid compressed data: {e}") from e
+        os.replace(part, job["target"])
+
+    def plan(self, remote_dir: str, target_dir: str, result: RestoreResult) -> list:
+        """
+        Lists the remote directory and decides where each file is restored
+        :param remote_dir: The remote directory.
+        :param target_dir: The local directory the files are restored to.
+        :param result: RestoreResult the skipped and unsafe files are added to.
+        :return: list of the files to download. The uploaded integrity manifests are kept in the manifests attribute
+        instead.
+        """
+        root = "/" + remote_dir.strip("/")
+        jobs = []
+        self.manifests = []
+        for entry in self.client.list_directory(remote_dir):
+            path = "/" + entry["path"].strip("/")
+            relative = path[len(root):].lstrip("/") if path.startswith(root.rstrip("/") + "/") else entry["name"]
+            if relative.startswith(f"{REMOTE_DIR}/"):
+                self.manifests.append({"path": path, "size": int(entry["size"])})
+                continue
+            # Encrypted files are saved under their original name when the key is available
+            decrypted_name = bool(self.keypath) and relative.endswith(".enc")
+            local = local_path(target_dir, relative[:-4] if decrypted_name else relative)
+            if local is None:
+                self.log.error("restore", f"Refusing to restore {path} outside of the target directory.")
+                result.add("failed", path)
+            elif os.path.exists(local) and not self.overwrite:
+                self.log.warning("restore", f"File {local} already exists. Skipping file...")
+                result.add("skipped", path)
+            else:
+                jobs.append({"path": path, "size": int(entry["size"]), "local": local,
+                             "decrypted_name": decrypted_name})
+        return jobs
+
+    def download_links(self, pool: ThreadPoolExecutor, jobs: list) -> None:
+        """
+        Sets the "dlink" of every file with batched filemetas requests
+        :param pool: Pool the requests are made in.
+        :param jobs: list of dicts with the cloud "path" of each file. The "dlink" is None if the file has no link.
+        :return:
+        """
+        paths = [job["path"] for job in jobs]
+        batches = [paths[index:index + BATCH_SIZE] for index in range(0, len(paths), BATCH_SIZE)]
+        links = {}
+        for metas in pool.map(lambda batch: self.client.file_metas(batch, dlink=True), batches):
+            for meta in metas:
+                links["/" + meta.get("path", "").strip("/")] = meta.get("dlink")
+        for job in jobs:
+            job["dlink"] = links.get(job["path"])
+
+    def block_digest(self, url: str, start: int, end: int) -> str:
+        """
+        Downloads a block of a file and hashes it
+        :param url: Download URL of the file.
+        :param start: First byte of the block.
+        :param end: Last byte of the block (inclusive).
+        :return: SHA-256 hex digest of the block.
+        """
+        state = {}
+
+        @contextmanager
+        def sink():
+            state["sha"] = hashlib.sha256()
+            yield state["sha"].update
+
+        self._fetch(url, start, end, sink)
+        return state["sha"].hexdigest()
+
+    def integrity_records(self, pool: ThreadPoolExecutor) -> dict:
+        """
+        Reads the local integrity manifests and the uploaded ones of the manifests attribute
+        :param pool: Pool the download links of the uploaded manifests are requested in.
+        :return: dict of cloud path to the newest integrity record of the file.
+        """
+        self.download_links(pool, self.manifests)
+        uploaded = []
+        for manifest in self.manifests:
+            if not manifest.get("dlink") or not manifest["size"]:
+                continue
+            buffer = io.BytesIO()
+            try:
+                self._fetch(manifest["dlink"], 0, manifest["size"] - 1, lambda: self._memory_sink(buffer))
+            except TransferError as e:
+                self.log.warning("integrity", f"The integrity manifest {manifest['path']} could not be downloaded: {e}")
+                continue
+            uploaded.append((buffer.getvalue(), manifest["path"]))
+        return self.integrity.load(uploaded)
+
+    def _load_integrity(self, pool: ThreadPoolExecutor, jobs: list) -> None:
+        # Files with an integrity record are checked block by block before they are decrypted
+        records = self.integrity_records(pool)
+        checked = 0
+        for job in jobs:
+            record = records.get(job["path"])
+            if record is None:
+                continue
+            if record["size"] != job["size"]:
+                self.log.warning("integrity", f"File {job['path']} doesn't have the size of its integrity record. "
+                                              f"It is restored without being checked.")
+                continue
+            job["integrity"] = record
+            checked += 1
+        if checked:
+            self.log.info("integrity", f"Checking {checked} files against their integrity manifests.")
+
+    def restore(self, remote_dir: Optional[str] = None, target_dir: str = ".") -> RestoreResult:
+        """
+        Downloads the files of a remote directory and its subdirectories
+        :param remote_dir: The remote directory. Defaults to the remote directory of the settings.
+        :param target_dir: The local directory the tree is rebuilt in.
+        :return: RestoreResult with the outcome of every file.
+        """
+        result = RestoreResult()
+        remote_dir = remote_dir or self.settings.remote_dir
+        started = time.monotonic()
+        self.log.info("restore", f"Listing the remote directory {remote_dir}...")
+        jobs = self.plan(remote_dir, target_dir, result)
+        self.log.info("restore", f"Restoring {len(jobs)} files to {target_dir}...")
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            self.download_links(pool, jobs)
+            self._load_integrity(pool, jobs)
+            futures = {}
+            for job in jobs:
+                if not job["dlink"]:
+                    self.log.error("restore", f"No download link for {job['path']}.")
+                    result.add("failed", job["path"])
+                elif job["size"] == 0:
+                    self._write(job, b"", "plain")
+                    result.add("restored", job["path"])
+                elif job["size"] <= self.range_size:
+                    futures[pool.submit(self._download_small, job)] = (job, "done")
+                else:
+                    futures[pool.submit(self._probe, job)] = (job, "probe")
+
+            remaining = {}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, step = futures.pop(future)
+                    if job["path"] in result.failed:
+                        continue
+                    try:
+                        future.result()
+                        if step == "probe":
+                            ranges = self._ranges(job)
+                            remaining[job["path"]] = len(ranges)
+                            for start, end, open_sink in ranges:
+                                futures[pool.submit(self._fetch, job["url"], start, end, open_sink)] = (job, "range")
+                            continue
+                        if step == "range":
+                            remaining[job["path"]] -= 1
+                            if remaining[job["path"]]:
+                                continue
+                            self._finish_large(job)
+                    except (TransferError, OSError, ValueError) as e:
+                        self.log.error("restore", f"File {job['path']} could not be restored: {e}")
+                        result.add("failed", job["path"])
+                        if job.get("part") and os.path.exists(job["part"]):
+                            os.remove(job["part"])
+                        continue
+                    self.log.success("restore", f"File {job['path']} restored to {job.get('target', job['local'])}.")
+                    result.add("restored", job["path"])
+
+        elapsed = time.monotonic() - started
+        self.log.info("restore", f"Downloaded {convert_size(self.downloaded_bytes)} in {elapsed:.1f}s "
+                                 f"({convert_size(int(self.downloaded_bytes / elapsed) if elapsed else 0)}/s).")
+        if self.repaired_blocks:
+            self.log.info("integrity", f"Downloaded {self.repaired_blocks} blocks again to repair them.")
+        return result
@@ -0,0 +1,239 @@
+"""
+TeraBox Uploader CLI: retry.py
+This module is used to retry failed requests to the Terabox API.
+It decides per error class (API errno, HTTP status, curl exit code) if a request is retried, waits with a jittered
+exponential backoff between attempts and stops every request after repeated authentication errors.
+Used in: client.py, asyncengine.py, uploader.py, accounts.py, remote.py, restore.py, verify.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+from modules.formatting import Formatting
+from modules.metrics import get_metrics
+
+
+# Errors that will never succeed by retrying the same request
+PERMANENT_ERRNOS = {-7, -8, -9, -10, 2, 31061, 31062, 31066}
+# Errors of a remote directory that doesn't exist
+MISSING_DIR_ERRNOS = {-7, -9}
+# Errors caused by an invalid or expired login session
+AUTH_ERRNOS = {-6, 4000020, 4000023}
+RETRY_HTTP_STATUS = {408, 425, 429, 500, 502, 503, 504}
+AUTH_HTTP_STATUS = {401, 403}
+# curl exit codes for DNS, connection, timeout, TLS and transfer errors
+RETRY_CURL_CODES = {5, 6, 7, 16, 18, 28, 35, 52, 55, 56, 92}
+
+RETRY = "retry"
+FAIL = "fail"
+AUTH = "auth"
+
+
+class TransferError(Exception):
+    """
+    Exception raised when a single attempt of a request fails.
+    """
+    def __init__(self, kind: str, code=None, message: str = ""):
+        """
+        :param kind: Error class: "errno", "http", "curl", "md5" or "exception".
+        :param code: The errno, HTTP status or curl exit code of the error.
+        :param message: More information about the error.
+        """
+        self.kind = kind
+        self.code = code
+        self.message = message
+        super().__init__(f"{kind} error {code}: {message}" if code is not None else f"{kind} error: {message}")
+
+
+class CircuitOpenException(Exception):
+    """
+    Exception raised when requests are refused after repeated authentication errors.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class CircuitBreaker:
+    """
+    Opens after a number of consecutive authentication errors. While open, every request fails immediately.
+    """
+
+    def __init__(self, threshold: int = 3):
+        """
+        :param threshold: Consecutive authentication errors needed to open the circuit.
+        """
+        self.threshold = threshold
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """
+        True if requests are currently refused
+        """
+        return self.failures >= self.threshold
+
+    def record_success(self) -> None:
+        """
+        Resets the consecutive failure counter
+        :return:
+        """
+        with self._lock:
+            self.failures = 0
+
+    def record_auth_failure(self) -> None:
+        """
+        Counts an authentication error
+        :return:
+        """
+        with self._lock:
+            self.failures += 1
+
+
+class RetryPolicy:
+    """
+    Central retry policy shared by every request of the program.
+    """
+
+    def __init__(self, attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 breaker: Optional[CircuitBreaker] = None, log: Optional[Formatting] = None):
+        """
+        :param attempts: Maximum number of attempts per request, including the first one.
+        :param base_delay: Backoff base in seconds. The n-th retry waits up to base_delay * 2^n seconds.
+        :param max_delay: Upper bound of a single backoff in seconds.
+        :param breaker: Circuit breaker for authentication errors.
+        :param log: Formatting object used to log the retries.
+        """
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.log = log or Formatting(timestamps=True)
+        self.retry_counts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, section: dict, log: Optional[Formatting] = None) -> "RetryPolicy":
+        """
+        Builds a policy from the "retry" section of settings.json
+        :param section: The "retry" settings section.
+        :param log: Formatting object used to log the retries.
+        :return: RetryPolicy object
+        """
+        return cls(attempts=int(section.get("attempts", "5")),
+                   base_delay=float(section.get("basedelay", "1")),
+                   max_delay=float(section.get("maxdelay", "60")),
+                   breaker=CircuitBreaker(int(section.get("authfailures", "3"))),
+                   log=log)
+
+    @staticmethod
+    def decide(error: TransferError) -> str:
+        """
+        Decides what to do with a failed attempt
+        :param error: The error of the attempt.
+        :return: RETRY, FAIL or AUTH
+        """
+        if error.kind == "errno":
+            if error.code in AUTH_ERRNOS or "need verify" in error.message:
+                return AUTH
+            if error.code in PERMANENT_ERRNOS:
+                return FAIL
+            return RETRY
+        if error.kind == "http":
+            if error.code in AUTH_HTTP_STATUS:
+                return AUTH
+            if error.code in RETRY_HTTP_STATUS or (isinstance(error.code, int) and error.code >= 500):
+                return RETRY
+            return FAIL
+        if error.kind == "curl":
+            return RETRY if error.code in RETRY_CURL_CODES else FAIL
+        # MD5 mismatches, connection errors, timeouts and truncated responses
+        return RETRY
+
+    def backoff(self, retry: int) -> float:
+        """
+        Returns a full-jitter exponential backoff delay
+        :param retry: Number of the retry, starting at 0.
+        :return: Delay in seconds.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    def _before_attempt(self, operation: str) -> None:
+        if self.breaker.is_open:
+            raise CircuitOpenException(f"Refusing {operation} request after {self.breaker.failures} consecutive "
+                                       f"authentication errors. Please refresh the credentials.")
+
+    def _after_failure(self, operation: str, number: int, error: TransferError, attempts: int) -> float:
+        """
+        Handles a failed attempt
+        :param attempts: Amount of attempts of the request.
+        :return: Seconds to wait before the next attempt. Raises the error if the request must not be retried.
+        """
+        decision = self.decide(error)
+        get_metrics().record_error(operation, error)
+        if decision == AUTH:
+            self.breaker.record_auth_failure()
+        if decision == FAIL or number >= attempts - 1:
+            raise error
+        if self.breaker.is_open:
+            raise CircuitOpenException(f"Refusing {operation} request after {self.breaker.failures} "
+                                       f"consecutive authentication errors. Please refresh the credentials.") \
+                from error
+        delay = self.backoff(number)
+        with self._lock:
+            self.retry_counts[operation] = self.retry_counts.get(operation, 0) + 1
+        get_metrics().retries.inc(operation=operation)
+        self.log.warning(operation, f"Attempt {number + 1}/{attempts} failed ({error}). "
+                                    f"Retrying in {delay:.1f}s...")
+        return delay
+
+    def run(self, operation: str, attempt: Callable, attempts: Optional[int] = None):
+        """
+        Runs attempt until it succeeds, fails permanently or runs out of attempts
+        :param operation: Name of the operation, used for logging.
+        :param attempt: Callable doing one attempt. It returns the result or raises TransferError.
+        :param attempts: Amount of attempts, instead of the one of the policy. 1 for requests that must not be repeated.
+        :return: The result of the first successful attempt.
+        """
+        attempts = max(1, attempts or self.attempts)
+        for number in range(attempts):
+            self._before_attempt(operation)
+            try:
+                result = attempt()
+            except TransferError as error:
+                time.sleep(self._after_failure(operation, number, error, attempts))
+                continue
+            self.breaker.record_success()
+            return result
+        raise TransferError("exception", None, f"{operation} did not run")
+
+    async def run_async(self, operation: str, attempt: Callable[[], Awaitable]):
+        """
+        Coroutine version of run. Waits between attempts without blocking the event loop.
+        :param operation: Name of the operation, used for logging.
+        :param attempt: Coroutine function doing one attempt. It returns the result or raises TransferError.
+        :return: The result of the first successful attempt.
+        """
+        import asyncio
+
+        for number in range(self.attempts):
+            self._before_attempt(operation)
+            try:
+                result = await attempt()
+            except TransferError as error:
+                await asyncio.sleep(self._after_failure(operation, number, error, self.attempts))
+                continue
+            self.breaker.record_success()
+            return result
+        raise TransferError("exception", None, f"{operation} did not run")
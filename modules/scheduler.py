@@ -0,0 +1,232 @@
+"""
+TeraBox Uploader CLI: scheduler.py
+This module is used to decide the order in which the files of a run are uploaded.
+Without it the files are uploaded in the order of the directory listing, so a large video can hold back hundreds of
+small urgent files queued behind it. The files are ordered by a list of policies (smallest first, newest first, the
+priority of their directory or their deadline), and a large file that is being uploaded in parts can yield its upload
+slot between two parts to a small file of a higher priority or an earlier deadline.
+Used in: uploader.py, asyncengine.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import asyncio
+import fnmatch
+import heapq
+import itertools
+import math
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from modules.throttle import BandwidthSettingException, parse_rate
+
+POLICIES = ("fifo", "smallest", "largest", "newest", "oldest", "priority", "deadline")
+DEFAULT_PREEMPT_SIZE = 64 * 1024 * 1024
+
+
+class SchedulingSettingException(Exception):
+    """
+    Exception raised when the scheduling settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class Scheduler:
+    """
+    Orders the files of a run and decides when a large transfer yields to a small urgent file.
+    """
+
+    def __init__(self, policies: tuple = ("fifo",), priorities: Optional[dict] = None,
+                 deadlines: Optional[dict] = None, preempt: bool = False, preempt_size: int = DEFAULT_PREEMPT_SIZE):
+        """
+        :param policies: Policies applied in order, each one breaking the ties of the previous ones. The files that
+        are still tied keep the order of the scan.
+        :param priorities: dict of a directory pattern to its priority. Higher priorities are uploaded first. The
+        patterns are matched with the relative path of the file and of each of its parent directories, and the first
+        matching pattern is used. Other files have priority 0.
+        :param deadlines: dict of a directory pattern to the seconds after the modification time of a file by which it
+        should be uploaded. Other files have no deadline.
+        :param preempt: If True, large files yield their upload slot between two parts to small urgent files.
+        :param preempt_size: Files of this size or bigger are large, smaller files are small.
+        """
+        unknown = [policy for policy in policies if policy not in POLICIES]
+        if unknown:
+            raise SchedulingSettingException(f"Invalid scheduling policy: {', '.join(unknown)}. Use one of "
+                                             f"{', '.join(POLICIES)}.")
+        self.policies = tuple(policies) or ("fifo",)
+        self.priorities = priorities or {}
+        self.deadlines = deadlines or {}
+        self.preempt = preempt
+        self.preempt_size = preempt_size
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "Scheduler":
+        """
+        Builds the scheduler from the "scheduling" section of settings.json
+        :param section: dict with the optional "policy", "priorities", "deadlines", "preempt" and "preemptsize" keys.
+        "policy" is a policy or a comma separated list of policies.
+        :return: Scheduler object
+        """
+        policy = section.get("policy", "fifo")
+        policies = policy if isinstance(policy, list) else str(policy).split(",")
+        policies = tuple(item.strip().lower() for item in policies if item.strip())
+        try:
+            priorities = {str(pattern): int(value) for pattern, value in section.get("priorities", {}).items()}
+            deadlines = {str(pattern): float(value) for pattern, value in section.get("deadlines", {}).items()}
+            preempt_size = parse_rate(section.get("preemptsize", "64MB")) or 0
+        except (ValueError, AttributeError, BandwidthSettingException) as e:
+            raise SchedulingSettingException(f"Invalid scheduling settings: {e}") from e
+        return cls(policies, priorities, deadlines, str(section.get("preempt", "false")).lower() == "true",
+                   preempt_size)
+
+    @property
+    def enabled(self) -> bool:
+        """
+        True if the files are reordered or can preempt each other
+        """
+        return self.policies != ("fifo",) or self.preempt
+
+    @staticmethod
+    def _match(patterns: dict, file: dict):
+        relative = file['relative_path'].replace("\\", "/").strip("/")
+        parts = relative.split("/")
+        candidates = ["/".join(parts[:end]) for end in range(len(parts), 0, -1)]
+        for pattern, value in patterns.items():
+            pattern = pattern.replace("\\", "/").strip("/")
+            if any(fnmatch.fnmatch(candidate, pattern) for candidate in candidates):
+                return value
+        return None
+
+    @staticmethod
+    def _mtime(file: dict) -> float:
+        try:
+            return os.path.getmtime(file['path'])
+        except OSError:
+            return 0.0
+
+    def priority(self, file: dict) -> int:
+        """
+        Returns the priority of a file. A bundle has the highest priority of its files.
+        :param file: The file entry.
+        :return: The priority, 0 if no pattern matches.
+        """
+        members = file.get("members") or [file]
+        return max((self._match(self.priorities, member) or 0) for member in members)
+
+    def deadline(self, file: dict) -> float:
+        """
+        Returns the deadline of a file. A bundle has the earliest deadline of its files.
+        :param file: The file entry.
+        :return: Deadline as a Unix timestamp, infinity if the file has no deadline.
+        """
+        deadlines = []
+        for member in file.get("members") or [file]:
+            seconds = self._match(self.deadlines, member)
+            deadlines.append(math.inf if seconds is None else self._mtime(member) + seconds)
+        return min(deadlines)
+
+    def _policy_key(self, policy: str, file: dict):
+        if policy == "smallest":
+            return file['sizebytes']
+        if policy == "largest":
+            return -file['sizebytes']
+        if policy == "newest":
+            return -self._mtime(file)
+        if policy == "oldest":
+            return self._mtime(file)
+        if policy == "priority":
+            return -self.priority(file)
+        if policy == "deadline":
+            return self.deadline(file)
+        return 0
+
+    def key(self, file: dict) -> tuple:
+        """
+        Returns the sort key of a file according to the policies
+        :param file: The file entry.
+        :return: Tuple, lower keys are uploaded first.
+        """
+        return tuple(self._policy_key(policy, file) for policy in self.policies)
+
+    def order(self, entries: list) -> list:
+        """
+        Orders the files of a run
+        :param entries: list of file entries in the order of the scan.
+        :return: New list of the file entries in upload order.
+        """
+        if self.policies == ("fifo",):
+            return list(entries)
+        return sorted(entries, key=self.key)
+
+    def urgency(self, file: dict) -> tuple:
+        """
+        Returns how urgent a file is, by its priority and then by its deadline
+        :param file: The file entry.
+        :return: Tuple, lower is more urgent.
+        """
+        return -self.priority(file), self.deadline(file)
+
+    def preempts(self, waiting: dict, running: dict) -> bool:
+        """
+        Decides if a queued file takes the upload slot of a file that is being uploaded
+        :param waiting: Entry of the queued file.
+        :param running: Entry of the file being uploaded.
+        :return: True if preemption is enabled, the running file is large, the queued file is small and more urgent.
+        """
+        return (self.preempt and running['sizebytes'] >= self.preempt_size > waiting['sizebytes']
+                and self.urgency(waiting) < self.urgency(running))
+
+
+class PrioritySlots:
+    """
+    Asyncio semaphore that gives the free slots to the waiter with the lowest rank instead of the first one.
+    """
+
+    def __init__(self, slots: int):
+        """
+        :param slots: Amount of slots.
+        """
+        self._free = slots
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def _wake(self) -> None:
+        while self._free and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._free -= 1
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, rank: tuple = ()):
+        """
+        Holds a slot while the block runs
+        :param rank: Rank of the waiter. Waiters with the same rank get the slots in the order they asked for them.
+        """
+        if self._free and not self._waiters:
+            self._free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (rank, next(self._counter), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was given to this waiter just before it was cancelled
+                    self._free += 1
+                    self._wake()
+                raise
+        try:
+            yield
+        finally:
+            self._free += 1
+            self._wake()
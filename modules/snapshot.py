@@ -0,0 +1,225 @@
+"""
+TeraBox Uploader CLI: snapshot.py
+This module is used to upload a consistent state of the files that change while they are uploaded, like logs or
+databases. The size, modification time and inode of a file are recorded when the file is prepared for its upload and
+checked again before it is created on the cloud, so a file that changed mid-transfer is never created with a block
+list, a size and a content that disagree. Files modified within the stability window are deferred until they stop
+changing. Active files can also be copied to the temp directory before their upload, with a copy-on-write clone
+where the filesystem supports it, so the upload reads a frozen copy while the source keeps changing. Encrypted files
+are already uploaded from a copy, which is made again if the file changed while it was encrypted.
+Used in: uploader.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import os
+import shutil
+import time
+from typing import Callable, Optional
+
+from modules.formatting import Formatting
+
+COPY_MODES = ("never", "active", "always")
+# Seconds a file that is still being written is waited for before it is copied or skipped
+MAX_WAIT = 300
+# Files modified in the last seconds are active, and copied with the "active" copy mode
+ACTIVE_AGE = 60
+# Copies or encryptions of a file that changed while it was read before the file is skipped
+ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+# ioctl cloning a file on Linux filesystems with copy-on-write support (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+READ_BLOCK = 1024 * 1024
+
+
+class SnapshotSettingException(Exception):
+    """
+    Exception raised when the snapshot settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def file_state(path: str) -> tuple:
+    """
+    Returns the state of a file that changes when the file is written or replaced
+    :param path: Path of the file.
+    :return: (size, modification time in nanoseconds, inode) tuple.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def clone_file(source: str, target: str) -> bool:
+    """
+    Copies a file, cloning it where the filesystem supports copy-on-write so no data is copied
+    :param source: Path of the file.
+    :param target: Path of the copy. An existing file is replaced.
+    :return: True if the file was cloned, False if it was copied.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Not available on Windows
+        fcntl = None
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return True
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, READ_BLOCK)
+    return False
+
+
+class Snapshotter:
+    """
+    Keeps the uploads of the files that change while they are uploaded consistent.
+    """
+
+    def __init__(self, check: bool = True, stability: float = 0, max_wait: float = MAX_WAIT, copy: str = "never",
+                 active_age: float = ACTIVE_AGE, log: Optional[Formatting] = None):
+        """
+        :param check: If True, a file uploaded from its source is checked before it is created on the cloud, and a
+        file copied or encrypted while it changed is copied or encrypted again.
+        :param stability: Seconds a file must be left unchanged before it is uploaded. 0 disables the window.
+        :param max_wait: Seconds a file that is still being written is waited for.
+        :param copy: "never", "active" to copy the files modified in the last active_age seconds and the files still
+        being written after max_wait, or "always" to copy every file before its upload.
+        :param active_age: Seconds since the last modification of a file under which it is active.
+        :param log: Formatting object used for logging.
+        """
+        if copy not in COPY_MODES:
+            raise SnapshotSettingException(f"Invalid snapshot copy mode in settings.json: {copy}. Use one of "
+                                           f"{', '.join(COPY_MODES)}.")
+        self.check = check
+        self.stability = stability
+        self.max_wait = max_wait
+        self.copy = copy
+        self.active_age = active_age
+        self.log = log or Formatting(timestamps=True)
+
+    @classmethod
+    def from_settings(cls, section: dict, log: Optional[Formatting] = None) -> "Snapshotter":
+        """
+        Builds the snapshotter from the "snapshot" section of settings.json
+        :param section: dict with the optional "check", "stability", "maxwait", "copy" and "activeage" keys.
+        :param log: Formatting object used for logging.
+        :return: Snapshotter object
+        """
+        try:
+            stability = float(section.get("stability", 0))
+            max_wait = float(section.get("maxwait", MAX_WAIT))
+            active_age = float(section.get("activeage", ACTIVE_AGE))
+        except ValueError as e:
+            raise SnapshotSettingException(f"Invalid snapshot time in settings.json: {e}") from e
+        if min(stability, max_wait, active_age) < 0:
+            raise SnapshotSettingException("The snapshot times in settings.json can't be negative.")
+        return cls(str(section.get("check", "true")).lower() == "true", stability, max_wait,
+                   str(section.get("copy", "never")).lower(), active_age, log)
+
+    @staticmethod
+    def _age(path: str) -> float:
+        return time.time() - os.stat(path).st_mtime
+
+    def unstable(self, path: str) -> float:
+        """
+        Returns how long a file must still be left unchanged to be stable
+        :param path: Path of the file.
+        :return: Seconds left in the stability window, 0 if the file is stable or doesn't exist anymore.
+        """
+        if not self.stability:
+            return 0
+        try:
+            return max(0.0, self.stability - self._age(path))
+        except OSError:
+            return 0
+
+    def wait_stable(self, file: dict, block: bool = True) -> Optional[bool]:
+        """
+        Waits until a file is left unchanged for the stability window
+        :param file: The file entry.
+        :param block: If False, returns None instead of waiting.
+        :return: True once the file is stable, False if it is still being written after max_wait seconds.
+        """
+        left = self.unstable(file['path'])
+        if not left:
+            return True
+        if not block:
+            return None
+        self.log.info("snapshot", f"File {file['name']} is still being written. Waiting for it to stop changing...")
+        deadline = time.monotonic() + self.max_wait
+        while left:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(left, POLL_INTERVAL))
+            left = self.unstable(file['path'])
+        return True
+
+    def wants_copy(self, file: dict) -> bool:
+        """
+        Checks if a file is copied before its upload
+        :param file: The file entry, not encrypted.
+        :return: True with the "always" copy mode, or with the "active" copy mode if the file was modified in the
+        last active_age seconds.
+        """
+        return self.copy == "always" or (self.copy == "active" and self._age(file['path']) < self.active_age)
+
+    @staticmethod
+    def capture(file: dict) -> None:
+        """
+        Records the state of a file as it is read for its upload
+        :param file: The file entry. Its size is set to the size of the file.
+        :return:
+        """
+        file['state'] = file_state(file['path'])
+        file['sizebytes'] = file['state'][0]
+
+    @staticmethod
+    def changed(file: dict) -> Optional[str]:
+        """
+        Compares a file with its recorded state
+        :param file: The file entry.
+        :return: What changed, or None if the file is unchanged or its state wasn't recorded.
+        """
+        if 'state' not in file:
+            return None
+        try:
+            size, mtime, inode = file_state(file['path'])
+        except OSError:
+            return "it was deleted"
+        if inode != file['state'][2]:
+            return "it was replaced"
+        if size != file['state'][0]:
+            return f"its size went from {file['state'][0]} to {size} bytes"
+        if mtime != file['state'][1]:
+            return "it was modified"
+        return None
+
+    def consistent(self, file: dict, read: Callable, action: str) -> bool:
+        """
+        Copies or encrypts a file, again if the file changed while it was read
+        :param file: The file entry.
+        :param read: Function making the copy of the file. It returns True on success.
+        :param action: What the function does in the logs, like "copied" or "encrypted".
+        :return: True once a copy of an unchanged file is made.
+        """
+        for attempt in range(1, ATTEMPTS + 1):
+            self.capture(file)
+            if not read():
+                return False
+            reason = self.changed(file) if self.check else None
+            if reason is None:
+                return True
+            self.log.warning("snapshot", f"File {file['name']} changed while it was {action} ({reason})."
+                                         f"{' Trying again...' if attempt < ATTEMPTS else ''}")
+        self.log.error("snapshot", f"File {file['name']} kept changing while it was {action}. Skipping file...")
+        return False
@@ -0,0 +1,296 @@
+"""
+TeraBox Uploader CLI: tempspace.py
+This module is used to manage the space taken by the encrypted files, file parts and bundles of a run.
+Every run writes to its own directory under the temp directory, so two runs started from the same directory don't
+delete each other's files, and the directories left behind by runs that were killed are removed by the next run. The
+temp files of a file are deleted as soon as it is uploaded, and an optional budget caps the space they take: a file
+waits to be encrypted or split until the files being uploaded have freed enough space. The temp directory can be
+placed on a tmpfs or on a fast scratch volume.
+Used in: uploader.py, jobs.py, postupload.py, main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Optional
+
+from modules.formatting import Formatting, convert_size
+from modules.throttle import BandwidthSettingException, parse_rate
+
+RUN_PREFIX = "run-"
+TMPFS_DIRECTORY = "/dev/shm"
+# Share of the free memory of the tmpfs used when no budget is set
+TMPFS_SHARE = 0.5
+# Age after which the directory of a run is stale where the process of the run can't be looked up
+STALE_AGE = 24 * 3600
+
+
+class TempSpaceSettingException(Exception):
+    """
+    Exception raised when the temp settings are invalid.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def running(pid: int, path: str) -> bool:
+    """
+    Checks if the run that owns a temp directory or a journal is still running
+    :param pid: Process ID in the name of the directory or file.
+    :param path: Path of the directory or file.
+    :return: True if the process exists. On Windows, where signalling a process ends it, True if the directory or
+    file was modified in the last day.
+    """
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        try:
+            return time.time() - os.path.getmtime(path) < STALE_AGE
+        except OSError:
+            return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TempSpace:
+    """
+    Temp directory of a run, with a budget of the space its files can take.
+    """
+
+    def __init__(self, directory: str = "./temp", budget: Optional[int] = None, tmpfs: bool = False,
+                 log: Optional[Formatting] = None):
+        """
+        :param directory: Directory holding the directory of each run.
+        :param budget: Maximum amount of bytes taken by the temp files of the run. None if unlimited.
+        :param tmpfs: True if the directory is on the tmpfs. Without a budget, the budget is then half of the free
+        memory of the tmpfs when the run starts.
+        :param log: Formatting object used for logging.
+        """
+        self.root = os.path.abspath(directory)
+        self.budget = budget
+        self.tmpfs = tmpfs
+        self.log = log or Formatting(timestamps=True)
+        self.run_dir = os.path.join(self.root, f"{RUN_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self._held = {}
+        # Keys whose space is taken by files written ahead of their upload, like the bundles
+        self._parked = set()
+        self._files = {}
+        self._opened = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_settings(cls, section: dict, directory: str = "./temp", log: Optional[Formatting] = None) -> "TempSpace":
+        """
+        Builds the temp space from the "temp" section of settings.json
+        :param section: dict with the optional "directory", "tmpfs" and "budget" keys.
+        :param directory: Temp directory used if the section doesn't set one.
+        :param log: Formatting object used for logging.
+        :return: TempSpace object
+        """
+        try:
+            budget = parse_rate(section.get("budget", "0"))
+        except BandwidthSettingException as e:
+            raise TempSpaceSettingException(f"Invalid temp budget in settings.json: {section.get('budget')}") from e
+        directory = section.get("directory") or directory
+        tmpfs = str(section.get("tmpfs", "false")).lower() == "true"
+        if tmpfs:
+            if os.path.isdir(TMPFS_DIRECTORY) and os.access(TMPFS_DIRECTORY, os.W_OK):
+                directory = os.path.join(TMPFS_DIRECTORY, "terabox-uploader")
+            else:
+                # Not a Linux system, the temp directory stays on the disk
+                tmpfs = False
+        return cls(directory, budget, tmpfs, log)
+
+    def directory(self, name: Optional[str] = None) -> str:
+        """
+        Returns the directory of the run, or a directory inside it
+        :param name: Name of the directory inside the directory of the run, like the name of an upload job.
+        :return: Absolute path. The directory is created when a file is written to it.
+        """
+        return os.path.join(self.run_dir, name) if name else self.run_dir
+
+    def clean_stale(self) -> int:
+        """
+        Removes the directories of the runs that are no longer running. Other files of the temp directory are left
+        alone, as it can be a shared scratch directory.
+        :return: Amount of directories removed.
+        """
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(RUN_PREFIX) or path == self.run_dir or not os.path.isdir(path):
+                continue
+            pid = name[len(RUN_PREFIX):].split("-")[0]
+            if pid.isdigit() and running(int(pid), path):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    def open(self) -> None:
+        """
+        Creates the directory of the run and removes the stale ones. Every open must be matched by a close, and only
+        the first one does anything.
+        :return:
+        """
+        with self._condition:
+            self._opened += 1
+            if self._opened > 1:
+                return
+        os.makedirs(self.root, exist_ok=True)
+        removed = self.clean_stale()
+        if removed:
+            self.log.info("temp", f"Removed the temp directories of {removed} previous runs.")
+        os.makedirs(self.run_dir, exist_ok=True)
+        free = shutil.disk_usage(self.root).free
+        if self.budget is None and self.tmpfs:
+            self.budget = int(free * TMPFS_SHARE)
+        if self.budget is not None and self.budget > free:
+            self.log.warning("temp", f"The temp budget of {convert_size(self.budget)} is more than the "
+                                     f"{convert_size(free)} free in {self.root}.")
+        budget = f" with a budget of {convert_size(self.budget)}" if self.budget is not None else ""
+        self.log.debug("temp", f"Using temp directory {self.run_dir}{budget}.")
+
+    def close(self) -> None:
+        """
+        Removes the directory of the run once every open was closed
+        :return:
+        """
+        with self._condition:
+            self._opened -= 1
+            if self._opened > 0:
+                return
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        if self.peak:
+            self.log.debug("temp", f"The temp files took up to {convert_size(self.peak)}"
+                                   f"{f' and waited for space {self.waits} times' if self.waits else ''}.")
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Space reserved by the files being prepared or uploaded, which is freed once they are done
+        """
+        return self.used - sum(self._held.get(key, 0) for key in self._parked)
+
+    def fits(self, nbytes: int) -> bool:
+        """
+        Checks if a reservation can be made without waiting
+        :param nbytes: Size of the reservation.
+        :return: True if there is no budget, the reservation fits in the budget, or no file in flight holds space.
+        The space of the files written ahead of their upload is only freed once they are uploaded, so waiting for
+        it could wait forever.
+        """
+        return self.budget is None or self.in_flight == 0 or self.used + nbytes <= self.budget
+
+    def _add(self, key: str, nbytes: int) -> None:
+        self._held[key] = self._held.get(key, 0) + nbytes
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def reserve(self, key: str, nbytes: int, name: Optional[str] = None, block: bool = True) -> bool:
+        """
+        Reserves space for the temp files of a file, waiting for the files being uploaded to free it if the budget
+        is used up. A file that already holds space grows its reservation without waiting, so two files never wait
+        for each other.
+        :param key: Key of the file, its source path.
+        :param nbytes: Space the file needs in bytes.
+        :param name: Name of the file in the logs.
+        :param block: If False, returns False instead of waiting.
+        :return: True once the space is reserved.
+        """
+        with self._condition:
+            held = self._held.get(key)
+            if held is not None:
+                # A file written ahead of its upload is in flight once it is prepared
+                self._parked.discard(key)
+                self._add(key, max(0, nbytes - held))
+                return True
+            if not self.fits(nbytes):
+                if not block:
+                    return False
+                self.waits += 1
+                self.log.info("temp", f"Waiting for {convert_size(nbytes)} of temp space for "
+                                      f"{name or os.path.basename(key)}...")
+                self._condition.wait_for(lambda: self.fits(nbytes))
+            self._add(key, nbytes)
+            return True
+
+    def resize(self, key: str, nbytes: int) -> None:
+        """
+        Sets the reservation of a file to the space it really takes, once its temp files are written
+        :param key: Key of the file.
+        :param nbytes: Space taken in bytes.
+        :return:
+        """
+        with self._condition:
+            self.used += nbytes - self._held.get(key, 0)
+            self._held[key] = nbytes
+            self.peak = max(self.peak, self.used)
+            self._condition.notify_all()
+
+    def track(self, key: str, path: str, nbytes: int = 0) -> None:
+        """
+        Records a temp file of a file, so it is deleted with the file's reservation
+        :param key: Key of the file.
+        :param path: Path of the temp file.
+        :param nbytes: Size added to the reservation of the file, for files written ahead of their upload outside of a
+        reservation, like the bundles. Their space doesn't make the other files wait until they are prepared.
+        :return:
+        """
+        with self._condition:
+            self._files.setdefault(key, set()).add(path)
+            if nbytes:
+                if key not in self._held:
+                    self._parked.add(key)
+                self._add(key, nbytes)
+
+    def remove(self, key: str, path: str) -> None:
+        """
+        Deletes a temp file of a file before the file is done, like an uploaded part
+        :param key: Key of the file.
+        :param path: Path of the temp file.
+        :return:
+        """
+        with self._condition:
+            self._files.get(key, set()).discard(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def release(self, key: str) -> None:
+        """
+        Deletes the temp files of a file and frees its reservation, once the file is uploaded, skipped or failed
+        :param key: Key of the file.
+        :return:
+        """
+        with self._condition:
+            paths = self._files.pop(key, set())
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._condition:
+            self.used -= self._held.pop(key, 0)
+            self._parked.discard(key)
+            self._condition.notify_all()
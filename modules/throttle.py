@@ -0,0 +1,429 @@
+"""
+TeraBox Uploader CLI: throttle.py
+This module is used to limit the upload bandwidth used by the program.
+It implements a token bucket shared by every transfer, time-of-day bandwidth schedules and runtime adjustments
+through a control file or a signal. When several upload jobs run at once, the limit is split equally between them.
+Used in: main.py, client.py, jobs.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import contextvars
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+# Upload job of the running code. Coroutines and asyncio.to_thread calls inherit it from the job's thread
+CURRENT_JOB = contextvars.ContextVar("throttle_job", default="")
+
+
+class BandwidthSettingException(Exception):
+    """
+    Exception raised when a bandwidth setting can't be parsed.
+    """
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def parse_rate(value) -> Optional[int]:
+    """
+    Parses a rate setting like "5MB", "512KB" or "1048576" into bytes per second
+    :param value: The rate as a string or number. "0", "" and "unlimited" mean no limit.
+    :return: The rate in bytes per second or None if unlimited.
+    """
+    if value is None:
+        return None
+    text = str(value).strip().upper().replace("/S", "").replace(" ", "")
+    if text in ("", "0", "UNLIMITED", "NONE", "AUTO"):
+        return None
+    for unit in ("GB", "MB", "KB", "B"):
+        if text.endswith(unit):
+            number = text[:-len(unit)]
+            break
+    else:
+        unit, number = "B", text
+    try:
+        rate = int(float(number) * SIZE_UNITS[unit])
+    except ValueError as e:
+        raise BandwidthSettingException(f"Invalid bandwidth value: {value}") from e
+    return rate if rate > 0 else None
+
+
+def _parse_clock(value: str) -> int:
+    """
+    Converts a "HH:MM" string to minutes since midnight
+    :param value: The time of day as "HH:MM".
+    :return: Minutes since midnight.
+    """
+    try:
+        hours, minutes = str(value).split(":")
+        return int(hours) * 60 + int(minutes)
+    except ValueError as e:
+        raise BandwidthSettingException(f"Invalid time of day: {value}. Use the HH:MM format.") from e
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens are bytes and are refilled at the configured rate.
+    """
+
+    def __init__(self, rate: Optional[int] = None, burst: Optional[int] = None):
+        """
+        Initializes the bucket
+        :param rate: Refill rate in bytes per second. None disables the limit.
+        :param burst: Maximum amount of tokens stored. Defaults to one second worth of tokens.
+        """
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(self._capacity())
+        self._updated = time.monotonic()
+
+    def _capacity(self) -> int:
+        if self.burst:
+            return self.burst
+        return self.rate or 0
+
+    def set_rate(self, rate: Optional[int]) -> None:
+        """
+        Changes the refill rate of the bucket
+        :param rate: New rate in bytes per second. None disables the limit.
+        :return:
+        """
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self._tokens = min(self._tokens, float(self._capacity()))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(float(self._capacity()), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, nbytes: int) -> float:
+        """
+        Takes tokens from the bucket without blocking
+        :param nbytes: Amount of bytes about to be sent.
+        :return: Seconds the caller has to wait before sending them.
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self._tokens -= nbytes
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def consume(self, nbytes: int) -> None:
+        """
+        Takes tokens from the bucket, blocking until they are available
+        :param nbytes: Amount of bytes about to be sent.
+        :return:
+        """
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BandwidthSchedule:
+    """
+    Resolves the bandwidth limit for a given time of day.
+    """
+
+    def __init__(self, default: Optional[int] = None, rules: Optional[list] = None):
+        """
+        Initializes the schedule
+        :param default: Limit in bytes per second used outside of every rule. None means unlimited.
+        :param rules: list of (start minute, end minute, limit) tuples. Rules can wrap around midnight.
+        """
+        self.default = default
+        self.rules = rules or []
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "BandwidthSchedule":
+        """
+        Builds a schedule from the "bandwidth" section of settings.json
+        :param section: The "bandwidth" settings section.
+        :return: BandwidthSchedule object
+        """
+        rules = []
+        for rule in section.get("schedule", []):
+            rules.append((_parse_clock(rule["start"]), _parse_clock(rule["end"]), parse_rate(rule.get("limit"))))
+        return cls(parse_rate(section.get("limit", "0")), rules)
+
+    def limit_at(self, when: Optional[datetime] = None) -> Optional[int]:
+        """
+        Returns the limit that applies at the given time
+        :param when: The time to check. Defaults to now.
+        :return: Limit in bytes per second or None if unlimited.
+        """
+        when = when or datetime.now()
+        minute = when.hour * 60 + when.minute
+        for start, end, limit in self.rules:
+            if start <= end and start <= minute < end:
+                return limit
+            if start > end and (minute >= start or minute < end):
+                return limit
+        return self.default
+
+
+class Throttle:
+    """
+    Global bandwidth limiter shared by every upload of the program.
+    """
+
+    def __init__(self, schedule: Optional[BandwidthSchedule] = None, controlfile: str = "",
+                 refresh_interval: float = 1.0):
+        """
+        Initializes the throttle
+        :param schedule: Time-of-day schedule for the bandwidth limit.
+        :param controlfile: Path of a file whose content ("5MB", "unlimited", "auto") overrides the schedule at
+        runtime. Deleting the file or writing "auto" gives control back to the schedule.
+        :param refresh_interval: Minimum amount of seconds between limit re-evaluations.
+        """
+        self.schedule = schedule or BandwidthSchedule()
+        self.controlfile = controlfile
+        self.refresh_interval = refresh_interval
+        self.bucket = TokenBucket(self.schedule.limit_at())
+        self._lock = threading.Lock()
+        self._override = None
+        self._control_mtime = None
+        self._last_refresh = 0.0
+        self._force_reload = False
+        self._active = 0
+        self._sent_bytes = 0
+        self._busy_since = None
+        self._busy_seconds = 0.0
+        self._jobs = {}
+        self._job_transfers = {}
+        # Most transfers that can run at the same time, declared by the blocks running parallel uploads
+        self._parallel = []
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "Throttle":
+        """
+        Builds a throttle from the "bandwidth" section of settings.json
+        :param section: The "bandwidth" settings section.
+        :return: Throttle object
+        """
+        return cls(BandwidthSchedule.from_settings(section), section.get("controlfile", ""))
+
+    @property
+    def limit(self) -> Optional[int]:
+        """
+        Current limit in bytes per second, None if unlimited
+        """
+        self.refresh()
+        return self.bucket.rate
+
+    @property
+    def active(self) -> int:
+        """
+        Amount of transfers in progress
+        """
+        with self._lock:
+            return self._active
+
+    def install_signal_handler(self) -> bool:
+        """
+        Reloads the control file immediately when SIGUSR1 is received (not available on Windows)
+        :return: True if the handler was installed.
+        """
+        if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+            return False
+
+        def _reload(_signum, _frame):
+            self._force_reload = True
+
+        signal.signal(signal.SIGUSR1, _reload)
+        return True
+
+    def _read_controlfile(self) -> None:
+        if not self.controlfile:
+            return
+        try:
+            mtime = os.path.getmtime(self.controlfile)
+        except OSError:
+            self._override = None
+            self._control_mtime = None
+            return
+        if mtime == self._control_mtime and not self._force_reload:
+            return
+        self._control_mtime = mtime
+        try:
+            with open(self.controlfile, "r", encoding="utf8") as f:
+                content = f.read().strip()
+            if content.lower() in ("", "auto"):
+                self._override = None
+            else:
+                self._override = ("limit", parse_rate(content))
+        except (OSError, BandwidthSettingException):
+            self._override = None
+
+    def refresh(self) -> None:
+        """
+        Re-evaluates the schedule and the control file, at most once per refresh interval
+        :return:
+        """
+        now = time.monotonic()
+        if not self._force_reload and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            self._last_refresh = now
+            self._read_controlfile()
+            self._force_reload = False
+            limit = self._override[1] if self._override else self.schedule.limit_at()
+            if limit != self.bucket.rate:
+                self.bucket.set_rate(limit)
+                self._rebalance()
+
+    def _rebalance(self) -> None:
+        # Gives every running job an equal share of the limit. Called with the lock held.
+        rate = self.bucket.rate
+        share = max(1, rate // len(self._jobs)) if rate and self._jobs else None
+        for bucket in self._jobs.values():
+            if bucket.rate != share:
+                bucket.set_rate(share)
+
+    @contextmanager
+    def job(self, name: str):
+        """
+        Runs the code of an upload job with its own share of the limit. The limit is split equally between the
+        running jobs, so a job with many parallel transfers doesn't starve the others.
+        :param name: Unique name of the job.
+        :return:
+        """
+        with self._lock:
+            self._jobs[name] = TokenBucket()
+            self._job_transfers[name] = 0
+            self._rebalance()
+        token = CURRENT_JOB.set(name)
+        try:
+            yield
+        finally:
+            CURRENT_JOB.reset(token)
+            with self._lock:
+                del self._jobs[name]
+                del self._job_transfers[name]
+                self._rebalance()
+
+    @contextmanager
+    def parallel(self, transfers: int):
+        """
+        Declares that up to transfers uploads can run at the same time in the block, like the workers of the upload
+        jobs or of the accounts, so the curl processes get a share of the limit that fits all of them from the start
+        :param transfers: Most transfers running at the same time.
+        :return:
+        """
+        with self._lock:
+            self._parallel.append(max(1, transfers))
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._parallel.remove(max(1, transfers))
+
+    def _bucket(self) -> TokenBucket:
+        # The bucket of the current job, or the global bucket outside of jobs
+        return self._jobs.get(CURRENT_JOB.get(), self.bucket)
+
+    def consume(self, nbytes: int) -> None:
+        """
+        Blocks until nbytes can be sent under the global limit
+        :param nbytes: Amount of bytes about to be sent.
+        :return:
+        """
+        self.refresh()
+        self._bucket().consume(nbytes)
+
+    def reserve(self, nbytes: int) -> float:
+        """
+        Takes nbytes from the global limit without blocking. Used by coroutines, which wait on their own.
+        :param nbytes: Amount of bytes about to be sent.
+        :return: Seconds the caller has to wait before sending them.
+        """
+        self.refresh()
+        return self._bucket().reserve(nbytes)
+
+    def start_transfer(self) -> None:
+        """
+        Registers a transfer as active. Active transfers share the limit (or the share of their job) equally.
+        :return:
+        """
+        with self._lock:
+            if self._active == 0:
+                self._busy_since = time.monotonic()
+            self._active += 1
+            job = CURRENT_JOB.get()
+            if job in self._job_transfers:
+                self._job_transfers[job] += 1
+
+    def end_transfer(self, nbytes: int) -> None:
+        """
+        Registers the end of a transfer
+        :param nbytes: Amount of bytes the transfer sent.
+        :return:
+        """
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            job = CURRENT_JOB.get()
+            if job in self._job_transfers:
+                self._job_transfers[job] = max(0, self._job_transfers[job] - 1)
+            self._sent_bytes += nbytes
+            if self._active == 0 and self._busy_since is not None:
+                self._busy_seconds += time.monotonic() - self._busy_since
+                self._busy_since = None
+
+    def curl_args(self) -> list:
+        """
+        Returns the curl arguments that keep an external curl process within its share of the limit.
+        The share is recalculated when each process starts, so changes apply from the next file or part on. A curl
+        process keeps its share until it ends, so the share is never more than the limit divided by the most
+        transfers that can run at the same time, and the processes that overlap stay under the limit together.
+        :return: list of curl arguments, empty if unlimited.
+        """
+        limit = self.limit
+        if not limit:
+            return []
+        with self._lock:
+            share = limit // max([1, self._active] + self._parallel)
+            job = CURRENT_JOB.get()
+            if job in self._jobs:
+                share = min(share, (self._jobs[job].rate or limit) // max(1, self._job_transfers[job]))
+            share = max(1024, share)
+        return ["--limit-rate", str(share)]
+
+    def throughput(self) -> float:
+        """
+        Returns the achieved aggregate throughput while at least one transfer was active
+        :return: Throughput in bytes per second.
+        """
+        with self._lock:
+            busy = self._busy_seconds
+            if self._busy_since is not None:
+                busy += time.monotonic() - self._busy_since
+            if busy <= 0:
+                return 0.0
+            return self._sent_bytes / busy
+
+    @property
+    def sent_bytes(self) -> int:
+        """
+        Total amount of bytes reported by finished transfers
+        """
+        return self._sent_bytes
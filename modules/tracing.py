@@ -0,0 +1,220 @@
+"""
+TeraBox Uploader CLI: tracing.py
+This module is used to measure where the time of a run goes. Spans are recorded around the phases of the run
+(scan, encryption, remote listing), the stages of every file, the API requests and the curl uploads. They can be
+exported as a Chrome trace file (chrome://tracing or https://ui.perfetto.dev) and summarized in a table.
+Tracing is disabled by default and costs almost nothing then.
+Used in: main.py, uploader.py, client.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from modules.formatting import Formatting
+
+LANE_OFFSET = 1000
+MAX_EVENTS = 1000000
+
+
+class Tracer:
+    """
+    Records timed spans. It also listens to the stage and transfer events of the Progress tracker; the stages of
+    each file are shown on a "file lane", reused by the next file once the file is finished.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "", summary: bool = True, max_events: int = MAX_EVENTS):
+        """
+        :param enabled: If False, nothing is recorded.
+        :param path: Path of the Chrome trace file written by write(). Not written if empty.
+        :param summary: If True, log_summary() logs the table of the time spent per span.
+        :param max_events: Maximum amount of spans kept for the trace file. The summary counts every span.
+        """
+        self.enabled = enabled
+        self.path = path
+        self.summary = summary
+        self.max_events = max_events
+        self.started = time.monotonic()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._events = []
+        self._totals = {}
+        self._threads = {}
+        self._lanes = []
+        self._file_lanes = {}
+
+    @classmethod
+    def from_settings(cls, section: dict) -> "Tracer":
+        """
+        Builds the tracer from the "tracing" section of settings.json
+        :param section: dict with the optional "enabled", "file" and "summary" keys.
+        :return: Tracer object
+        """
+        return cls(str(section.get("enabled", "false")).lower() == "true", section.get("file", "trace.json"),
+                   str(section.get("summary", "true")).lower() == "true")
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **args):
+        """
+        Records the time spent in a with block
+        :param name: Name of the span.
+        :param category: Category of the span (phase, encrypt, api, curl...).
+        :param args: Extra values shown with the span in the trace viewer.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            thread = threading.current_thread()
+            self._threads.setdefault(thread.ident, thread.name)
+            self.record(name, category, started, time.monotonic(), thread.ident, args)
+
+    def record(self, name: str, category: str, started: float, ended: float, tid: int,
+               args: Optional[dict] = None) -> None:
+        """
+        Records a finished span
+        :param name: Name of the span.
+        :param category: Category of the span.
+        :param started: time.monotonic() at the start of the span.
+        :param ended: time.monotonic() at the end of the span.
+        :param tid: Thread or lane of the span.
+        :param args: Extra values of the span.
+        :return:
+        """
+        if not self.enabled:
+            return
+        duration = ended - started
+        with self._lock:
+            total = self._totals.setdefault((category, name), [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            if len(self._events) < self.max_events:
+                self._events.append({"name": name, "cat": category, "ph": "X", "pid": self._pid, "tid": tid,
+                                     "ts": round((started - self.started) * 1e6, 1),
+                                     "dur": round(duration * 1e6, 1), "args": args or {}})
+
+    def _lane(self, key: str, started: float) -> int:
+        lane = self._file_lanes.get(key)
+        if lane is None:
+            # First free lane whose last span ended before this one started, so spans never overlap on a lane
+            for index, (owner, last_end) in enumerate(self._lanes):
+                if owner is None and last_end <= started:
+                    lane = index
+                    break
+            else:
+                lane = len(self._lanes)
+                self._lanes.append([None, 0.0])
+            self._lanes[lane][0] = key
+            self._file_lanes[key] = lane
+        return lane
+
+    def on_stage(self, key: str, stage: str, started: float, ended: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            lane = self._lane(key, started)
+            self._lanes[lane][1] = max(self._lanes[lane][1], ended)
+        self.record(stage, "stage", started, ended, LANE_OFFSET + lane, {"file": key})
+
+    def on_transfer(self, key: str, part: int, nbytes: int, started: float, ended: float, ok: bool) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            lane = self._lane(key, started)
+        self.record(f"part {part}", "transfer", started, ended, LANE_OFFSET + lane,
+                    {"file": key, "bytes": nbytes, "ok": ok})
+
+    def on_finish(self, key: str, status: str, size: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            lane = self._file_lanes.pop(key, None)
+            if lane is not None:
+                self._lanes[lane][0] = None
+                self._lanes[lane][1] = max(self._lanes[lane][1], time.monotonic())
+
+    def write(self, path: Optional[str] = None) -> Optional[str]:
+        """
+        Writes the spans as a Chrome trace file
+        :param path: Path of the file. Defaults to the path of the tracer.
+        :return: The path of the file, or None if nothing was written.
+        """
+        path = path or self.path
+        if not self.enabled or not path:
+            return None
+        with self._lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                        for tid, name in self._threads.items()]
+            metadata += [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": LANE_OFFSET + lane,
+                          "args": {"name": f"file lane {lane + 1}"}} for lane in range(len(self._lanes))]
+            events = metadata + self._events
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+    def rows(self) -> list:
+        """
+        Returns the time spent per span, the longest first
+        :return: list of (category, name, count, total seconds, max seconds) tuples.
+        """
+        with self._lock:
+            return sorted(((category, name, count, total, longest)
+                           for (category, name), (count, total, longest) in self._totals.items()),
+                          key=lambda row: row[3], reverse=True)
+
+    def log_summary(self, log: Optional[Formatting] = None) -> None:
+        """
+        Logs the table of the time spent per span. Spans of concurrent files can add up to more than the run.
+        :param log: Formatting object used for logging.
+        :return:
+        """
+        if not self.enabled or not self.summary:
+            return
+        log = log or Formatting(timestamps=True)
+        wall = time.monotonic() - self.started
+        log.info("trace", f"Time per span for a run of {wall:.2f}s:")
+        log.info("trace", f"{'category':<10} {'span':<24} {'count':>7} {'total (s)':>10} {'mean (ms)':>10} "
+                          f"{'max (ms)':>10} {'% of run':>9}")
+        for category, name, count, total, longest in self.rows():
+            log.info("trace", f"{category:<10} {name[:24]:<24} {count:>7} {total:>10.3f} "
+                              f"{total / count * 1000:>10.1f} {longest * 1000:>10.1f} "
+                              f"{total / wall * 100 if wall else 0:>8.1f}%")
+
+
+_tracer = None
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the tracer shared by the program
+    :return: Tracer object. Disabled unless replaced with set_tracer.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    """
+    Replaces the tracer shared by the program
+    :param tracer: The new tracer.
+    :return:
+    """
+    global _tracer
+    _tracer = tracer
@@ -0,0 +1,1048 @@
+"""
+TeraBox Uploader CLI: uploader.py
+This module is used to upload local files and directories to Terabox.
+It scans the local files, packs the small ones into bundles, skips the files that already exist on the cloud,
+encrypts the rest if enabled right before uploading them and moves or deletes the source files afterwards.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import fnmatch
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from modules.accounts import AccountPool
+from modules.client import TeraboxClient
+from modules.config import Settings
+from modules.curl import CurlNotFoundException
+from modules.formatting import Formatting, convert_size, short_path
+from modules.integrity import IntegrityManifest, block_digests
+from modules.metrics import get_metrics
+from modules.packing import Packer
+from modules.postupload import PostUploadJournal
+from modules.progress import Dashboard, Progress
+from modules.quota import QuotaTracker
+from modules.retry import MISSING_DIR_ERRNOS, CircuitOpenException, RetryPolicy, TransferError
+from modules.scheduler import Scheduler
+from modules.snapshot import Snapshotter, clone_file
+from modules.tempspace import TempSpace
+from modules.tracing import get_tracer
+
+PROTECTED_FILES = [".DS_Store", "main.py", "settings.json", "secrets.json"]
+SPLIT_THRESHOLD = 2147483648
+CHUNK_SIZE = 120 * 1024 * 1024
+READ_BLOCK = 1024 * 1024
+# Directories of the temp files of each file, unique in the process so uploaders sharing a temp directory don't clash
+_SCRATCH_IDS = itertools.count()
+
+
+def part_count(size: int, chunk_size: int = CHUNK_SIZE, split_threshold: int = SPLIT_THRESHOLD) -> int:
+    """
+    Returns the amount of parts a file is uploaded in
+    :param size: Size of the file in bytes.
+    :param chunk_size: Size of each part when the file is split.
+    :param split_threshold: Files of this size or bigger are split in parts.
+    :return: Amount of parts, 1 if the file isn't split.
+    """
+    return -(-size // chunk_size) if size >= split_threshold else 1
+
+
+def block_md5s(path: str, size: int, chunk_size: int = CHUNK_SIZE, split_threshold: int = SPLIT_THRESHOLD) -> list:
+    """
+    Calculates the MD5 hash of every block of the file uploaded as a separate part
+    :param path: Path of the file.
+    :param size: Size of the file in bytes.
+    :param chunk_size: Size of each part when the file is split.
+    :param split_threshold: Files of this size or bigger are split in parts.
+    :return: list of MD5 hex digests, one per part.
+    """
+    part_size = chunk_size if size >= split_threshold else max(size, 1)
+    hashes = []
+    with open(path, "rb") as f:
+        for _ in range(part_count(size, chunk_size, split_threshold)):
+            md5 = hashlib.md5()
+            remaining = part_size
+            while remaining > 0:
+                data = f.read(min(READ_BLOCK, remaining))
+                if not data:
+                    break
+                md5.update(data)
+                remaining -= len(data)
+            hashes.append(md5.hexdigest())
+    return hashes
+
+
+def log_transfer_summary(client: TeraboxClient, log: Formatting) -> None:
+    """
+    Logs the retried requests and the average upload bandwidth of a client
+    :param client: The client of the uploads.
+    :param log: Formatting object used for logging.
+    :return:
+    """
+    retry_counts = client.retry.retry_counts
+    if retry_counts:
+        log.info("retry", "Retried requests: " + ", ".join(f"{operation} {count}x" for operation, count
+                                                           in retry_counts.items()))
+    throttle = client.throttle
+    if throttle.sent_bytes:
+        log.info("bandwidth", f"Uploaded {convert_size(throttle.sent_bytes)} at an average of "
+                              f"{convert_size(int(throttle.throughput()))}/s.")
+
+
+class UploadResult:
+    """
+    Outcome of an upload run.
+    """
+
+    def __init__(self):
+        self.uploaded = []
+        self.skipped = []
+        self.failed = []
+
+    @property
+    def ok(self) -> bool:
+        """
+        True if no file failed
+        """
+        return not self.failed
+
+    def add(self, status: str, path: str) -> None:
+        """
+        Records the outcome of a file
+        :param status: "uploaded", "skipped" or "failed".
+        :param path: Local path of the file.
+        :return:
+        """
+        getattr(self, status).append(path)
+
+
+class Uploader:
+    """
+    Uploads local files to a Terabox account according to the settings.
+    """
+
+    def __init__(self, client: TeraboxClient, settings: Settings, temp_dir: str = "./temp",
+                 log: Optional[Formatting] = None, progress: Optional[Progress] = None,
+                 packer: Optional[Packer] = None, quota: Optional[QuotaTracker] = None, shared: bool = False,
+                 accounts: Optional[AccountPool] = None, temp: Optional[TempSpace] = None):
+        """
+        :param client: Client of the account the files are uploaded to.
+        :param settings: Program settings.
+        :param temp_dir: Directory holding the temp directory of each run, unless set by the temp settings. With a
+        shared temp space, the directory of the uploader inside it.
+        :param log: Formatting object used for logging.
+        :param progress: Tracker of the upload progress. A new one is used if None.
+        :param packer: Packer of the small files. Built from the packing settings if None.
+        :param quota: Tracker of the available quota, shared with other uploaders of the account. A new one is used
+        if None.
+        :param shared: If True, the uploader is one of several uploaders of a run, like the upload jobs. The progress
+        dashboard and the retry and bandwidth summaries are then left to the caller.
+        :param accounts: AccountPool of the accounts the files are spread over. With a single account, or None, every
+        file is uploaded with the client.
+        :param temp: Temp space shared with other uploaders, like the upload jobs, and opened by the caller. Built
+        from the temp settings if None.
+        """
+        self.client = client
+        self.settings = settings
+        self.log = log or client.log
+        self.temp = temp or TempSpace.from_settings(settings.temp, temp_dir, self.log)
+        self.temp_dir = temp_dir if temp is not None else self.temp.directory()
+        self.progress = progress or Progress()
+        self.packer = packer or Packer.from_settings(settings.packing, self.temp_dir, self.log)
+        self.scheduler = Scheduler.from_settings(settings.scheduling)
+        self.journal = PostUploadJournal.from_settings(settings.files, self.log)
+        self.integrity = IntegrityManifest.from_settings(settings.integrity, self.log)
+        self.snapshot = Snapshotter.from_settings(settings.snapshot, self.log)
+        self.quota = quota or QuotaTracker(client)
+        self.shared = shared
+        self.accounts = accounts
+        self.metrics = get_metrics()
+        self.progress.add_listener(self.metrics)
+        self.tracer = get_tracer()
+        if self.tracer.enabled:
+            self.progress.add_listener(self.tracer)
+        self._compression = None
+        self._encryption_ready = None
+        self._encryption_lock = threading.Lock()
+
+    def _display(self, path: str) -> str:
+        try:
+            return short_path(path, prefer_base=self.settings.source_dir)
+        except Exception:
+            return path
+
+    def get_files_in_directory(self, find_dir: str, base_directory: str) -> dict:
+        """
+        Recursively gets all files in the source directory
+        :param find_dir:        The directory to get files from
+        :param base_directory:  The base directory to get the relative path
+        :return:                dict of files in the directory
+        """
+        dir_files = {}
+        for filename in os.listdir(find_dir):
+            full_path = os.path.join(find_dir, filename)
+            if os.path.isfile(full_path):
+                entry = self._file_entry(full_path, base_directory)
+                if entry is not None:
+                    dir_files.setdefault(find_dir, []).append(entry)
+            elif os.path.isdir(full_path):
+                dir_files.update(self.get_files_in_directory(full_path, base_directory))
+
+        return dir_files
+
+    def _file_entry(self, full_path: str, base_directory: str) -> Optional[dict]:
+        filename = os.path.basename(full_path)
+        if filename in PROTECTED_FILES:
+            self.log.warning("upload", f"Skipping file {filename} because it's a protected file.")
+            return None
+        if any(fnmatch.fnmatch(filename, exclusion) for exclusion in self.settings.ignored_files):
+            self.log.warning("upload", f"Skipping file {filename} because it's in the ignore list.")
+            return None
+        return {"name": filename, "path": os.path.abspath(full_path),
+                "relative_path": os.path.relpath(full_path, base_directory),
+                "sizebytes": os.path.getsize(full_path), "encrypted": False, "encrypterror": False,
+                "md5mismatch": False}
+
+    def scan(self, paths: list) -> dict:
+        """
+        Collects the files to upload. Directories are scanned recursively and their files keep their path relative
+        to the directory; single files are uploaded to the root of the remote directory.
+        :param paths: list of files and directories.
+        :return: dict of the files to upload, grouped by directory.
+        """
+        files = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                for directory, entries in self.get_files_in_directory(path, path).items():
+                    files.setdefault(directory, []).extend(entries)
+            elif os.path.isfile(path):
+                entry = self._file_entry(path, os.path.dirname(path))
+                if entry is not None:
+                    files.setdefault(os.path.dirname(path), []).append(entry)
+            else:
+                self.log.error("upload", f"Path {path} does not exist. Skipping path...")
+        return files
+
+    def _check_encryption(self) -> bool:
+        from modules.compression import Compression, CompressionSettingException
+        from modules.encryption import Encryption
+
+        try:
+            compression = Compression.from_settings(self.settings.compression)
+        except CompressionSettingException as e:
+            self.log.error("compress", e.message)
+            return False
+        keypath = self.settings.encryption_key
+        try:
+            key_type = Encryption().get_key_type(keypath)
+            self.log.debug("encrypt", f"Formatting files using key type: {key_type}")
+        except Exception as e:
+            self.log.error("encrypt", f"Encryption key {keypath} is invalid.")
+            self.log.error("encrypt", f"More information about this error: {e}")
+            return False
+        if compression.enabled:
+            self.log.debug("compress", f"Compressing files with {compression.algorithm} level {compression.level} "
+                                       f"before the encryption.")
+            self._compression = compression
+        return True
+
+    def encryption_ready(self) -> bool:
+        """
+        Checks the encryption key and the compression settings, once per uploader
+        :return: True if the files can be encrypted.
+        """
+        with self._encryption_lock:
+            if self._encryption_ready is None:
+                self._encryption_ready = self._check_encryption()
+            return self._encryption_ready
+
+    def encrypt_file(self, file: dict) -> bool:
+        """
+        Encrypts a file into its directory in the temp directory
+        :param file: The file entry, marked as encrypted.
+        :return: True if the file was encrypted.
+        """
+        from modules.encryption import Encryption, FileEncryptedException
+
+        if not self.encryption_ready():
+            file['encrypterror'] = True
+            return False
+        encrypt = Encryption(self.settings.encryption_buffer or None, self._compression, self._scratch(file))
+        source = os.path.basename(file['path'])
+        self.log.info("encrypt", f"Encrypting file {source}...")
+        started = time.monotonic()
+        try:
+            with self.tracer.span("encrypt file", "encrypt", file=source):
+                encrypt.encrypt_file(self.settings.encryption_key, file['path'])
+            self.log.success("encrypt", f"File {file['name']} encrypted successfully.")
+        except FileEncryptedException:
+            self.log.warning("encrypt", f"File {file['name']} is already encrypted.")
+        except Exception as e:
+            self.log.error("encrypt", f"File {source} encryption failed.")
+            self.log.error("encrypt", f"More information about this error: {e}")
+            file['encrypterror'] = True
+            return False
+        finally:
+            self.metrics.stage_seconds.observe(time.monotonic() - started, stage="encrypt")
+        file['sizebytes'] = os.path.getsize(self.local_path(file))
+        return True
+
+    def _temp_need(self, file: dict, parts: bool) -> int:
+        """
+        Estimates the temp space a file takes while it is uploaded
+        :return: Size in bytes of its encrypted copy, if it isn't written yet, and of the part being uploaded.
+        """
+        size, need = file['sizebytes'], 0
+        if file.get('snapshot') and not os.path.exists(file['snapshot']):
+            need = size
+        elif file['encrypted'] and not os.path.exists(self.local_path(file)):
+            from modules.encryption import Encryption
+
+            try:
+                # A compressed file takes at most its uncompressed size
+                size = Encryption.encrypted_size(self.settings.encryption_key, file['path'], size) or size
+            except (OSError, ValueError):
+                pass
+            need = size
+        if parts and size >= SPLIT_THRESHOLD:
+            need += CHUNK_SIZE
+        return need
+
+    def _snapshot(self, file: dict, block: bool) -> Optional[bool]:
+        """
+        Waits for a file to stop changing, decides if it is copied before its upload and records its state
+        :return: True if the file can be uploaded, False if it is still being written and can't be copied, None if
+        it isn't stable and block is False.
+        """
+        if file.get('packed') or 'state' in file:
+            # The members of a bundle are read when it is packed
+            return True
+        try:
+            stable = self.snapshot.wait_stable(file, block)
+            if stable is None:
+                return None
+            copy = not file['encrypted'] and (self.snapshot.wants_copy(file) or
+                                              (not stable and self.snapshot.copy != "never"))
+            if not stable and not copy and not file['encrypted']:
+                self.log.error("snapshot", f"File {file['name']} is still being written after "
+                                           f"{self.snapshot.max_wait:g}s. Skipping file...")
+                return False
+            if copy:
+                file['snapshot'] = os.path.join(self._scratch(file), file['name'])
+            self.snapshot.capture(file)
+        except OSError as e:
+            self.log.error("snapshot", f"File {self._display(file['path'])} could not be read: {e}")
+            return False
+        return True
+
+    def _copy_snapshot(self, file: dict) -> bool:
+        # The upload reads the copy, so the source can keep changing
+        try:
+            cloned = clone_file(file['path'], file['snapshot'])
+        except OSError as e:
+            self.log.error("snapshot", f"File {file['name']} could not be copied to the temp directory: {e}")
+            return False
+        self.log.debug("snapshot", f"File {file['name']} {'cloned' if cloned else 'copied'} to the temp directory.")
+        return True
+
+    def _unchanged(self, file: dict) -> bool:
+        """
+        Checks that a file uploaded from its source wasn't modified since it was prepared
+        :param file: The file entry.
+        :return: False if the file changed, so it must not be created on the cloud.
+        """
+        if not self.snapshot.check or self.local_path(file) != file['path']:
+            # A copy doesn't change
+            return True
+        reason = self.snapshot.changed(file)
+        if reason is None:
+            return True
+        self.log.error("snapshot", f"File {file['name']} changed while it was uploaded ({reason}). It is not created "
+                                   f"on the cloud. Skipping file...")
+        return False
+
+    def prepare(self, file: dict, parts: bool = True, block: bool = True) -> Optional[bool]:
+        """
+        Waits for a file to stop changing, reserves its temp space and copies or encrypts it if needed, right before
+        it is uploaded. The space is released with the temp space of the file once it is done.
+        :param file: The file entry.
+        :param parts: True if the parts of a split file are written to the temp directory.
+        :param block: If False, returns None instead of waiting for the file or for temp space.
+        :return: True if the file is ready to upload, False if it can't be read, copied or encrypted, None if it has
+        to wait.
+        """
+        key = file['path']
+        ready = self._snapshot(file, block)
+        if not ready:
+            return ready
+        need = self._temp_need(file, parts)
+        if need and not self.temp.reserve(key, need, file['name'], block):
+            return None
+        local_path = self.local_path(file)
+        if local_path == file['path'] or os.path.exists(local_path):
+            return True
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        self.temp.track(key, local_path)
+        if file.get('snapshot'):
+            if not self.snapshot.consistent(file, lambda: self._copy_snapshot(file), "copied"):
+                return False
+        elif not self.snapshot.consistent(file, lambda: self.encrypt_file(file), "encrypted"):
+            return False
+        if file.get('packed'):
+            # Only the encrypted copy of a bundle is uploaded
+            self.temp.remove(key, file['path'])
+        self.temp.resize(key, file['sizebytes'] + (CHUNK_SIZE if parts and file['sizebytes'] >= SPLIT_THRESHOLD
+                                                   else 0))
+        return True
+
+    def _on_cloud(self, remote_files: list) -> Callable[[str], bool]:
+        """
+        Returns a function telling if a file exists on the cloud, for the packing
+        :param remote_files: Files in the remote directory.
+        :return: Function taking a path relative to the remote directory, without the .enc of encrypted uploads.
+        """
+        paths = {"/" + entry["path"].replace("\\", "/").strip("/") for entry in remote_files}
+        root = "/" + self.settings.remote_dir.replace("\\", "/").strip("/")
+        suffix = ".enc" if self.settings.encryption_enabled else ""
+        return lambda relative: f"{root}/{relative}{suffix}".replace("//", "/") in paths
+
+    def fetch_remote_files(self) -> Optional[list]:
+        """
+        Returns all the files in the remote directory
+        :return: list of files in the remote directory, empty if it doesn't exist. If the listing failed, the last
+        listing in the cache, or None if there is none.
+        """
+        try:
+            files = self.client.list_directory(self.settings.remote_dir)
+        except TransferError as e:
+            if e.code in MISSING_DIR_ERRNOS:
+                self.log.error("remote fetch", "Couldn't fetch remote directory. Check if the remote directory "
+                                               "exists.")
+                return []
+            if e.code == -6:
+                self.log.error("remote fetch", "Couldn't fetch remote directory. Check if all the cookies are valid.")
+            else:
+                self.log.error("remote fetch", f"API error: {e}")
+            # Without the listing every file would be uploaded again
+            return self.client.fallback_listing(self.settings.remote_dir)
+        # Kept for the plan command, which can't list the remote directory
+        self.client.remember_listing(self.settings.remote_dir, files)
+        return files
+
+    def _hash(self, file: dict, path: str, size: int) -> list:
+        """
+        Calculates the MD5 hashes of the parts of a file, and with integrity enabled the SHA-256 hashes of its blocks
+        in the same read, kept in the file entry for the manifest
+        :param file: The file entry.
+        :param path: Path of the file that is uploaded.
+        :param size: Size of the file in bytes.
+        :return: list of MD5 hex digests, one per part.
+        """
+        if not self.integrity.enabled:
+            return block_md5s(path, size, CHUNK_SIZE, SPLIT_THRESHOLD)
+        md5s, file['sha256'] = block_digests(path, size, CHUNK_SIZE, SPLIT_THRESHOLD, self.integrity.block_size)
+        file['md5s'] = md5s
+        return md5s
+
+    def _record_integrity(self, file: dict, size: int) -> None:
+        """
+        Adds an uploaded file to the integrity manifest of the run
+        :param file: The file entry.
+        :param size: Size of the uploaded file in bytes.
+        :return:
+        """
+        if self.integrity.enabled and 'sha256' in file:
+            self.integrity.add(f"{self.settings.remote_dir}/{self.cloud_relative(file)}", size, file['sha256'],
+                               file['md5s'], file['encrypted'])
+
+    def _save_integrity(self) -> None:
+        """
+        Saves the integrity manifest of the files uploaded by the run, and uploads it if enabled
+        :return:
+        """
+        count = len(self.integrity.files)
+        try:
+            path = self.integrity.save(self.settings.remote_dir)
+        except OSError as e:
+            self.log.error("integrity", f"The integrity manifest could not be saved: {e}")
+            return
+        if path is None:
+            return
+        self.log.success("integrity", f"Integrity manifest of {count} files saved to {self._display(path)}.")
+        if not self.integrity.upload:
+            return
+        try:
+            remote_path = self.integrity.upload_manifest(self.client, path, self.settings.remote_dir)
+        except (TransferError, OSError) as e:
+            self.log.error("integrity", f"The integrity manifest could not be uploaded: {e}")
+            return
+        self.log.success("integrity", f"Integrity manifest uploaded to {remote_path}.")
+
+    def _scratch(self, file: dict) -> str:
+        # Own directory of the temp files of a file, as files of different directories can have the same name
+        if 'scratch' not in file:
+            file['scratch'] = os.path.abspath(os.path.join(self.temp_dir, f"{next(_SCRATCH_IDS):06d}"))
+        return file['scratch']
+
+    def local_path(self, file: dict) -> str:
+        """
+        Returns the local file that is uploaded for a file entry
+        :param file: The file entry.
+        :return: Absolute path of the source file, of its snapshot copy or of its encrypted copy.
+        """
+        if file.get('snapshot'):
+            return file['snapshot']
+        if file['encrypted']:
+            return os.path.join(self._scratch(file), file['name'])
+        return file['path']
+
+    def _write_part(self, file: dict, source: str, index: int, path: str) -> None:
+        # Only the part being uploaded is in the temp directory
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.temp.track(file['path'], path)
+        with open(source, 'rb') as f, open(path, 'wb') as part:
+            f.seek(index * CHUNK_SIZE)
+            remaining = CHUNK_SIZE
+            while remaining > 0:
+                data = f.read(min(READ_BLOCK, remaining))
+                if not data:
+                    break
+                part.write(data)
+                remaining -= len(data)
+
+    @staticmethod
+    def source_paths(file: dict) -> list:
+        """
+        Returns the local files an entry stands for in the upload result
+        :param file: The file entry.
+        :return: The source files of a bundle, or the path of the file.
+        """
+        return [member['path'] for member in file['members']] if file.get('members') else [file['path']]
+
+    @staticmethod
+    def cloud_relative(file: dict) -> str:
+        """
+        Returns the path of a file relative to the remote directory
+        :param file: The file entry.
+        :return: Forward-slash relative cloud path, with .enc appended for encrypted files.
+        """
+        return file['relative_path'].replace('\\', '/') + ('.enc' if file['encrypted'] else '')
+
+    def post_upload_actions(self, file: dict) -> bool:
+        """
+        Records the move or the delete of the source file after it was uploaded, according to the settings. The
+        actions run in batches from the journal, and the files whose action fails are reported as failed at the end
+        of the run.
+        :param file: The file entry.
+        :return: True if the action was recorded.
+        """
+        if file.get('packed'):
+            # The source files of a bundle, not the bundle in the temp directory
+            return all([self.post_upload_actions(member) for member in file['members']])
+
+        moved = self.settings.move_files or self.settings.delete_source
+        reason = self.snapshot.changed(file) if moved and self.snapshot.check else None
+        if reason is not None:
+            # The upload is the state of the file when it was copied, so the newer content must be kept
+            self.log.warning("snapshot", f"File {file['name']} changed after it was read for the upload ({reason}). "
+                                         f"It is left in place.")
+            return True
+        try:
+            if self.settings.move_files:
+                # The file keeps its path relative to the scanned directory
+                target = os.path.abspath(os.path.join(self.settings.uploaded_dir, file['relative_path']))
+                self.journal.add("move", file['path'], target)
+            elif self.settings.delete_source:
+                self.journal.add("delete", file['path'])
+        except OSError as e:
+            self.log.error("journal", f"The move or delete of file {self._display(file['path'])} could not be "
+                                      f"recorded.")
+            self.log.error("journal", f"More information about this error: {e}")
+            return False
+        return True
+
+    def process_file(self, file: dict, remote_files: list, between_parts: Optional[Callable] = None) -> str:
+        """
+        Uploads a single file
+        :param file: The file entry.
+        :param remote_files: Files that already exist in the remote directory.
+        :param between_parts: Callable run with the file entry between two parts of a split file.
+        :return: "uploaded", "skipped" or "failed".
+        """
+        remote_dir = self.settings.remote_dir
+        # Safe, forward-slash relative path for logging and cloud comparisons
+        rel_disp = file['relative_path'].replace('\\', '/')
+        cloud_relative = self.cloud_relative(file)
+
+        # Skip if file already exists remotely (compare using the cloud-relative name)
+        for remote_file in remote_files:
+            if remote_file.get("path", "").endswith(cloud_relative):
+                self.log.warning("upload", f"File {file['name']} (OS path: {self._display(file['path'])}) already "
+                                           f"exists on the cloud. Skipping file...")
+                # The source files of a bundle are moved or deleted like after its upload
+                if file.get('packed') and not self.post_upload_actions(file):
+                    return "failed"
+                return "skipped"
+
+        if not self.prepare(file):
+            return "failed"
+        if file['encrypted']:
+            self.log.debug("file", f"File {rel_disp} is encrypted. Using source directory as "
+                                   f"{os.path.dirname(self.local_path(file))}.")
+        else:
+            self.log.debug("file", f"File {rel_disp} is not encrypted. Using source directory as "
+                                   f"{os.path.dirname(file['path'])}.")
+
+        self.log.info("upload", f"Uploading {rel_disp}...")
+
+        # Quota check
+        if self.settings.show_quota:
+            try:
+                aviquot = self.quota.available()
+            except TransferError as e:
+                self.log.error("quota", f"Could not check the available quota: {e}")
+                return "failed"
+            self.log.debug("quota", f"Available quota: {convert_size(aviquot)}")
+            if aviquot < file['sizebytes']:
+                self.log.error("quota", f"Not enough quota available for file {file['name']}.")
+                return "failed"
+            self.log.debug("quota", f"Available quota after the upload: {convert_size(aviquot - file['sizebytes'])}")
+
+        # Resolve local file path
+        local_file_path = self.local_path(file)
+        if not os.path.exists(local_file_path):
+            self.log.error("upload", f"File {self._display(local_file_path)} does not exist on the source directory "
+                                     f"anymore. Skipping file...")
+            return "failed"
+
+        # Size limits
+        try:
+            max_size = self.client.max_file_size()
+        except TransferError as e:
+            self.log.error("vip", f"Could not check the account type: {e}")
+            return "failed"
+        if file['sizebytes'] >= max_size:
+            self.log.error("upload", f"File {file['name']} is too big for the type of account you have. "
+                                     f"Skipping file...")
+            self.log.error("upload", f"File size: {convert_size(file['sizebytes'])}")
+            self.log.error("upload", f"Maximum file size for your account: "
+                                     f"{'20GB' if self.client.is_vip() else '4GB'}")
+            return "failed"
+
+        # Build upload pieces and MD5 list
+        key = file['path']
+        self.progress.stage(key, "hash")
+        pieces = []
+        md5dict = []
+        if file['sizebytes'] >= SPLIT_THRESHOLD:
+            self.log.info("split", "File size is greater than 2GB. Splitting original file in chunks...")
+            size = file['sizebytes']
+            num_chunks = part_count(size, CHUNK_SIZE, SPLIT_THRESHOLD)
+            self.log.debug("split", f"File will be split in {num_chunks} chunks.")
+            # Each chunk is written to the temp directory right before its upload and deleted after it
+            md5dict = self._hash(file, local_file_path, size)
+            pieces = [os.path.join(self._scratch(file), f"{file['name']}.part{i:03d}") for i in range(num_chunks)]
+            self.log.success("split", f"MD5 hashes calculated for the {len(pieces)} pieces of the file.")
+        else:
+            md5dict = self._hash(file, local_file_path, file['sizebytes'])
+            self.log.info("md5", f"MD5 hash calculated for file {rel_disp}.")
+            pieces.append(local_file_path)
+        md5json = json.dumps(md5dict)
+        if not self._unchanged(file):
+            return "failed"
+
+        # Precreate on cloud
+        self.progress.stage(key, "precreate")
+        self.log.info("precreate", f"Precreating cloud file {rel_disp}...")
+        remote_path = f"{remote_dir}/{cloud_relative}"
+        try:
+            uploadid = self.client.precreate(remote_path, remote_dir, md5json)
+        except TransferError as exp_precreate:
+            self.log.error("precreate", "File precreate failed.")
+            if RetryPolicy.decide(exp_precreate) == "auth":
+                self.log.error("precreate",
+                               "The login session has expired. Please login again and refresh the credentials.")
+            else:
+                self.log.error("precreate", f"ERROR: More information about this error: {exp_precreate}")
+            return "failed"
+        cloudpath = (os.path.join(remote_dir, cloud_relative)).replace('\\', '/')
+
+        # Upload
+        self.progress.stage(key, "upload")
+        for idx, piece in enumerate(pieces):
+            if piece != local_file_path:
+                try:
+                    self._write_part(file, local_file_path, idx, piece)
+                except OSError as e:
+                    self.log.error("split", f"Piece {idx + 1} of file {rel_disp} could not be written: {e}")
+                    return "failed"
+            self.progress.start_transfer(key, idx, rel_disp if len(pieces) == 1 else
+                                         f"{rel_disp} part {idx + 1}/{len(pieces)}", os.path.getsize(piece))
+            try:
+                self.client.upload_part(piece, remote_path, uploadid, md5dict[idx], idx,
+                                        on_progress=self.progress.callback(key, idx))
+            except TransferError as exp_upload:
+                self.progress.end_transfer(key, idx, False)
+                if exp_upload.kind == "md5":
+                    file['md5mismatch'] = True
+                    self.log.error("md5", f"MD5 hash mismatch for cloud file {cloud_relative} after upload. "
+                                          f"Skipping file...")
+                else:
+                    self.log.error("upload", "File upload request failed.")
+                    self.log.error("upload", f"More information about this error: {exp_upload}")
+                return "failed"
+            self.progress.end_transfer(key, idx, True)
+            self.log.success("upload", f"File {self._display(piece)} uploaded successfully to cloud path "
+                                       f"{remote_path}.")
+            if piece != local_file_path:
+                self.temp.remove(key, piece)
+            self.log.info("md5", f"MD5 hash match for cloud file {cloud_relative} after upload.")
+            if between_parts is not None and idx < len(pieces) - 1:
+                between_parts(file)
+
+        # Create the file on the cloud
+        if not self._unchanged(file):
+            return "failed"
+        self.progress.stage(key, "create")
+        self.log.info("upload", f"Finalizing file {rel_disp} upload...")
+        try:
+            self.client.create(str(cloudpath), remote_dir, uploadid, file['sizebytes'], md5json)
+        except TransferError as e:
+            self.log.error("upload", f"File {file['name']} upload failed.")
+            self.log.error("upload", f"More information: {e}")
+            return "failed"
+        self.quota.consume(file['sizebytes'])
+        self._record_integrity(file, file['sizebytes'])
+        self.log.success("upload", f"File {self._display(local_file_path)} uploaded and saved on cloud successfully.")
+        self.log.success("upload", f"The file is now available at {cloudpath} in the cloud.")
+
+        # Move/delete
+        self.progress.stage(key, "post")
+        if not self.post_upload_actions(file):
+            return "failed"
+
+        # Conclude per-file procedure
+        self.log.success("upload", f"File {self._display(local_file_path)} concluded every upload procedure.")
+        return "uploaded"
+
+    def _flush_journal(self, result: UploadResult) -> None:
+        """
+        Runs the moves and deletes left in the journal, and reports the files whose action failed as failed
+        """
+        try:
+            self.journal.flush()
+        except OSError as e:
+            self.log.error("journal", f"The journal {self.journal.path} could not be written: {e}")
+        failed, self.journal.failed = self.journal.failed, []
+        for path in failed:
+            if path in result.uploaded:
+                result.uploaded.remove(path)
+                result.add("failed", path)
+
+    def _upload_sync(self, entries: list, result: UploadResult, remote_files: Optional[list] = None) -> None:
+        """
+        Uploads the files one at a time. With preemption, a large file pauses between two parts to upload the small
+        queued files that are more urgent.
+        :param remote_files: Files in the remote directory, if it was already listed.
+        """
+        if remote_files is None:
+            with self.tracer.span("remote fetch"):
+                remote_files = self.fetch_remote_files()
+        if remote_files is None:
+            for file in entries:
+                self.progress.finish(file['path'], "failed", file['sizebytes'])
+                for path in self.source_paths(file):
+                    result.add("failed", path)
+            return
+        pending = list(entries)
+
+        def upload(file: dict, between_parts: Optional[Callable] = None) -> None:
+            try:
+                status = self.process_file(file, remote_files, between_parts)
+            finally:
+                self.temp.release(file['path'])
+            self.progress.finish(file['path'], "mismatch" if file['md5mismatch'] else status, file['sizebytes'])
+            for path in self.source_paths(file):
+                result.add(status, path)
+
+        def yield_slot(running: dict) -> None:
+            for waiting in [file for file in pending if self.scheduler.preempts(file, running)]:
+                # The paused file holds its temp space, so a file that would have to wait for it stays queued
+                if self.prepare(waiting, block=False) is None:
+                    continue
+                pending.remove(waiting)
+                self.log.info("schedule", f"Pausing {running['name']} to upload the more urgent file "
+                                          f"{waiting['name']}.")
+                upload(waiting)
+
+        with self.tracer.span("upload", engine="sync"):
+            while pending:
+                file = pending.pop(0)
+                if pending and not file.get('deferred') and self.snapshot.unstable(file['path']):
+                    # Uploading the other files first gives the file time to stop changing
+                    file['deferred'] = True
+                    self.log.info("snapshot", f"File {file['name']} is still being written. Uploading it later...")
+                    pending.append(file)
+                    continue
+                upload(file, yield_slot if self.scheduler.preempt else None)
+
+    def _upload_async(self, entries: list, result: UploadResult, remote_files: Optional[list] = None) -> None:
+        import asyncio
+        from modules.asyncengine import AsyncUploadEngine
+
+        try:
+            max_file_size = self.client.max_file_size()
+        except TransferError as e:
+            self.log.error("vip", f"Could not check the account type: {e}")
+            for file in entries:
+                for path in self.source_paths(file):
+                    result.add("failed", path)
+            return
+        engine = AsyncUploadEngine(
+            self.client, self.settings.remote_dir,
+            concurrency=int(self.settings.upload.get("concurrency", "16")),
+            max_file_size=max_file_size,
+            quota=self.quota if self.settings.show_quota else None,
+            chunk_size=CHUNK_SIZE,
+            split_threshold=SPLIT_THRESHOLD,
+            progress=self.progress,
+            log=self.log,
+            scheduler=self.scheduler,
+            hasher=lambda item, size: self._hash(item["file"], item["local_path"], size),
+            unchanged=lambda item: self._unchanged(item["file"]),
+        )
+        items = [{"file": file, "local_path": self.local_path(file), "cloud_relative": self.cloud_relative(file)}
+                 for file in entries]
+
+        def prepare(item: dict) -> bool:
+            ready = bool(self.prepare(item["file"], parts=False))
+            # The file is uploaded from its snapshot copy if it was made
+            item["local_path"] = self.local_path(item["file"])
+            return ready
+
+        def uploaded(item: dict) -> bool:
+            self._record_integrity(item["file"], os.path.getsize(item["local_path"]))
+            return self.post_upload_actions(item["file"])
+
+        statuses = asyncio.run(engine.run(items, uploaded,
+                                          prepare=prepare, listing=remote_files,
+                                          finished=lambda item: self.temp.release(item["file"]["path"])))
+        for file, status in zip(entries, statuses):
+            if status == "skipped" and file.get('packed') and not self.post_upload_actions(file):
+                status = "failed"
+            for path in self.source_paths(file):
+                result.add(status, path)
+
+    def _upload_spread(self, entries: list, result: UploadResult) -> None:
+        """
+        Uploads the files with every account of the pool, one worker per account. An account that fails to
+        authenticate is taken out and its file is uploaded by another account.
+        """
+        pool = self.accounts
+        uploaders = {account.name: Uploader(account.client, self.settings, self.temp_dir, self.log, self.progress,
+                                            self.packer, account.quota, shared=True, temp=self.temp)
+                     for account in pool.accounts}
+        for uploader in uploaders.values():
+            uploader.journal = self.journal
+            uploader.integrity = self.integrity
+
+        def listing(account) -> list:
+            try:
+                files = uploaders[account.name].fetch_remote_files()
+            except CircuitOpenException as e:
+                pool.mark_down(account, str(e))
+                return []
+            if files is None:
+                pool.mark_down(account, "its remote directory couldn't be listed")
+                return []
+            return files
+
+        # A file uploaded by any of the accounts already exists on the cloud
+        with ThreadPoolExecutor(len(pool)) as executor:
+            remote_files = [entry for entries in executor.map(listing, pool.healthy) for entry in entries]
+        # Without a scheduling policy the largest files go first, so the smaller ones fill the quota that is left
+        if self.scheduler.policies == ("fifo",):
+            pending = sorted(entries, key=lambda entry: entry['sizebytes'], reverse=True)
+        else:
+            pending = list(entries)
+
+        def work(account) -> None:
+            uploader = uploaders[account.name]
+            while not account.down:
+                file = pool.take(account, pending)
+                if file is None:
+                    return
+                started = time.monotonic()
+                reason = "authentication error"
+                try:
+                    status = uploader.process_file(file, remote_files)
+                except CircuitOpenException as e:
+                    status, reason = None, str(e)
+                finally:
+                    self.temp.release(file['path'])
+                # The breaker counts the authentication errors since the last successful request
+                if status is None or (status == "failed" and account.client.retry.breaker.failures):
+                    pool.mark_down(account, reason)
+                    pool.put_back(file, pending)
+                    return
+                if status == "uploaded":
+                    pool.record(account, file['sizebytes'], time.monotonic() - started)
+                    pool.manifest.record(account.name, self.source_paths(file),
+                                         f"{self.settings.remote_dir}/{self.cloud_relative(file)}", file['sizebytes'])
+                self.progress.finish(file['path'], "mismatch" if file['md5mismatch'] else status, file['sizebytes'])
+                for path in self.source_paths(file):
+                    result.add(status, path)
+
+        # The files an account gives back are taken in the next round by the accounts that are left
+        with self.client.throttle.parallel(len(pool)):
+            while pending and pool.healthy:
+                state = (len(pending), len(pool.healthy))
+                with ThreadPoolExecutor(len(pool.healthy)) as executor:
+                    list(executor.map(work, pool.healthy))
+                if (len(pending), len(pool.healthy)) == state:
+                    break
+        reason = "no account has enough quota left" if pool.healthy else "every account stopped uploading"
+        for file in pending:
+            self.log.error("accounts", f"File {file['name']} could not be uploaded: {reason}.")
+            self.progress.finish(file['path'], "failed", file['sizebytes'])
+            for path in self.source_paths(file):
+                result.add("failed", path)
+        pool.log_summary()
+
+    def upload_paths(self, paths: list) -> UploadResult:
+        """
+        Uploads files and directories to the remote directory of the settings
+        :param paths: list of local files and directories.
+        :return: UploadResult with the outcome of every file.
+        """
+        with self.tracer.span("temp"):
+            self.temp.open()
+        try:
+            return self._upload_paths(paths)
+        finally:
+            self.temp.close()
+
+    def _upload_paths(self, paths: list) -> UploadResult:
+        result = UploadResult()
+        run_started = time.time()
+
+        # Moves and deletes of a previous run that stopped before running them
+        try:
+            self.journal.replay()
+        except OSError as e:
+            self.log.error("journal", f"The journals of {self.journal.base} could not be replayed: {e}")
+
+        self.log.info("upload", f"Checking files in {', '.join(self._display(path) for path in paths)}...")
+        started = time.monotonic()
+        with self.tracer.span("scan"):
+            files = self.scan(paths)
+        self.metrics.stage_seconds.observe(time.monotonic() - started, stage="scan")
+        if len(files) == 0:
+            self.log.success("upload", "No files to upload.")
+            self.metrics.record_run(run_started, True)
+            return result
+
+        remote_files = None
+        if self.packer.enabled:
+            if self.accounts is None or len(self.accounts) <= 1:
+                # The bundles already on the cloud aren't written again
+                with self.tracer.span("remote fetch"):
+                    remote_files = self.fetch_remote_files()
+            started = time.monotonic()
+            try:
+                with self.tracer.span("pack"):
+                    files = self.packer.pack(files, None if remote_files is None else self._on_cloud(remote_files))
+            except OSError as e:
+                self.log.error("pack", f"The small files could not be packed. Uploading them one by one: {e}")
+            self.metrics.stage_seconds.observe(time.monotonic() - started, stage="pack")
+
+        entries = [file for files_in_directory in files.values() for file in files_in_directory]
+        for bundle in [file for file in entries if file.get('exists')]:
+            entries.remove(bundle)
+            self.log.warning("upload", f"Bundle {bundle['name']} already exists on the cloud. Skipping file...")
+            status = "skipped" if self.post_upload_actions(bundle) else "failed"
+            self.metrics.files.inc(outcome=status)
+            for path in self.source_paths(bundle):
+                result.add(status, path)
+        for file in entries:
+            if file.get('packed'):
+                # Written by the packing before the upload, and deleted once uploaded
+                self.temp.track(file['path'], file['path'], file['sizebytes'])
+        if self.settings.encryption_enabled and not self.encryption_ready():
+            # Files that can't be encrypted must not be uploaded as they are
+            for file in entries:
+                self.metrics.files.inc(outcome="failed")
+                for path in self.source_paths(file):
+                    result.add("failed", path)
+            entries = []
+        elif self.settings.encryption_enabled:
+            # The files are encrypted one at a time right before their upload, not all of them up front
+            for file in entries:
+                file['name'] = f"{file['name']}.enc"
+                file['encrypted'] = True
+
+        if self.scheduler.enabled:
+            entries = self.scheduler.order(entries)
+            self.log.info("schedule", f"Uploading the files by {', '.join(self.scheduler.policies)}"
+                                      f"{' with preemption' if self.scheduler.preempt else ''}.")
+        self.progress.start(len(entries), sum(file['sizebytes'] for file in entries))
+        self.metrics.throughput.set_function(self.progress.rate)
+        dashboard = Dashboard(self.progress, self.log, mode="false" if self.shared else self.settings.progress)
+        dashboard.start()
+        try:
+            if self.accounts is not None and len(self.accounts) > 1:
+                self.log.info("upload", f"Spreading the files over {len(self.accounts)} accounts...")
+                with self.tracer.span("upload", engine="accounts"):
+                    self._upload_spread(entries, result)
+            elif self.settings.upload.get("engine", "sync").lower() == "async":
+                self.log.info("upload", "Uploading files with the asyncio engine...")
+                with self.tracer.span("upload", engine="async"):
+                    self._upload_async(entries, result, remote_files)
+            else:
+                self._upload_sync(entries, result, remote_files)
+        except (CircuitOpenException, CurlNotFoundException) as e:
+            subject = "auth" if isinstance(e, CircuitOpenException) else "curl"
+            self.log.error(subject, str(e))
+            self.log.error(subject, "Stopping the upload of the remaining files.")
+            done = set(result.uploaded + result.skipped + result.failed)
+            for file in entries:
+                if not set(self.source_paths(file)) & done:
+                    self.progress.finish(file['path'], "failed", file['sizebytes'])
+                    for path in self.source_paths(file):
+                        result.add("failed", path)
+        finally:
+            dashboard.stop()
+            self._flush_journal(result)
+            self._save_integrity()
+
+        if not self.shared:
+            log_transfer_summary(self.client, self.log)
+        uploaded = set(result.uploaded)
+        self.client.remember_listing(self.settings.remote_dir,
+                                     [{"path": f"{self.settings.remote_dir}/{self.cloud_relative(file)}",
+                                       "size": file['sizebytes']}
+                                      for file in entries if set(self.source_paths(file)) & uploaded], merge=True)
+
+        self.metrics.record_run(run_started, result.ok)
+        return result
+
+    def run(self) -> UploadResult:
+        """
+        Uploads the source directory of the settings
+        :return: UploadResult with the outcome of every file.
+        """
+        return self.upload_paths([self.settings.source_dir])
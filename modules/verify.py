@@ -0,0 +1,281 @@
+"""
+TeraBox Uploader CLI: verify.py
+This module is used to check that the remote directory matches the local files, without downloading anything.
+The remote tree is listed with parallel requests, the sizes are compared with the local files (or with the size
+their encrypted copy would have), and the MD5 hashes of the blocks of the unencrypted files are compared with the
+block lists returned by batched filemetas requests. Files packed into bundles are checked through their bundle.
+With the blocks option, the files recorded in an integrity manifest are downloaded in parallel block by block and
+their SHA-256 hashes compared with the record, which also checks the encrypted files and the bundles.
+Used in: main.py
+
+This program is provided as-is, without any warranty.
+This program is not affiliated with Terabox in any way.
+This program is licensed under the MIT License.
+
+Developed by Gonçalo M. (@dnigamer in GitHub).
+For more information, please visit https://github.com/dnigamer/TeraboxUploaderCLI
+If you find any bugs, please open an issue in the GitHub repository mentioned in the link above.
+"""
+
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+from modules.client import TeraboxClient
+from modules.config import Settings
+from modules.formatting import Formatting
+from modules.integrity import REMOTE_DIR, corrupted, merkle_root, remote_key
+from modules.packing import INDEX_SUFFIX
+from modules.retry import MISSING_DIR_ERRNOS, TransferError
+from modules.uploader import Uploader, block_md5s
+
+BATCH_SIZE = 100
+# Byte ranges of the corrupted blocks of a file listed in its reason
+SHOWN_RANGES = 5
+
+
+class VerifyReport:
+    """
+    Outcome of a verification.
+    """
+
+    def __init__(self):
+        self.matched = []
+        self.missing = []
+        self.extra = []
+        self.mismatched = []
+        # Files whose size matches but that have no remote checksum to compare with
+        self.unchecked = []
+        # Indexes of the blocks of each file that differ from its integrity record
+        self.corrupted = {}
+
+    @property
+    def ok(self) -> bool:
+        """
+        True if every local file is on the cloud with the same content
+        """
+        return not self.missing and not self.mismatched
+
+    def to_dict(self) -> dict:
+        """
+        Returns the report as a JSON-serializable dict
+        :return: dict with the list of each outcome.
+        """
+        return {"ok": self.ok, "matched": self.matched, "missing": self.missing, "extra": self.extra,
+                "mismatched": [{"path": path, "reason": reason} for path, reason in self.mismatched],
+                "unchecked": self.unchecked, "corrupted": self.corrupted}
+
+
+class Verifier:
+    """
+    Compares local files with the files of the remote directory of the settings.
+    """
+
+    def __init__(self, client: TeraboxClient, settings: Settings, log: Optional[Formatting] = None,
+                 workers: int = 8, batch_size: int = BATCH_SIZE, checksums: bool = True, blocks: bool = False):
+        """
+        :param client: Client of the account the files were uploaded to.
+        :param settings: Program settings.
+        :param log: Formatting object used for logging.
+        :param workers: Amount of parallel listing, filemetas and hashing jobs.
+        :param batch_size: Amount of files per filemetas request.
+        :param checksums: If False, only the sizes are compared.
+        :param blocks: If True, the files with an integrity record are downloaded and their blocks compared with it.
+        """
+        self.client = client
+        self.settings = settings
+        self.log = log or client.log
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.checksums = checksums
+        self.blocks = blocks
+
+    def local_files(self, paths: list) -> dict:
+        """
+        Collects the local files and the state they should have on the cloud
+        :param paths: list of local files and directories.
+        :return: dict of cloud path to a dict with the local "path", the expected "size" (None for a bundle or a
+        compressed file) and "encrypted".
+        """
+        files = {}
+        encrypt = None
+        compression = None
+        if self.settings.encryption_enabled:
+            from modules.compression import Compression
+            from modules.encryption import Encryption
+
+            encrypt = Encryption
+            compression = Compression.from_settings(self.settings.compression)
+        uploader = Uploader(self.client, self.settings, log=self.log)
+        scanned = uploader.scan(paths)
+        packed = set()
+        if uploader.packer.enabled:
+            packer = uploader.packer
+            for members in packer.groups(scanned):
+                # The bundle isn't built again to verify it, so only the presence of the bundle and its index is
+                # checked
+                bundle = packer.bundle_name(members, packer.archive)
+                relative = f"{packer.directory}/{bundle}" if packer.directory else bundle
+                for name in (relative, relative + INDEX_SUFFIX):
+                    cloud_path = remote_key(f"{self.settings.remote_dir}/{name}" + (".enc" if encrypt else ""))
+                    files[cloud_path] = {"path": members[0]['path'], "size": None, "encrypted": encrypt is not None}
+                packed.update(id(file) for file in members)
+        for entries in scanned.values():
+            for file in entries:
+                if id(file) in packed:
+                    continue
+                size = file["sizebytes"]
+                if encrypt is not None:
+                    size = encrypt.encrypted_size(self.settings.encryption_key, file["path"], size,
+                                                  compression if compression.enabled else None)
+                    file["encrypted"] = True
+                cloud_path = remote_key(f"{self.settings.remote_dir}/{Uploader.cloud_relative(file)}")
+                files[cloud_path] = {"path": file["path"], "size": size, "encrypted": file["encrypted"]}
+        return files
+
+    def remote_files(self) -> dict:
+        """
+        Lists every file of the remote directory, listing the subdirectories in parallel
+        :return: dict of cloud path to the entry returned by /api/list.
+        """
+        files = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            root = pool.submit(self.client.list_entries, self.settings.remote_dir)
+            pending = {root}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        entries = future.result()
+                    except TransferError as e:
+                        if future is root and e.kind == "errno" and e.code in MISSING_DIR_ERRNOS:
+                            return files
+                        raise
+                    for entry in entries:
+                        if entry["isdir"] == 1:
+                            pending.add(pool.submit(self.client.list_entries, entry["path"]))
+                        else:
+                            files[remote_key(entry["path"])] = entry
+        return files
+
+    @staticmethod
+    def _remote_blocks(meta: dict) -> Optional[list]:
+        blocks = meta.get("block_list")
+        if isinstance(blocks, str):
+            try:
+                blocks = json.loads(blocks)
+            except json.JSONDecodeError:
+                blocks = None
+        if blocks:
+            return [str(block) for block in blocks]
+        return [meta["md5"]] if meta.get("md5") else None
+
+    def _compare_checksums(self, candidates: dict, report: VerifyReport) -> None:
+        paths = sorted(candidates)
+        batches = [paths[index:index + self.batch_size] for index in range(0, len(paths), self.batch_size)]
+        with ThreadPoolExecutor(self.workers) as pool:
+            # The requests are queued before the hashes, so they don't wait for the disk
+            requests = [pool.submit(self.client.file_metas, batch) for batch in batches]
+            hashes = {path: pool.submit(block_md5s, candidates[path]["path"], candidates[path]["size"])
+                      for path in paths}
+            metas = {}
+            for request in requests:
+                for meta in request.result():
+                    metas[remote_key(meta.get("path", ""))] = meta
+            for path in paths:
+                remote_blocks = self._remote_blocks(metas.get(path, {}))
+                try:
+                    local_blocks = hashes[path].result()
+                except OSError as e:
+                    report.mismatched.append((path, f"could not read the local file: {e}"))
+                    continue
+                if remote_blocks is None:
+                    report.unchecked.append(path)
+                elif [block.lower() for block in remote_blocks] != local_blocks:
+                    report.mismatched.append((path, "block MD5 hashes differ"))
+                else:
+                    report.matched.append(path)
+
+    def _compare_blocks(self, restorer, pool: ThreadPoolExecutor, records: dict, report: VerifyReport) -> None:
+        jobs = [{"path": path} for path in sorted(records)]
+        restorer.download_links(pool, jobs)
+        digests = {}
+        for job in jobs:
+            record = records[job["path"]]
+            if not job["dlink"]:
+                report.mismatched.append((job["path"], "no download link to check its blocks"))
+                continue
+            size, block_size = record["size"], record["blocksize"]
+            digests[job["path"]] = [pool.submit(restorer.block_digest, job["dlink"], start,
+                                                min(start + block_size, size) - 1)
+                                    for start in range(0, size, block_size)]
+        for path, futures in digests.items():
+            record = records[path]
+            try:
+                blocks = [future.result() for future in futures] or [hashlib.sha256(b"").hexdigest()]
+            except TransferError as e:
+                report.mismatched.append((path, f"its blocks could not be downloaded: {e}"))
+                continue
+            if merkle_root(blocks) == record["root"]:
+                report.matched.append(path)
+                continue
+            bad = corrupted(record["blocks"], blocks)
+            report.corrupted[path] = bad
+            block_size = record["blocksize"]
+            ranges = ", ".join(f"{index * block_size}-{min((index + 1) * block_size, record['size']) - 1}"
+                               for index in bad[:SHOWN_RANGES])
+            report.mismatched.append((path, f"{len(bad)} of {len(blocks)} blocks differ from the integrity manifest "
+                                            f"(bytes {ranges}{', ...' if len(bad) > SHOWN_RANGES else ''})"))
+
+    def verify(self, paths: Optional[list] = None) -> VerifyReport:
+        """
+        Compares the local files with the remote directory
+        :param paths: list of local files and directories. Defaults to the source directory of the settings.
+        :return: VerifyReport with the outcome of every file.
+        """
+        report = VerifyReport()
+        self.log.info("verify", f"Listing the remote directory {self.settings.remote_dir}...")
+        remote = self.remote_files()
+        self.log.info("verify", "Checking the local files...")
+        local = self.local_files(paths or [self.settings.source_dir])
+
+        manifest_dir = remote_key(f"{self.settings.remote_dir}/{REMOTE_DIR}") + "/"
+        manifests = [{"path": path, "size": int(entry.get("size", 0))} for path, entry in remote.items()
+                     if path.startswith(manifest_dir)]
+        candidates = {}
+        for path, file in local.items():
+            entry = remote.get(path)
+            if entry is None:
+                report.missing.append(path)
+            elif file["size"] is not None and int(entry.get("size", -1)) != file["size"]:
+                report.mismatched.append((path, f"size is {entry.get('size')} bytes on the cloud instead of "
+                                                f"{file['size']} bytes"))
+            elif self.checksums and not file["encrypted"] and file["size"] is not None:
+                candidates[path] = file
+            else:
+                # Encrypted copies use a random IV, so only their size can be compared
+                report.matched.append(path)
+        report.extra = sorted(set(remote) - set(local) - {manifest["path"] for manifest in manifests})
+
+        if self.blocks:
+            from modules.restore import Restorer
+
+            restorer = Restorer(self.client, self.settings, self.log, self.workers)
+            restorer.manifests = manifests
+            with ThreadPoolExecutor(self.workers) as pool:
+                known = restorer.integrity_records(pool)
+                # A record of another size is from an older upload of the file
+                records = {path: known[path] for path in report.matched + list(candidates)
+                           if path in known and known[path]["size"] == int(remote[path].get("size", -1))}
+                report.matched = [path for path in report.matched if path not in records]
+                candidates = {path: file for path, file in candidates.items() if path not in records}
+                if records:
+                    self.log.info("verify", f"Comparing the blocks of {len(records)} files with their integrity "
+                                            f"manifests...")
+                    self._compare_blocks(restorer, pool, records, report)
+
+        if candidates:
+            self.log.info("verify", f"Comparing the block MD5 hashes of {len(candidates)} files...")
+            self._compare_checksums(candidates, report)
+        return report